@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+compares identifying face codes one request per code (base64 json) with the batch endpoint (binary float32) against
+a facerec server (facerec.server.FacerecServer) on a temporary database.
+
+    python benchmarks/bench_client_protocol.py [--persons 1000] [--codes 200] [--batch-size 50]
+"""
+
+import argparse
+import base64
+import json
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from facerec import facedb, protocol
+from facerec.client import FacerecApi
+from facerec.server import FacerecServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--persons', type=int, default=1000)
+    parser.add_argument('--codes', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    gallery = rng.randn(args.persons, 128) * 0.1
+    queries = gallery[rng.randint(0, args.persons, args.codes)] + rng.randn(args.codes, 128) * 0.01
+
+    with tempfile.TemporaryDirectory() as tmp:
+        facedb.set_db_path(tmp)
+        session = facedb.assert_session()
+        session.add_all([facedb.Person(name='person {}'.format(i), code=code) for i, code in enumerate(gallery)])
+        session.commit()
+        facedb.Session.remove()
+
+        server = FacerecServer('localhost', args.port, processes=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        api = FacerecApi(server.url)
+        try:
+            api.faces()  # warm up the connection
+
+            batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+            # request bodies as sent by the client
+            nbytes = {'single json': sum(len(json.dumps({'code': base64.b64encode(code.tobytes()).decode('ascii')}))
+                                         for code in queries),
+                      'batch binary': sum(len(protocol.encode_facecodes(batch)) for batch in batches)}
+            results = {}
+            for name, run in (('single json', lambda: [api.identify_facecode(code) for code in queries]),
+                              ('batch binary', lambda: sum([api.identify_facecodes(batch) for batch in batches], []))):
+                start = time.perf_counter()
+                persons = run()
+                elapsed = time.perf_counter() - start
+                results[name] = [p['id'] for p in persons]
+                print("{:>13}: {:8.1f} codes/s  {:7.1f} bytes/code sent".format(
+                    name, len(queries) / elapsed, nbytes[name] / len(queries)))
+            assert results['single json'] == results['batch binary']
+        finally:
+            api.close()
+            server.shutdown()
+            server.server_close()
+            facedb.close()
+
+
+if __name__ == '__main__':
+    main()
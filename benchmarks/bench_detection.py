@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+compares the detection modes of dlib_api (upsampling, downscaled coarse to fine detection and a region of interest)
+in recall against speed. The faces found with the default (upsample 1, full resolution) are the reference.
+
+    python benchmarks/bench_detection.py [image files or directories, default tests/data]
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+
+from facerec import dlib_api
+from facerec.pipeline import iter_image_paths, read_image
+
+here = os.path.split(__file__)[0]
+
+modes = [
+    ('upsample 1, scale 1', dict(upsample=1, scale=1.0)),
+    ('upsample 0, scale 1', dict(upsample=0, scale=1.0)),
+    ('upsample 1, scale 0.5', dict(upsample=1, scale=0.5)),
+    ('upsample 0, scale 0.5', dict(upsample=0, scale=0.5)),
+    ('upsample 1, scale 0.25', dict(upsample=1, scale=0.25)),
+    ('upsample 0, scale 0.25', dict(upsample=0, scale=0.25)),
+    ('upsample 1, center roi', dict(upsample=1, scale=1.0, roi='center')),
+]
+
+
+def iou(a, b):
+    l, t = max(a.left(), b.left()), max(a.top(), b.top())
+    r, bottom = min(a.right(), b.right()), min(a.bottom(), b.bottom())
+    intersection = max(r - l, 0) * max(bottom - t, 0)
+    union = a.width() * a.height() + b.width() * b.height() - intersection
+    return intersection / union if union > 0 else 0.
+
+
+def recall(reference, found, min_iou=0.5):
+    if len(reference) == 0:
+        return 1.
+    return np.mean([any(iou(r, f) >= min_iou for f in found) for r in reference])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(here, '..', 'tests', 'data')])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = [read_image(path) for path in iter_image_paths(args.paths)]
+    dlib_api.preload()
+    references = [dlib_api.locate_faces(image, upsample=1, scale=1.0) for image in images]
+    print("{} images, {} reference faces".format(len(images), sum(len(r) for r in references)))
+
+    for name, params in modes:
+        elapsed, recalls = [], []
+        for image, reference in zip(images, references):
+            h, w = image.shape[:2]
+            kwargs = dict(params)
+            if kwargs.get('roi') == 'center':
+                kwargs['roi'] = [(w // 4, h // 4, 3 * w // 4, 3 * h // 4)]
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                found = dlib_api.locate_faces(image, **kwargs)
+            elapsed.append((time.perf_counter() - start) / args.repeat)
+            recalls.append(recall(reference, found))
+        print("{:>24}: recall {:5.1%}  {:8.1f} ms/image".format(name, np.mean(recalls), 1e3 * np.mean(elapsed)))
+
+
+if __name__ == '__main__':
+    main()
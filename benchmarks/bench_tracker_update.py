@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+measures the latency of FaceTracker.update with the in-process ('local') and the Manager based shared state.
+The detector is replaced by fixed rectangles so only the bookkeeping and the state sharing are measured.
+
+    python benchmarks/bench_tracker_update.py [--frames 200] [--faces 5] [--width 1920] [--height 1080]
+"""
+
+import argparse
+import time
+import dlib
+import numpy as np
+
+from facerec.facetracker import FaceTracker
+
+
+def bench(shared_state, frames, nfaces, width, height):
+    tracker = FaceTracker(shared_state=shared_state, identification_interval=3600)
+    # identification is not part of the measurement
+    tracker._identifier.cancel()
+    rects = [dlib.rectangle(100 + 200 * i, 100, 250 + 200 * i, 250) for i in range(nfaces)]
+    tracker.detector = lambda frame, *args: rects
+
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    latencies = []
+    try:
+        for _ in range(frames):
+            start = time.perf_counter()
+            tracker.update(frame)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        tracker.stop()
+    return np.asarray(latencies) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--faces', type=int, default=5)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+
+    print("update latency, {} frames {}x{} with {} faces".format(args.frames, args.width, args.height, args.faces))
+    for shared_state in ('manager', 'local'):
+        ms = bench(shared_state, args.frames, args.faces, args.width, args.height)
+        print("{:>8}: mean {:7.3f} ms  median {:7.3f} ms  p95 {:7.3f} ms".format(
+            shared_state, ms.mean(), np.median(ms), np.percentile(ms, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,15 @@
 try:
-    import pkg_resources
-    __version__ = pkg_resources.get_distribution('facerec').version
-except (pkg_resources.DistributionNotFound, ImportError):
-    __version__ = 'dev'
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        __version__ = version('facerec')
+    except PackageNotFoundError:
+        __version__ = 'dev'
+except ImportError:
+    # python < 3.8, pkg_resources is slow to import but always there
+    try:
+        import pkg_resources
+        __version__ = pkg_resources.get_distribution('facerec').version
+    except (pkg_resources.DistributionNotFound, ImportError):
+        __version__ = 'dev'
 
 from .dlib_api import detect_and_identify_faces, teach_person
\ No newline at end of file
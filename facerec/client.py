@@ -3,78 +3,159 @@
 # created: 30.04.2018
 # author:  TOS
 
+import asyncio
+import logging
 import requests
 import base64
 import json
 from io import BytesIO
 import numpy as np
 
+from . import protocol
+
+log = logging.getLogger(__name__)
+
+
+def _code_payload(code, name=None, id=None):
+    payload = {'code': base64.b64encode(np.asarray(code).tobytes()).decode('ascii')}
+    if name is not None:
+        payload['name'] = name
+    if id is not None:
+        payload['id'] = id
+    return payload
+
+
+def _image_payload(image, name=None, id=None):
+    payload = {'image': base64.b64encode(FacerecApi.compress_image(image)).decode('ascii')}
+    if name is not None:
+        payload['name'] = name
+    if id is not None:
+        payload['id'] = id
+    return payload
+
+
+def _batch_header(names=None, ids=None):
+    header = {}
+    if names is not None:
+        header['names'] = list(names)
+    if ids is not None:
+        header['ids'] = [None if i is None else int(i) for i in ids]
+    return header
+
+
+_batch_headers = {'Content-Type': protocol.content_type}
+
+# methods whose requests may be retried after they reached the server
+_idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
 class FacerecApi(object):
 
-    def __init__(self, url='http://localhost:80'):
+    def __init__(self, url='http://localhost:80', timeout=None, retries=0, pool_size=10):
+        """
+        client of a facerec server, the requests share a pool of keep-alive connections.
+        Args:
+            url: (str) url of the facerec server
+            timeout: (float, optional) seconds to wait for a response
+            retries: (int) number of retries on connection errors
+            pool_size: (int) number of connections kept alive
+        """
         self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.url + path, **kwargs).json()
+
+    def close(self):
+        self.session.close()
 
     def faces(self):
-        return requests.get(self.url+'/faces').json()
+        return self._request('GET', '/faces')
 
     def config(self):
-        return requests.get(self.url+'/config').json()
+        return self._request('GET', '/config')
 
     def set_config(self, **kwargs):
+        # one request per parameter, the route every server version serves
         for parameter, new_value in kwargs.items():
-            requests.patch(self.url+'/config/{}'.format(parameter), data={'value': new_value}).json()
+            self._request('PATCH', '/config/{}'.format(parameter), data={'value': new_value})
         return self.config()
 
     def face(self, id_or_name):
-        return requests.get(self.url+'/faces/{}'.format(id_or_name)).json()
+        return self._request('GET', '/faces/{}'.format(id_or_name))
 
     def delete_face(self, id_or_name):
-        return requests.delete(self.url+'/faces/{}'.format(id_or_name)).json()
+        return self._request('DELETE', '/faces/{}'.format(id_or_name))
 
     def set_name(self, id_or_name, new_name):
-        return requests.patch(self.url+'/faces/{}'.format(id_or_name), data={'name':new_name}).json()
+        return self._request('PATCH', '/faces/{}'.format(id_or_name), data={'name':new_name})
 
     def identify_facecode(self, code):
         # encode face code and send to identify
-        payload = {'code': base64.b64encode(np.asarray(code).tobytes()).decode('ascii')}
-        r = requests.post(self.url+'/facecode/identify', json=payload)
-        return r.json()
+        return self._request('POST', '/facecode/identify', json=_code_payload(code))
 
     def teach_facecode(self, code, name=None, id=None):
-        # encode face code and send to identify
-        payload = {'code': base64.b64encode(np.asarray(code).tobytes()).decode('ascii')}
-        if name is not None:
-            payload['name'] = name
-        if id is not None:
-            payload['id'] = id
-        r = requests.post(self.url+'/facecode/identify', json=payload)
-        return r.json()
+        # encode face code and send to identify, the name or id makes it a teach request
+        return self._request('POST', '/facecode/identify', json=_code_payload(code, name, id))
 
     def identify_image(self, image):
-        buffer = self.compress_image(image)
-        # encode face code and send to identify
-        payload = {'image': base64.b64encode(buffer).decode('ascii')}
-        r = requests.post(self.url+'/image/teach', json=payload)
-        return r.json()
+        # encode image and send to the image route, without name or id it identifies
+        return self._request('POST', '/image/teach', json=_image_payload(image))
 
     def teach_image(self, image, name=None, id=None):
-        # encode face code and send to identify
-        buffer = self.compress_image(image)
-        payload = {'image': base64.b64encode(buffer).decode('ascii')}
-        if name is not None:
-            payload['name'] = name
-        if id is not None:
-            payload['id'] = id
-        r = requests.post(self.url+'/image/teach', json=payload)
-        return r.json()
+        # encode image and send to teach
+        return self._request('POST', '/image/teach', json=_image_payload(image, name, id))
+
+    def identify_facecodes(self, codes):
+        """
+        identifies many face codes with one request.
+        Args:
+            codes: (np.array) (N, 128) face codes
+
+        Returns:
+            (list of dict) a person per code
+        """
+        return self._request('POST', '/facecodes/identify', data=protocol.encode_facecodes(codes),
+                             headers=_batch_headers)
 
+    def teach_facecodes(self, codes, names=None, ids=None):
+        """
+        teaches many face codes with one request.
+        Args:
+            codes: (np.array) (N, 128) face codes
+            names: (list of str, optional) name of the person per code
+            ids: (list of int, optional) id of the person per code
+
+        Returns:
+            (list of dict) a person per code
+        """
+        return self._request('POST', '/facecodes/teach',
+                             data=protocol.encode_facecodes(codes, **_batch_header(names, ids)),
+                             headers=_batch_headers)
+
+    def identify_images(self, images):
+        """
+        detects and identifies the faces on many images with one request.
+        Args:
+            images: (list of np.array) images given by 3d int arrays
+
+        Returns:
+            (list of list of dict) the persons on every image
+        """
+        return self._request('POST', '/images/identify', data=protocol.encode_images(images), headers=_batch_headers)
 
     @staticmethod
     def compress_image(image):
         try:
             import cv2
             _, array = cv2.imencode('.jpg',image)
-            return array.tostring()
+            return array.tobytes()
         except ModuleNotFoundError:
             from PIL import Image
             if not isinstance(image, Image.Image):
@@ -83,3 +164,144 @@ class FacerecApi(object):
             buffer = BytesIO()
             image.save(buffer, format="JPEG")
             return buffer.getvalue()
+
+
+class AsyncFacerecApi(object):
+    """
+    asyncio client of a facerec server (requires aiohttp). Requests share a pool of keep-alive connections and run
+    concurrently up to max_concurrency, e.g. with map:
+
+        api = AsyncFacerecApi(url)
+        persons = await api.map(api.identify_facecode, codes)
+    """
+
+    def __init__(self, url='http://localhost:80', max_concurrency=16, timeout=10., retries=2, retry_backoff=0.1):
+        """
+        Args:
+            url: (str) url of the facerec server
+            max_concurrency: (int) maximal number of requests in flight
+            timeout: (float) seconds to wait for a response
+            retries: (int) number of retries on connection errors and timeouts. Requests that may have reached the
+                     server are only retried if repeating them is harmless: GET, PUT and DELETE requests and the
+                     identifications, never teach requests
+            retry_backoff: (float) seconds to wait before the first retry, doubled with every further retry
+        """
+        import aiohttp  # fail early if the optional dependency is missing
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+
+    async def _assert_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _request(self, method, path, idempotent=None, **kwargs):
+        import aiohttp
+        if idempotent is None:
+            idempotent = method in _idempotent_methods
+        session = await self._assert_session()
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with session.request(method, self.url + path, **kwargs) as response:
+                        return await response.json(content_type=None)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    # a request which never reached the server can always be sent again
+                    sent = not isinstance(e, aiohttp.ClientConnectorError)
+                    if attempt == self.retries or (sent and not idempotent):
+                        raise
+                    log.warning("request {} {} failed ({}), retry...".format(method, path, e))
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def map(self, method, items, *args, **kwargs):
+        """
+        calls an api method for many items concurrently.
+        Args:
+            method: (coroutine function) e.g. api.identify_facecode
+            items: (iterable) first argument of every call
+
+        Returns:
+            (list) results in the order of the items
+        """
+        return await asyncio.gather(*[method(item, *args, **kwargs) for item in items])
+
+    def run(self, coroutine):
+        """
+        runs a coroutine of this client to completion from synchronous code, e.g. a worker thread. The client keeps
+        its own event loop for it, so it must not be used from several threads at the same time.
+        Args:
+            coroutine: (coroutine) e.g. api.map(api.identify_facecode, codes)
+
+        Returns:
+            result of the coroutine
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coroutine)
+
+    async def faces(self):
+        return await self._request('GET', '/faces')
+
+    async def config(self):
+        return await self._request('GET', '/config')
+
+    async def set_config(self, **kwargs):
+        for parameter, new_value in kwargs.items():
+            await self._request('PATCH', '/config/{}'.format(parameter), data={'value': new_value})
+        return await self.config()
+
+    async def face(self, id_or_name):
+        return await self._request('GET', '/faces/{}'.format(id_or_name))
+
+    async def delete_face(self, id_or_name):
+        return await self._request('DELETE', '/faces/{}'.format(id_or_name))
+
+    async def set_name(self, id_or_name, new_name):
+        return await self._request('PATCH', '/faces/{}'.format(id_or_name), data={'name': new_name})
+
+    # a repeated identification finds the unknown person added by the first one, they may be retried
+    async def identify_facecode(self, code):
+        return await self._request('POST', '/facecode/identify', json=_code_payload(code), idempotent=True)
+
+    async def teach_facecode(self, code, name=None, id=None):
+        return await self._request('POST', '/facecode/identify', json=_code_payload(code, name, id))
+
+    async def identify_image(self, image):
+        return await self._request('POST', '/image/teach', json=_image_payload(image), idempotent=True)
+
+    async def teach_image(self, image, name=None, id=None):
+        return await self._request('POST', '/image/teach', json=_image_payload(image, name, id))
+
+    async def identify_facecodes(self, codes):
+        return await self._request('POST', '/facecodes/identify', data=protocol.encode_facecodes(codes),
+                                   headers=_batch_headers, idempotent=True)
+
+    async def teach_facecodes(self, codes, names=None, ids=None):
+        return await self._request('POST', '/facecodes/teach',
+                                   data=protocol.encode_facecodes(codes, **_batch_header(names, ids)),
+                                   headers=_batch_headers)
+
+    async def identify_images(self, images):
+        return await self._request('POST', '/images/identify', data=protocol.encode_images(images),
+                                   headers=_batch_headers, idempotent=True)
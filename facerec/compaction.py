@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+compaction of the unknown faces of the face database. identify_person adds an unknown person for every unmatched
+face code, over weeks of camera operation the gallery fills with near duplicates which slow down every lookup.
+
+    facerec-compact [--db DIR] [--max-age DAYS] [--min-hits N] [--merge-distance D]
+
+clusters the unknown persons by the distances of their centroids, merges every cluster into its most established
+member (see facedb.merge_persons) and deletes the unknown persons not identified for max_age days with less than
+min_hits identifications.
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+from sqlalchemy.orm import selectinload
+
+from . import facedb
+
+log = logging.getLogger(__name__)
+
+
+def _neighbours(codes, distance, max_bytes=64 << 20):
+    # pairwise distances below distance, computed in blocks of rows whose distance matrix fits into max_bytes
+    block_size = max(1, max_bytes // (codes.itemsize * max(len(codes), 1)))
+    norms = np.sum(codes ** 2, axis=1)
+    neighbours = []
+    for start in range(0, len(codes), block_size):
+        block = codes[start:start + block_size]
+        squared = norms[start:start + block_size, None] + norms[None, :] - 2. * block.dot(codes.T)
+        rows, columns = np.nonzero(squared < distance ** 2)
+        splits = np.searchsorted(rows, np.arange(1, len(block)))
+        neighbours.extend(np.split(columns, splits))
+    return neighbours
+
+
+def cluster(codes, distance, order=None):
+    """
+    groups the codes greedily: the first unassigned code in order is the seed of a cluster with all unassigned codes
+    closer than distance to it. Unlike single linkage clustering, chains of similar faces are not merged.
+    Args:
+        codes: (np.array) (N, 128) face codes
+        distance: (float) maximal distance to the seed of a cluster
+        order: (np.array, optional) indices of the codes by decreasing priority as seeds, defaults to their order
+
+    Returns:
+        (np.array) (N,) index of the seed of the cluster of every code
+    """
+    codes = np.asarray(codes, dtype=np.float64).reshape(len(codes), -1)
+    seeds = np.full(len(codes), -1, dtype=np.int64)
+    if len(codes) == 0:
+        return seeds
+    neighbours = _neighbours(codes, distance)
+    for i in (np.arange(len(codes)) if order is None else order):
+        if seeds[i] >= 0:
+            continue
+        members = neighbours[i][seeds[neighbours[i]] < 0]
+        seeds[members] = i
+        seeds[i] = i
+    return seeds
+
+
+def lookup_latency(nqueries=200, session=None):
+    """
+    measures the time to identify a single face code on the resident index.
+    Args:
+        nqueries: (int) number of lookups, perturbed codes of the gallery
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (float) mean seconds per lookup, nan for an empty gallery
+    """
+    index = facedb.get_index(session)
+    codes = np.asarray(index.codes, dtype=np.float64)
+    if len(codes) == 0:
+        return float('nan')
+    rng = np.random.RandomState(0)
+    queries = codes[rng.randint(0, len(codes), nqueries)] + rng.randn(nqueries, codes.shape[1]) * 0.01
+    threshold = facedb.get_distance_threshold()
+    start = time.perf_counter()
+    for query in queries:
+        index.nearest(query[None, :], threshold)
+    return (time.perf_counter() - start) / nqueries
+
+
+def _gallery_size(session):
+    return session.query(facedb.Person).count(), session.query(facedb.Exemplar).count()
+
+
+def compact(max_age=30., min_hits=2, merge_distance=None, session=None):
+    """
+    merges the near duplicate unknown persons and deletes the stale ones.
+    Args:
+        max_age: (float) days since the last identification after which rarely seen unknown persons expire, None
+            keeps all
+        min_hits: (int) unknown persons with at least min_hits identifications never expire
+        merge_distance: (float, optional) maximal distance of the centroids of merged unknown persons, defaults to
+            the distance threshold of the identification
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (dict) number of 'merged' and 'expired' persons, gallery size ('persons', 'exemplars') and mean lookup
+        'latency' in seconds before and after, e.g. report['persons'] == (before, after)
+    """
+    session = facedb.assert_session(session)
+    merge_distance = facedb.get_distance_threshold() if merge_distance is None else merge_distance
+
+    # the statistics of this process, other processes flush theirs when they close the database
+    facedb.flush_hits()
+    facedb.sync_index(session)
+    persons_before, exemplars_before = _gallery_size(session)
+    latency_before = lookup_latency(session=session)
+
+    # the exemplars are merged or deleted along with their persons, load them in one query
+    unknowns = {p.id: p for p in session.query(facedb.Person).options(selectinload(facedb.Person.exemplars))
+                .filter(facedb.Person.name == facedb.unknown_tag)}
+    nexpired = 0
+    with facedb.transaction(session):
+        if max_age is not None:
+            deadline = time.time() - max_age * 24 * 3600
+            for p in list(unknowns.values()):
+                if (p.hits or 0) < min_hits and (p.last_seen or 0.) < deadline:
+                    session.delete(unknowns.pop(p.id))
+                    nexpired += 1
+            session.flush()
+        log.info("expired {} unknown persons...".format(nexpired))
+
+        persons = list(unknowns.values())
+        codes = np.vstack([p.code for p in persons]) if len(persons) > 0 else np.zeros((0, 128))
+        # the most established unknown persons are the seeds
+        order = np.lexsort(([-(p.hits or 0) for p in persons], [-p.nmeans for p in persons]))
+        seeds = cluster(codes, merge_distance, order)
+        nmerged = 0
+        for i, seed in enumerate(seeds):
+            if seed != i:
+                facedb.merge_persons(persons[i], persons[seed], session)
+                nmerged += 1
+        log.info("merged {} duplicate unknown persons...".format(nmerged))
+
+    persons_after, exemplars_after = _gallery_size(session)
+    latency_after = lookup_latency(session=session)
+    return {'merged': nmerged, 'expired': nexpired,
+            'persons': (persons_before, persons_after), 'exemplars': (exemplars_before, exemplars_after),
+            'latency': (latency_before, latency_after)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='directory of the face database (default: configured path)')
+    parser.add_argument('--max-age', type=float, default=30.,
+                        help='days after which rarely identified unknown persons expire (default: 30)')
+    parser.add_argument('--min-hits', type=int, default=2,
+                        help='identifications which keep an unknown person from expiring (default: 2)')
+    parser.add_argument('--merge-distance', type=float, default=None,
+                        help='maximal distance of merged unknown persons (default: distance threshold)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.db is not None:
+        facedb.set_db_path(args.db)
+
+    try:
+        report = compact(max_age=args.max_age, min_hits=args.min_hits, merge_distance=args.merge_distance)
+    finally:
+        facedb.close()
+    log.info("merged {merged} and expired {expired} unknown persons".format(**report))
+    log.info("persons {} -> {}, exemplars {} -> {}".format(*(report['persons'] + report['exemplars'])))
+    log.info("lookup {:.3f} ms -> {:.3f} ms".format(*(1e3 * t for t in report['latency'])))
+    return report
+
+
+if __name__ == '__main__':
+    main()
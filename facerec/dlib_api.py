@@ -4,76 +4,282 @@
 # author:  TOS
 
 import logging
-import dlib
+import threading
 import numpy as np
-import pkg_resources
-
-detector = dlib.get_frontal_face_detector()
-sp = dlib.shape_predictor(pkg_resources.resource_filename('facerec',r'models/shape_predictor_68_face_landmarks.dat'))
-facerec = dlib.face_recognition_model_v1(pkg_resources.resource_filename('facerec',r'models/dlib_face_recognition_resnet_model_v1.dat'))
 
 log = logging.getLogger(__name__)
 
-def detect_faces(image):
+_models = None
+_models_lock = threading.Lock()
+# models of the threads which use their own, see use_thread_models
+_thread = threading.local()
+
+def _create_models():
+    import dlib
+    import pkg_resources
+    log.info("load dlib models...")
+    detector = dlib.get_frontal_face_detector()
+    sp = dlib.shape_predictor(pkg_resources.resource_filename('facerec',r'models/shape_predictor_68_face_landmarks.dat'))
+    facerec = dlib.face_recognition_model_v1(pkg_resources.resource_filename('facerec',r'models/dlib_face_recognition_resnet_model_v1.dat'))
+    return (detector, sp, facerec)
+
+def _load_models():
+    """ loads the dlib detector and models on first use, returns the 3-tuple (detector, sp, facerec) """
+    global _models
+    if getattr(_thread, 'own', False):
+        if getattr(_thread, 'models', None) is None:
+            _thread.models = _create_models()
+        return _thread.models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                _models = _create_models()
+    return _models
+
+def preload():
+    """
+    loads the dlib models now instead of on the first detection, e.g. to warm up a worker.
+    """
+    _load_models()
+
+def use_thread_models():
+    """
+    the calling thread loads dlib models of its own on first use instead of sharing the ones of the process. The
+    models keep their intermediate results in themselves, threads which detect or describe faces at the same time
+    (e.g. the workers of trackerpool.FaceTrackerPool) must not share them. Every thread holds about 120 MB of models.
+    """
+    _thread.own = True
+
+def __getattr__(name):
+    # the models used to be module attributes, keep them accessible
+    if name in ('detector', 'sp', 'facerec'):
+        return dict(zip(('detector', 'sp', 'facerec'), _load_models()))[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+_detection = {'upsample': 1, 'scale': 1.0, 'roi': None}
+
+def get_detection_params():
+    return dict(_detection)
+
+def set_detection_params(**params):
+    """
+    sets the defaults of the face detection used by detect_faces, detect_and_identify_faces and teach_person.
+    Args:
+        upsample: (int) number of times to upsample the image 2x before running the detector
+        scale: (float) detect on a copy of the image resized by scale, landmarks and face codes are still computed
+               at full resolution on the mapped rectangles (coarse to fine)
+        roi: (np.array or list of 4-tuple) region of interest, a boolean mask or rectangles (left, top, right, bottom),
+             faces outside are not detected
+    """
+    unknown = set(params) - set(_detection)
+    if unknown:
+        raise ValueError("unknown detection parameters {}!".format(sorted(unknown)))
+    _detection.update(params)
+
+def _resize(image, scale):
+    h, w = image.shape[:2]
+    size = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+    try:
+        import cv2
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    except ModuleNotFoundError:
+        # nearest neighbour sampling
+        rows = np.minimum((np.arange(size[1]) / scale).astype(int), h - 1)
+        cols = np.minimum((np.arange(size[0]) / scale).astype(int), w - 1)
+        return np.ascontiguousarray(image[rows[:, None], cols[None, :]])
+
+def _roi_boxes(image, roi):
+    h, w = image.shape[:2]
+    if roi is None:
+        return [(0, 0, w, h)], None
+    if isinstance(roi, np.ndarray) and roi.dtype == bool:
+        rows = np.flatnonzero(roi.any(axis=1))
+        cols = np.flatnonzero(roi.any(axis=0))
+        if len(rows) == 0:
+            return [], roi
+        return [(int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)], roi
+    boxes = []
+    for l, t, r, b in roi:
+        l, t, r, b = max(int(l), 0), max(int(t), 0), min(int(r), w), min(int(b), h)
+        if r > l and b > t:
+            boxes.append((l, t, r, b))
+    return boxes, None
+
+def locate_faces(image, upsample=None, scale=None, roi=None):
+    """
+    detects the rectangles of the faces on the image.
+    Args:
+        image: (np.array, cv.array) image given by 3d int array.
+        upsample: (int, optional) number of times to upsample before detection, defaults to the detection params
+        scale: (float, optional) detect on a copy resized by scale, defaults to the detection params
+        roi: (np.array or list of 4-tuple, optional) region of interest, defaults to the detection params
+
+    Returns:
+        list of dlib.rectangle in full resolution image coordinates
+
+    """
+
+    import dlib
+
+    detector, _, _ = _load_models()
+    upsample = _detection['upsample'] if upsample is None else upsample
+    scale = _detection['scale'] if scale is None else scale
+    roi = _detection['roi'] if roi is None else roi
+
+    boxes, mask = _roi_boxes(image, roi)
+    rects = []
+    for l, t, r, b in boxes:
+        crop = image[t:b, l:r]
+        if scale != 1.0:
+            crop = _resize(crop, scale)
+        for d in detector(crop, upsample):
+            # map back to the full resolution image
+            rect = dlib.rectangle(int(round(d.left() / scale)) + l, int(round(d.top() / scale)) + t,
+                                  int(round(d.right() / scale)) + l, int(round(d.bottom() / scale)) + t)
+            if mask is not None:
+                cx = min(max(rect.center().x, 0), mask.shape[1] - 1)
+                cy = min(max(rect.center().y, 0), mask.shape[0] - 1)
+                if not mask[cy, cx]:
+                    continue
+            rects.append(rect)
+    return rects
+
+def compute_descriptors(images, shapes):
+    """
+    computes the face codes of all faces on a list of images with a single batch through the network.
+    Args:
+        images: (list of np.array) images given by 3d int arrays.
+        shapes: (list of list of dlib.full_object_detection) face landmarks for every image.
+
+    Returns:
+        list of (N_i, 128) arrays with the face codes of every image
+
+    """
+
+    import dlib
+
+    _, _, facerec = _load_models()
+
+    batch_images = []
+    batch_faces = []
+    for image, image_shapes in zip(images, shapes):
+        if len(image_shapes) > 0:
+            faces = dlib.full_object_detections()
+            faces.extend(image_shapes)
+            batch_images.append(image)
+            batch_faces.append(faces)
+
+    # Compute the 128D vectors that describe the faces identified by shape.
+    # In general, if two face descriptor vectors have a Euclidean
+    # distance between them less than 0.6 then they are from the same
+    # person, otherwise they are from different people.
+    if len(batch_images) > 0:
+        batch_codes = iter(facerec.compute_face_descriptor(batch_images, batch_faces))
+    facecodes = []
+    for image_shapes in shapes:
+        if len(image_shapes) > 0:
+            facecodes.append(np.asarray([np.asarray(code) for code in next(batch_codes)]))
+        else:
+            facecodes.append(np.empty((0, 128)))
+    return facecodes
+
+def detect_faces_batch(images, upsample=None, scale=None, roi=None):
+    """
+    detects faces on a list of images and computes the face codes of all faces in one batch.
+    Args:
+        images: (list of np.array, cv.array) images given by 3d int arrays.
+        upsample, scale, roi: (optional) detection parameters, see set_detection_params
+
+    Returns:
+        list (one per image) of lists of 3-tuple, 128D-array (face codes, rect, shape)
+
+    """
+
+    _, sp, _ = _load_models()
+
+    dets = [locate_faces(image, upsample, scale, roi) for image in images]
+    # Get the landmarks/parts for the faces in the boxes.
+    shapes = [[sp(image, d) for d in image_dets] for image, image_dets in zip(images, dets)]
+    facecodes = compute_descriptors(images, shapes)
+
+    return [list(zip(codes, image_dets, image_shapes))
+            for codes, image_dets, image_shapes in zip(facecodes, dets, shapes)]
+
+def detect_faces(image, upsample=None, scale=None, roi=None):
     """
     detects faces in image given and identifies the persons corresponding to the faces.
     Args:
         image: (np.array, cv.array) image given by 3d int array.
+        upsample, scale, roi: (optional) detection parameters, see set_detection_params
 
     Returns:
         list of 3-tuple, 128D-array (face codes, rect, shape)
 
     """
-    dets = detector(image, 1)
 
-    persons = []
-    for k, d in enumerate(dets):
-        # print("Detection {}: Left: {} Top: {} Right: {} Bottom: {}".format(
-        #     k, d.left(), d.top(), d.right(), d.bottom()))
-        # Get the landmarks/parts for the face in box d.
-        shape = sp(image, d)
+    return detect_faces_batch([image], upsample, scale, roi)[0]
 
-        # Compute the 128D vector that describes the face in img identified by
-        # shape.  In general, if two face descriptor vectors have a Euclidean
-        # distance between them less than 0.6 then they are from the same
-        # person, otherwise they are from different people.
-        facecode = np.asarray(facerec.compute_face_descriptor(image, shape))
-        persons.append((facecode, d, shape))
+def describe_faces(image, rects):
+    """
+    computes landmarks and face codes of faces already localized on the image, without running the detector.
+    Args:
+        image: (np.array, cv.array) image given by 3d int array.
+        rects: (list of dlib.rectangle or 4-tuple) face rectangles (left, top, right, bottom)
+
+    Returns:
+        list of 3-tuple, 128D-array (face codes, rect, shape)
+
+    """
+
+    import dlib
+
+    _, sp, _ = _load_models()
 
-    return persons
+    rects = [r if isinstance(r, dlib.rectangle) else dlib.rectangle(*[int(c) for c in r]) for r in rects]
+    shapes = [sp(image, d) for d in rects]
+    facecodes = compute_descriptors([image], [shapes])[0]
 
-def detect_and_identify_faces(image, session=None):
+    return list(zip(facecodes, rects, shapes))
+
+def identify_faces(image, rects, session=None):
     """
-    detects faces in image given and identifies the persons corresponding to the faces.
+    identifies the persons of faces already localized on the image, without running the detector.
     Args:
         image: (np.array, cv.array) image given by 3d int array.
+        rects: (list of dlib.rectangle or 4-tuple) face rectangles (left, top, right, bottom)
 
     Returns:
         list of 3-tuple (Person, rect, shape)
 
     """
 
-    from .facedb import identify_person
+    return _identify(describe_faces(image, rects), session)
 
-    dets = detector(image, 1)
+def _identify(faces, session):
+    from .facedb import identify_persons
 
-    persons = []
-    for k, d in enumerate(dets):
-        # print("Detection {}: Left: {} Top: {} Right: {} Bottom: {}".format(
-        #     k, d.left(), d.top(), d.right(), d.bottom()))
-        # Get the landmarks/parts for the face in box d.
-        shape = sp(image, d)
+    if len(faces) == 0:
+        return []
 
-        # Compute the 128D vector that describes the face in img identified by
-        # shape.  In general, if two face descriptor vectors have a Euclidean
-        # distance between them less than 0.6 then they are from the same
-        # person, otherwise they are from different people.
-        facecode = np.asarray(facerec.compute_face_descriptor(image, shape))
-        persons.append((identify_person(facecode, session=session), d, shape))
+    # identify all faces of the image with one lookup and one transaction
+    persons = identify_persons(np.vstack([facecode for facecode, d, shape in faces]), session=session)
+    return [(person, d, shape) for person, (facecode, d, shape) in zip(persons, faces)]
 
-    return persons
+def detect_and_identify_faces(image, session=None, upsample=None, scale=None, roi=None):
+    """
+    detects faces in image given and identifies the persons corresponding to the faces.
+    Args:
+        image: (np.array, cv.array) image given by 3d int array.
+        upsample, scale, roi: (optional) detection parameters, see set_detection_params
+
+    Returns:
+        list of 3-tuple (Person, rect, shape)
 
-def teach_person(image, name=None, id=None, weight=1.0, session=None):
+    """
+
+    return _identify(detect_faces(image, upsample, scale, roi), session)
+
+def teach_person(image, name=None, id=None, weight=1.0, session=None, upsample=None, scale=None, roi=None):
     """
     teach the face recognition system that the given image containes a exactly one face of specified person.
     Args:
@@ -81,6 +287,7 @@ def teach_person(image, name=None, id=None, weight=1.0, session=None):
         name: (str) name of the person in the face database (either name or id has to be specified)
         id: (int) id of the person in the face database (either name or id has to be specified)
         weight: (float, default 1.0) weight to assign to specific face code in teaching.
+        upsample, scale, roi: (optional) detection parameters, see set_detection_params
 
     Returns:
         3-tuple (Person, rect, shape)
@@ -89,7 +296,9 @@ def teach_person(image, name=None, id=None, weight=1.0, session=None):
 
     from .facedb import teach
 
-    dets = detector(image, 1)
+    _, sp, facerec = _load_models()
+
+    dets = locate_faces(image, upsample, scale, roi)
     if len(dets) > 1:
         raise ValueError('More than one face detected on the passed image! An image with exactly one face has to be passed!')
     elif len(dets) == 0:
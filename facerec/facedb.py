@@ -3,21 +3,32 @@
 # created: 20.04.2018
 # author:  TOS
 
+import contextlib
 import logging
 import pkg_resources
+import threading
 import pathlib
 import os
 
 from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint, ARRAY, Float
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session, Session as SqlSession, make_transient_to_detached, make_transient
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, Session as SqlSession, make_transient_to_detached, make_transient, object_session
 from sqlalchemy import create_engine
-from sqlalchemy import types, asc
+from sqlalchemy import types, asc, event, text, func, inspect, bindparam
+from concurrent.futures import Future
+import queue
+import time
 from sqlalchemy.orm.exc import NoResultFound
 import json
+import struct
+import uuid
 
 import numpy as np
 
+from .faceindex import backends, create_index, load_index, FaceIndex
+from .snapshot import Snapshot
+from .storage import create_storage, vector_type
+
 log = logging.getLogger(__name__)
 
 unknown_tag = "unknown"
@@ -32,25 +43,133 @@ try:
 except:
     __db_path = pathlib.Path(pkg_resources.resource_filename('facerec','data'))
 __db_file = 'face.db'
+__index_file = 'face.index.npz'
+__snapshot_file = 'face.snapshot'
+__index_config = {'backend': 'exact'}
+__code_dtype = 'float32'
+__exemplar_config = {'max_exemplars': 5, 'merge_distance': 0.3}
+__db_url = os.environ.get('FACEREC_DB_URL')
+__storage_config = {}
+__sync_interval = 1.
+try:
+    with open(__db_config_file, 'r') as fp:
+        config = json.load(fp)
+    __db_url = __db_url or config.get('url')
+    __storage_config.update(config.get('storage', {}))
+    __index_config.update(config.get('index', {}))
+    __code_dtype = config.get('code_dtype', __code_dtype)
+    __exemplar_config.update(config.get('exemplars', {}))
+    __sync_interval = float(config.get('sync_interval', __sync_interval))
+    del config
+except:
+    pass
 
+__storage = None
 __engine = None
+# identity of the opened database, snapshots of other databases are never mapped
+__db_uuid = None
+__index = None
+__snapshot_generation = None
+# last entry of the change log applied to the resident index
+__index_revision = 0
+__last_sync = 0.
+# identifications per person id not yet written to the database: (hits, last seen)
+__hits = {}
+__hits_lock = threading.Lock()
 nocommit = False
 Session = None
 
 Base = declarative_base()
 
+# storage format of the face codes:
+#   version 1 (unversioned): 1024 bytes of raw float64
+#   version 2: header (version, dtype, dimension) followed by the values, int8 codes carry a float32 scale
+# the decoded codes are float64, the distances between decoded codes deviate from the exact distances by less
+# than code_tolerances for dlib face codes
+code_version = 2
+code_dtypes = {1: np.float64, 2: np.float32, 3: np.float16, 4: np.int8}
+code_tolerances = {'float64': 0., 'float32': 1e-6, 'float16': 1e-3, 'int8': 1e-2}
+_code_header = struct.Struct('<BBH')
+_code_scale = struct.Struct('<f')
+
+def encode_facecode(code, dtype=None):
+    """
+    serializes a face code for storage.
+    Args:
+        code: (np.array) 128-d face feature vector
+        dtype: (str, optional) 'float64', 'float32', 'float16' or 'int8' (quantized), defaults to the configured
+               storage dtype
+
+    Returns:
+        (bytes)
+    """
+    dtype = np.dtype(__code_dtype if dtype is None else dtype)
+    kind = {np.dtype(t): k for k, t in code_dtypes.items()}.get(dtype)
+    if kind is None:
+        raise ValueError("unsupported face code dtype {}!".format(dtype))
+    code = np.asarray(code, dtype=np.float64).ravel()
+    header = _code_header.pack(code_version, kind, len(code))
+    if dtype == np.int8:
+        scale = max(float(np.abs(code).max()) / 127., np.finfo(np.float32).tiny)
+        values = np.round(code / scale).astype(np.int8)
+        return header + _code_scale.pack(scale) + values.tobytes()
+    return header + code.astype(dtype.newbyteorder('<')).tobytes()
+
+def decode_facecode(value):
+    """
+    deserializes a stored face code of any version.
+    Args:
+        value: (bytes)
+
+    Returns:
+        (np.array) float64 128-d face feature vector
+    """
+    value = bytes(value)
+    if len(value) == 1024:
+        # version 1, raw float64
+        return np.frombuffer(value, dtype='<f8').copy()
+    version, kind, dim = _code_header.unpack_from(value)
+    if version != code_version or kind not in code_dtypes:
+        raise ValueError("unknown face code format (version {}, dtype {})!".format(version, kind))
+    dtype = np.dtype(code_dtypes[kind]).newbyteorder('<')
+    offset = _code_header.size
+    scale = 1.
+    if kind == 4:
+        scale, = _code_scale.unpack_from(value, offset)
+        offset += _code_scale.size
+    if len(value) != offset + dim * dtype.itemsize:
+        raise ValueError("face code of {} bytes does not match its header!".format(len(value)))
+    return np.frombuffer(value, dtype=dtype, offset=offset).astype(np.float64) * scale
+
+
+def _vector_columns(dialect):
+    return dialect.name == 'postgresql' and __storage is not None and __storage.vector_search
+
+
 class FaceCode(types.TypeDecorator):
+    """ face code column, binary in the format of encode_facecode or a pgvector column on PostgreSQL """
 
-    impl = types.String
+    impl = types.LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if _vector_columns(dialect):
+            return dialect.type_descriptor(vector_type()(128))
+        return dialect.type_descriptor(types.LargeBinary())
 
     def process_bind_param(self, value, dialect):
-        return np.asarray(value).tobytes()[:self.impl.length]
+        if value is None:
+            return None
+        if _vector_columns(dialect):
+            return np.asarray(value, dtype=np.float32).ravel()
+        return encode_facecode(value)
 
     def process_result_value(self, value, dialect):
-        return np.frombuffer(value)
-
-    def copy(self, **kw):
-        return FaceCode(self.impl.length)
+        if value is None:
+            return None
+        if _vector_columns(dialect):
+            return np.asarray(value, dtype=np.float64)
+        return decode_facecode(value)
 
 
 class Person(Base):
@@ -59,8 +178,100 @@ class Person(Base):
     # Notice that each column is also a normal Python instance attribute.
     id = Column(Integer, primary_key=True)
     name = Column(String(250))
-    code = Column(FaceCode(1024), nullable=False)
+    code = Column(FaceCode(), nullable=False)
     nmeans = Column(Float, nullable=False, default=1.0)
+    # number of identifications and time of the last one (seconds since the epoch), see flush_hits
+    hits = Column(Integer, nullable=False, default=0)
+    last_seen = Column(Float, default=time.time)
+    exemplars = relationship('Exemplar', back_populates='person', cascade='all, delete-orphan')
+
+
+class Exemplar(Base):
+    """ one of up to max_exemplars representative face codes of a person (e.g. per pose, lighting or glasses) """
+    __tablename__ = 'face_codes'
+    id = Column(Integer, primary_key=True)
+    person_id = Column(Integer, ForeignKey('persons.id'), nullable=False, index=True)
+    code = Column(FaceCode(), nullable=False)
+    weight = Column(Float, nullable=False, default=1.0)
+    person = relationship('Person', back_populates='exemplars')
+
+
+class FaceChange(Base):
+    """
+    append only log of the inserted, updated and deleted exemplars, its ids are the revisions of the gallery. Other
+    processes apply the changes since their last revision to their resident index (see sync_index).
+    """
+    __tablename__ = 'face_changes'
+    # never reuse the ids of deleted (pruned) entries
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = Column(Integer, primary_key=True)
+    person_id = Column(Integer, nullable=False)
+    exemplar_id = Column(Integer, nullable=False)
+
+
+class DbInfo(Base):
+    """ properties of the database, e.g. its 'uuid' """
+    __tablename__ = 'db_info'
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+
+# the index holds the exemplars, its keys carry the person id in the upper 32 bits
+def _exemplar_key(person_id, exemplar_id):
+    return (int(person_id) << 32) | int(exemplar_id)
+
+def _person_ids(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return np.where(keys >= 0, keys >> 32, -1)
+
+
+# exemplars flushed by a session since its last commit: code per key, None for deleted ones. They are applied to
+# the shared resident index on commit, other threads never match uncommitted persons.
+_index_changes = 'facedb.index_changes'
+
+@event.listens_for(Exemplar, 'after_insert')
+@event.listens_for(Exemplar, 'after_update')
+def _index_exemplar(mapper, connection, target):
+    _log_change(connection, target)
+    _pending_index_changes(object_session(target))[_exemplar_key(target.person_id, target.id)] = np.array(target.code)
+
+@event.listens_for(Exemplar, 'after_delete')
+def _unindex_exemplar(mapper, connection, target):
+    _log_change(connection, target)
+    _pending_index_changes(object_session(target))[_exemplar_key(target.person_id, target.id)] = None
+
+def _pending_index_changes(session):
+    return session.info.setdefault(_index_changes, {})
+
+def _log_change(connection, exemplar):
+    # the change is committed or rolled back together with the exemplar
+    __storage.serialize_changes(connection)
+    connection.execute(FaceChange.__table__.insert().values(person_id=exemplar.person_id, exemplar_id=exemplar.id))
+
+@event.listens_for(SqlSession, 'before_flush')
+def _assure_exemplar(session, flush_context, instances):
+    # persons created with a code only start with it as their first exemplar
+    for obj in session.new:
+        if isinstance(obj, Person) and len(obj.exemplars) == 0:
+            obj.exemplars.append(Exemplar(code=obj.code, weight=obj.nmeans or 1.0))
+
+@event.listens_for(SqlSession, 'after_commit')
+def _apply_index_changes(session):
+    # keep the resident index in sync with every committed insert, update or delete of an exemplar
+    changes = session.info.pop(_index_changes, None)
+    index = __index
+    if not changes or index is None:
+        return
+    for key, code in changes.items():
+        if code is None:
+            index.remove(key)
+        else:
+            index.add(key, code)
+
+@event.listens_for(SqlSession, 'after_rollback')
+def _discard_index_changes(session):
+    # the flushed changes were undone in the database, the index never saw them
+    session.info.pop(_index_changes, None)
 
 
 def get_db_path():
@@ -69,6 +280,12 @@ def get_db_path():
 def get_db_file():
     return __db_path.joinpath(__db_file)
 
+def get_index_file():
+    return __db_path.joinpath(__index_file)
+
+def get_snapshot():
+    return Snapshot(__db_path.joinpath(__snapshot_file))
+
 
 def _update_config_file(new_config):
     log.info("write config file {}...".format(__db_config_file))
@@ -84,16 +301,59 @@ def _update_config_file(new_config):
         json.dump(config, fp)
 
 def set_db_path(path, persistent=False):
+    """
+    uses the SQLite database face.db in the directory path, the index, snapshot and journal files are stored there
+    for other backends as well.
+    """
 
     global __db_path
+    global __db_url
 
     path = pathlib.Path(path)
     assert path.exists()
     if persistent:
-        _update_config_file({'path': str(path)})
+        _update_config_file({'path': str(path), 'url': None})
     __db_path = path
+    __db_url = None
     open_db()
 
+def get_db_url():
+    """
+    Returns:
+        (str) SQLAlchemy url of the database, sqlite:///<db path>/face.db unless configured otherwise
+    """
+    if __db_url is not None:
+        return __db_url
+    return 'sqlite:///{}'.format(get_db_file())
+
+def set_db_url(url, persistent=False, **params):
+    """
+    selects the storage backend of the face database (see storage), e.g.
+
+        set_db_url('postgresql://facerec@dbhost/faces', pool_size=10)
+        set_db_url('memory://')
+
+    The url can also be given by the FACEREC_DB_URL environment variable or the 'url' key of the config file.
+    Args:
+        url: (str) SQLAlchemy database url or memory:// for an in-memory database
+        persistent: (bool) store the url and parameters in the config file
+        **params: parameters of the backend, e.g. pool_size, max_overflow or vector=False for PostgreSQL
+    """
+
+    global __db_url
+    global __storage_config
+
+    __db_url = url
+    __storage_config = dict(params)
+    if persistent:
+        _update_config_file({'url': url, 'storage': __storage_config})
+    open_db()
+
+def get_storage():
+    if __storage is None:
+        open_db()
+    return __storage
+
 def get_distance_threshold():
     return __distance_threshold
 
@@ -105,20 +365,186 @@ def set_distance_threshold(threshold, persistent=False):
     if persistent:
         _update_config_file({'threshold':threshold})
 
+def get_sync_interval():
+    return __sync_interval
+
+def set_sync_interval(interval, persistent=False):
+    """
+    Args:
+        interval: (float) minimal seconds between two polls of the change log by identify_person(s) and
+            find_similar_persons, the changes of other processes are seen at most interval seconds late. 0 polls
+            on every call, strict consistency at the cost of one query per lookup
+        persistent: (bool) store the setting in the config file
+    """
+    global __sync_interval
+    __sync_interval = float(interval)
+    if persistent:
+        _update_config_file({'sync_interval': __sync_interval})
+
+def get_code_dtype():
+    return __code_dtype
+
+def set_code_dtype(dtype, persistent=False):
+    """
+    selects the storage format of newly written face codes, existing codes are converted by migrate_db.
+    Args:
+        dtype: (str) 'float32' (default), 'float16', 'int8' (quantized) or 'float64' (lossless)
+        persistent: (bool) store the choice in the config file
+    """
+
+    global __code_dtype
+
+    if dtype not in code_tolerances:
+        raise ValueError("dtype must be one of {}!".format(sorted(code_tolerances)))
+    __code_dtype = dtype
+    if persistent:
+        _update_config_file({'code_dtype': dtype})
+
+def get_exemplar_policy():
+    return dict(__exemplar_config)
+
+def set_exemplar_policy(max_exemplars=None, merge_distance=None, persistent=False):
+    """
+    sets how many face codes are kept per person. A taught code closer than merge_distance to an exemplar is
+    merged into it (weighted mean), otherwise it becomes a new exemplar. Beyond max_exemplars the two closest
+    exemplars are merged, so teaching costs O(max_exemplars^2) and the index holds at most max_exemplars codes
+    per person.
+    Args:
+        max_exemplars: (int, optional) maximal number of exemplars per person, 1 keeps only the centroid
+        merge_distance: (float, optional) distance below which a code is merged into an exemplar
+        persistent: (bool) store the policy in the config file
+    """
+    if max_exemplars is not None:
+        if max_exemplars < 1:
+            raise ValueError("max_exemplars must be at least 1!")
+        __exemplar_config['max_exemplars'] = int(max_exemplars)
+    if merge_distance is not None:
+        __exemplar_config['merge_distance'] = float(merge_distance)
+    if persistent:
+        _update_config_file({'exemplars': __exemplar_config})
+
+def get_index_config():
+    return dict(__index_config)
+
+def set_index_backend(backend, persistent=False, **params):
+    """
+    selects the search backend of the face index, the index is rebuilt on next use.
+    Args:
+        backend: (str) 'exact' for brute force search or 'ivf' for approximate search on large galleries
+        persistent: (bool) store the choice in the config file
+        **params: parameters of the backend, e.g. nprobe (recall/latency knob) and min_train_size for 'ivf'
+    """
+
+    global __index_config
+    global __index
+
+    create_index(backend, **params)
+    __index_config = dict(params, backend=backend)
+    __index = None
+    if persistent:
+        _update_config_file({'index': __index_config})
+
 def open_db():
 
+    global __storage
     global __engine
+    global __index
+    global __db_uuid
     global Session
 
-    __engine = create_engine('sqlite:///{}'.format(get_db_file()))
-    if get_db_file().exists():
-        log.info("Use existing database ({})...".format(get_db_file()))
+    __index = None
+    if __engine is not None:
+        __engine.dispose()
+    __storage = create_storage(get_db_url(), **__storage_config)
+    __engine = __storage.create_engine()
+    if __storage.mtime() is not None:
+        log.info("Use existing database ({})...".format(__storage))
     else:
-        log.info("Create new empty database ({})...".format(get_db_file()))
+        log.info("Open database ({})...".format(__storage))
+    with __engine.begin() as connection:
+        __storage.prepare(connection)
     Base.metadata.create_all(__engine)
     session_factory = sessionmaker(bind=__engine)
     Session = scoped_session(session_factory)
 
+    with __engine.begin() as connection:
+        __storage.finalize(connection)
+        _assure_columns(connection)
+        _assure_exemplars(connection)
+        __db_uuid = _assure_uuid(connection)
+        if __storage.vector_search:
+            return
+        nlegacy = connection.execute(text('SELECT count(*) FROM persons WHERE length(code) = 1024')).scalar()
+    if nlegacy > 0:
+        log.warning("{} face codes in the old float64 format, call migrate_db() to convert them...".format(nlegacy))
+
+def _assure_columns(connection):
+    # columns added to the persons table since it was created
+    columns = {c['name'] for c in inspect(connection).get_columns('persons')}
+    if 'hits' not in columns:
+        connection.execute(text('ALTER TABLE persons ADD COLUMN hits INTEGER NOT NULL DEFAULT 0'))
+    if 'last_seen' not in columns:
+        log.info("add the identification statistics to the persons...")
+        connection.execute(text('ALTER TABLE persons ADD COLUMN last_seen FLOAT'))
+        # the unknown faces start to age now
+        connection.execute(text('UPDATE persons SET last_seen = :now'), {'now': time.time()})
+
+def _assure_uuid(connection):
+    # created once per database, copies of the database file share it
+    table = DbInfo.__table__
+    value = connection.execute(table.select().where(table.c.key == 'uuid')).fetchone()
+    if value is not None:
+        return value.value
+    value = str(uuid.uuid4())
+    connection.execute(table.insert().values(key='uuid', value=value))
+    return value
+
+def _assure_exemplars(connection):
+    # persons of databases without the face_codes table start with their centroid as single exemplar
+    nmissing = connection.execute(text('INSERT INTO face_codes (person_id, code, weight) '
+                                       'SELECT id, code, nmeans FROM persons '
+                                       'WHERE id NOT IN (SELECT person_id FROM face_codes)')).rowcount
+    if nmissing > 0:
+        log.info("created the exemplars of {} persons...".format(nmissing))
+
+def migrate_db(dtype=None, vacuum=True):
+    """
+    rewrites all face codes of the database in the current storage format (see set_code_dtype) and compacts the
+    database file.
+    Args:
+        dtype: (str, optional) storage format to convert to, defaults to the configured one
+        vacuum: (bool) reclaim the freed space of the database file
+
+    Returns:
+        (int) number of converted face codes, centroids and exemplars
+    """
+
+    global __index
+
+    if dtype is not None:
+        set_code_dtype(dtype)
+    if Session is not None:
+        Session.remove()
+    __index = None
+
+    if __storage.vector_search:
+        log.info("face codes are stored in vector columns, nothing to convert")
+        return 0
+
+    log.info("convert face codes to {}...".format(__code_dtype))
+    nrows = 0
+    with __engine.begin() as connection:
+        for table in ('persons', 'face_codes'):
+            rows = connection.execute(text('SELECT id, code FROM {}'.format(table))).fetchall()
+            if len(rows) > 0:
+                connection.execute(text('UPDATE {} SET code = :code WHERE id = :id'.format(table)),
+                                   [{'id': id, 'code': encode_facecode(decode_facecode(code))} for id, code in rows])
+            nrows += len(rows)
+    if vacuum and __engine.dialect.name == 'sqlite':
+        with __engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+    return nrows
+
 def assert_session(session=None):
     if Session is None:
         open_db()
@@ -132,6 +558,240 @@ def persons(session=None):
     session = assert_session(session)
     return session.query(Person).order_by(asc(Person.id)).all()
 
+def get_index(session=None):
+    """
+    returns the resident index of the exemplar codes of all persons, loads it on first use. Its keys carry the
+    person id in the upper 32 bits.
+    Args:
+        session: (sqlalchemy.Session, optional) session to use for the initial load
+
+    Returns:
+        (faceindex.FaceIndex)
+    """
+
+    global __index
+
+    if __index is None:
+        session = assert_session(session)
+        if session.info.get(_index_changes):
+            # load the committed exemplars only, the session applies its changes on commit
+            with contextlib.closing(Session.session_factory()) as committed:
+                return get_index(committed)
+        with session.no_autoflush:
+            __index = _load_index(session)
+        if __snapshot_generation is not None:
+            # catch up with the changes since the snapshot was written
+            sync_index(session)
+    return __index
+
+def _load_index(session, snapshot=True):
+
+    global __snapshot_generation
+    global __index_revision
+
+    params = get_index_config()
+    backend = params.pop('backend')
+    index = None
+    __snapshot_generation = None
+    # read the revision first, changes committed while loading are applied again by the next sync
+    revision = _revision(session)
+    if _index_file_is_current():
+        log.info("load face index from {}...".format(get_index_file()))
+        index = load_index(get_index_file(), **params)
+        if not isinstance(index, backends[backend]):
+            index = None
+    snapshot_file = get_snapshot()
+    meta = snapshot_file.meta() if snapshot and index is None else None
+    if meta is not None and meta.get('database') != __db_uuid:
+        log.info("snapshot {} belongs to another database, ignore it...".format(snapshot_file.path))
+        meta = None
+    # a snapshot of a known revision is brought up to date by the change log
+    if meta is not None and (meta.get('revision', revision + 1) <= revision or _is_current(snapshot_file.meta_file)):
+        ids, codes, meta = snapshot_file.read()
+        if backend == 'exact' and codes.dtype == np.dtype(params.get('dtype', np.float64)):
+            # zero copy, the pages are shared with all processes mapping the snapshot
+            log.info("map face index from snapshot {}...".format(snapshot_file.path))
+            index = FaceIndex.from_arrays(ids, codes, snapshot_file.norms(meta))
+        else:
+            log.info("load face index from snapshot {}...".format(snapshot_file.path))
+            index = create_index(backend, **params)
+            index.build(ids, codes)
+        __snapshot_generation = meta['generation']
+        revision = meta.get('revision', revision)
+    if index is None:
+        log.info("load face index from database...")
+        index = create_index(backend, **params)
+        rows = session.query(Exemplar.person_id, Exemplar.id, Exemplar.code).all()
+        index.build([_exemplar_key(person_id, id) for person_id, id, _ in rows], [code for _, _, code in rows])
+    __index_revision = revision
+    return index
+
+def _revision(session):
+    return session.query(func.max(FaceChange.id)).scalar() or 0
+
+def sync_index(session=None):
+    """
+    applies the exemplars inserted, updated or deleted by other processes since the last call to the resident
+    index, by the change log of the database. The index is only reloaded if the log was pruned in the meantime.
+    identify_person(s) and find_similar_persons call it at most every sync interval (see set_sync_interval).
+    Args:
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (int) number of applied changes
+    """
+
+    global __last_sync
+
+    if __index is None or get_storage().vector_search:
+        return 0
+    session = assert_session(session)
+    if session.info.get(_index_changes):
+        # the log holds the uncommitted changes of the session, sync after its commit
+        return 0
+    __last_sync = time.monotonic()
+    with session.no_autoflush:
+        return _apply_changes(session)
+
+def _apply_changes(session):
+
+    global __index
+    global __index_revision
+
+    changes = session.query(FaceChange.id, FaceChange.person_id, FaceChange.exemplar_id) \
+        .filter(FaceChange.id > __index_revision).order_by(asc(FaceChange.id)).all()
+    if len(changes) == 0:
+        return 0
+    # gaps in the ids (e.g. of rolled back sequence values) are no loss, only entries pruned after the revision are
+    pruned = session.get(DbInfo, 'pruned_revision')
+    if pruned is not None and int(pruned.value) > __index_revision:
+        log.info("face change log pruned since revision {}, reload face index...".format(__index_revision))
+        __index = _load_index(session, snapshot=False)
+        return len(changes)
+
+    # the current state of every changed exemplar, deleted ones are gone
+    exemplars = {exemplar_id: person_id for _, person_id, exemplar_id in changes}
+    ids = list(exemplars)
+    codes = {}
+    for start in range(0, len(ids), 500):
+        codes.update((id, code) for id, code in session.query(Exemplar.id, Exemplar.code)
+                     .filter(Exemplar.id.in_(ids[start:start + 500])))
+    for exemplar_id, person_id in exemplars.items():
+        if exemplar_id in codes:
+            __index.add(_exemplar_key(person_id, exemplar_id), codes[exemplar_id])
+        else:
+            __index.remove(_exemplar_key(person_id, exemplar_id))
+    __index_revision = changes[-1][0]
+    log.debug("applied {} face changes up to revision {}".format(len(changes), __index_revision))
+    return len(changes)
+
+def _synced_index(session):
+    if __index is not None and time.monotonic() - __last_sync >= __sync_interval:
+        sync_index(session)
+    return get_index(session)
+
+def prune_changes(keep=10000, session=None):
+    """
+    deletes all but the last entries of the change log. Processes which did not sync since reload their index.
+    Args:
+        keep: (int) number of entries to keep
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (int) number of deleted entries
+    """
+    session = assert_session(session)
+    with transaction(session):
+        pruned = _revision(session) - keep
+        ndeleted = session.query(FaceChange).filter(FaceChange.id <= pruned).delete(synchronize_session=False)
+        if ndeleted > 0:
+            # the low-water mark of the log, processes behind it missed changes
+            session.merge(DbInfo(key='pruned_revision', value=str(pruned)))
+    return ndeleted
+
+def _is_current(path):
+    # only files next to a local database can be checked against its last commit
+    mtime = get_storage().mtime()
+    if not path.exists() or mtime is None:
+        return False
+    return path.stat().st_mtime >= mtime
+
+def _index_file_is_current():
+    return _is_current(get_index_file())
+
+def save_index():
+    """
+    stores the face index next to the database file, it is reloaded from there as long as the database is unchanged.
+    """
+    index = get_index()
+    log.info("save face index to {}...".format(get_index_file()))
+    # numpy appends .npz to paths without it, write to a temporary archive and swap it in
+    tmp_file = get_index_file().with_name('tmp.' + __index_file)
+    index.save(tmp_file)
+    os.replace(str(tmp_file), str(get_index_file()))
+
+def save_snapshot(session=None):
+    """
+    writes the ids and codes of all persons to a snapshot next to the database that other processes map in
+    milliseconds instead of loading the persons from the database (see snapshot.Snapshot). An existing snapshot is
+    only rewritten if it changed, to the files of a new generation: readers which mapped the old one are not affected.
+    The snapshot records the database and the revision of its change log, processes mapping it apply the later
+    changes only.
+    Once a snapshot exists, close() keeps it up to date.
+    Args:
+        session: (sqlalchemy.Session, optional) session to use to load the index
+
+    Returns:
+        (int) the generation of the snapshot
+    """
+
+    global __snapshot_generation
+
+    index = get_index(session)
+    ids, codes = np.asarray(index.ids), np.asarray(index.codes)
+    snapshot = get_snapshot()
+    revision = __index_revision
+    log.info("save face snapshot {}...".format(snapshot.path))
+    meta = snapshot.meta()
+    if meta is not None and np.dtype(meta['dtype']) == codes.dtype and meta.get('revision') == revision and \
+            meta.get('database') == __db_uuid:
+        old_ids, old_codes, generation = snapshot.load()
+        if len(old_ids) == len(ids) and np.all(old_ids == ids) and np.all(old_codes == codes):
+            # unchanged, but current again
+            os.utime(str(snapshot.meta_file))
+            __snapshot_generation = generation
+            return generation
+
+    newer = []
+
+    def replace(current):
+        # a process with a later revision of the same database wrote the current snapshot
+        if current.get('database') == __db_uuid and current.get('revision', 0) > revision:
+            newer.append(current)
+        return len(newer) == 0
+
+    generation = snapshot.write(ids, codes, replace=replace, revision=revision, database=__db_uuid)
+    if len(newer) > 0:
+        log.info("keep the newer face snapshot of revision {}".format(newer[0]['revision']))
+    else:
+        __snapshot_generation = generation
+    return generation
+
+def refresh_index():
+    """
+    drops the resident index if it was mapped from a snapshot that changed since, it is mapped again on next use.
+
+    Returns:
+        (bool) True if the index was dropped
+    """
+
+    global __index
+
+    if __snapshot_generation is not None and get_snapshot().generation() != __snapshot_generation:
+        __index = None
+        return True
+    return False
+
 def find_similar_persons(encoding, session=None):
     """
     returns the sql persons with similar faces corresponding to the encoding, sorted by similarity.
@@ -144,17 +804,22 @@ def find_similar_persons(encoding, session=None):
     """
     session = assert_session(session)
 
-    #TODO: remove loading of all encodings
-    _persons = [p.code for p in persons()]
-    if len(_persons) < 1:
-        return []
-    encodings = np.vstack(_persons)
-    distances = np.sqrt(np.sum((encodings - encoding[None,:])**2,axis=1))
-    #I = np.argsort(distances)
-    I = np.where(distances < __distance_threshold)[0]
-    similar_persons = np.asarray(session.query(Person).filter(Person.id.in_((I+1).tolist())).all())
-    similar_persons = similar_persons[np.argsort(distances[I])].tolist()
-    return similar_persons
+    if get_storage().vector_search:
+        # filter and sort in the database, the distance of a person is the one of its closest exemplar
+        distance = func.min(_vector_distance(encoding)).label('distance')
+        rows = session.query(Exemplar.person_id, distance).group_by(Exemplar.person_id) \
+            .having(distance < __distance_threshold).order_by(distance).all()
+        ids = [id for id, _ in rows]
+    else:
+        keys, distances = _synced_index(session).search(encoding, __distance_threshold)
+        # the distance of a person is the one of its closest exemplar
+        ids, first = np.unique(_person_ids(keys), return_index=True)
+        ids = ids[np.argsort(first)]
+    # persons already loaded in the session are served from its identity map
+    query = session.query(Person)
+    persons = [query.get(int(id)) for id in ids]
+    # persons indexed by a newer transaction than the one of the session are skipped
+    return [p for p in persons if p is not None]
 
 
 def get_person(name=None, id=None, session=None):
@@ -179,6 +844,43 @@ def get_person(name=None, id=None, session=None):
     else:
         raise ValueError("either name or id must be specified!")
 
+_transaction_depth = 'facedb.transaction_depth'
+
+def _autocommit(session):
+    return not nocommit and session.info.get(_transaction_depth, 0) == 0
+
+@contextlib.contextmanager
+def transaction(session=None):
+    """
+    groups many identify_person(s), teach and delete_person calls into a single transaction, committed (one sync
+    to disk) when the block exits and rolled back on an exception. Transactions nest, only the outermost commits.
+
+        with facedb.transaction() as session:
+            for code in codes:
+                facedb.identify_person(code, session)
+
+    Args:
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        context manager yielding the session
+    """
+
+    session = assert_session(session)
+    outermost = _autocommit(session)
+    depth = session.info.get(_transaction_depth, 0)
+    session.info[_transaction_depth] = depth + 1
+    try:
+        yield session
+    except:
+        session.info[_transaction_depth] = depth
+        if outermost:
+            session.rollback()
+        raise
+    session.info[_transaction_depth] = depth
+    if outermost:
+        session.commit()
+
 def teach(facecode, name=None, id=None, weight=1.0, session=None):
     """
     teach the classifier that the facecode is of the specified person
@@ -195,29 +897,94 @@ def teach(facecode, name=None, id=None, weight=1.0, session=None):
     facecode = np.asarray(facecode)
     session = assert_session(session)
 
-    try:
-        p = get_person(name, id)
-
-    except NoResultFound:
+    with transaction(session):
+        try:
+            p = get_person(name, id, session=session)
 
-        if name is None:
-            raise ValueError("face unknown and no name is specified! Specify a name...")
+        except NoResultFound:
 
-        # find similar face and update name
-        p = identify_person(facecode, session)
-        p.name = name
+            if name is None:
+                raise ValueError("face unknown and no name is specified! Specify a name...")
 
-    # teach
-    # update the centroid
-    new_nmeans = p.nmeans + weight
-    p.code = ((p.code * p.nmeans) + facecode * weight) / new_nmeans
-    p.nmeans = new_nmeans
+            # find similar face and update name
+            p = identify_person(facecode, session)
+            p.name = name
 
-    if not nocommit:
-        session.commit()
+        # teach
+        # update the centroid
+        new_nmeans = p.nmeans + weight
+        p.code = ((p.code * p.nmeans) + facecode * weight) / new_nmeans
+        p.nmeans = new_nmeans
+        _add_exemplar(p, facecode, weight)
 
     return p
 
+def _merge_exemplars(a, b):
+    # merges exemplar a into b
+    weight = a.weight + b.weight
+    b.code = (a.code * a.weight + b.code * b.weight) / weight
+    b.weight = weight
+
+def _add_exemplar(p, facecode, weight):
+    exemplars = list(p.exemplars)
+    if len(exemplars) > 0:
+        codes = np.vstack([e.code for e in exemplars])
+        distances = np.sqrt(np.sum((codes - facecode[None, :]) ** 2, axis=1))
+        j = np.argmin(distances)
+        if distances[j] < __exemplar_config['merge_distance'] or __exemplar_config['max_exemplars'] == 1:
+            _merge_exemplars(Exemplar(code=facecode, weight=weight), exemplars[j])
+            return
+
+    exemplars.append(Exemplar(code=facecode, weight=weight))
+    p.exemplars.append(exemplars[-1])
+    if len(exemplars) > __exemplar_config['max_exemplars']:
+        # prune, merge the two closest exemplars
+        codes = np.vstack([e.code for e in exemplars])
+        distances = np.sqrt(np.sum((codes[:, None, :] - codes[None, :, :]) ** 2, axis=2))
+        distances[np.diag_indices(len(codes))] = np.inf
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        _merge_exemplars(exemplars[i], exemplars[j])
+        p.exemplars.remove(exemplars[i])
+
+def _vector_distance(code):
+    # euclidean distance operator of pgvector, the code is bound as vector by the column type
+    return Exemplar.code.op('<->', return_type=Float)(np.asarray(code))
+
+def _nearest_persons(facecodes, session):
+    if get_storage().vector_search:
+        ids = np.full(len(facecodes), -1, dtype=np.int64)
+        for i, code in enumerate(facecodes):
+            distance = _vector_distance(code)
+            row = session.query(Exemplar.person_id, distance).filter(distance < __distance_threshold) \
+                .order_by(distance).limit(1).first()
+            if row is not None:
+                ids[i] = row[0]
+        return ids
+
+    index = _synced_index(session)
+    keys, distances = index.nearest(facecodes, __distance_threshold)
+    changes = session.info.get(_index_changes)
+    if changes:
+        keys = _nearest_changed(index, facecodes, keys, distances, changes)
+    # the nearest exemplar over all persons is the one of the person with the minimal distance
+    return _person_ids(keys)
+
+def _nearest_changed(index, facecodes, keys, distances, changes):
+    # the uncommitted exemplar changes of the session take precedence over the shared index
+    changed = np.fromiter(changes, dtype=np.int64, count=len(changes))
+    for i in np.flatnonzero(np.isin(keys, changed)):
+        found, found_distances = index.search(facecodes[i], __distance_threshold)
+        valid = np.flatnonzero(~np.isin(found, changed))
+        keys[i], distances[i] = (found[valid[0]], found_distances[valid[0]]) if len(valid) > 0 else (-1, np.inf)
+    added = [key for key, code in changes.items() if code is not None]
+    if len(added) > 0:
+        codes = np.vstack([changes[key] for key in added])
+        matrix = np.sqrt(np.sum((facecodes[:, None, :] - codes[None, :, :]) ** 2, axis=2))
+        J = np.argmin(matrix, axis=1)
+        closer = matrix[np.arange(len(facecodes)), J] < np.minimum(distances, __distance_threshold)
+        keys[closer] = np.asarray(added, dtype=np.int64)[J[closer]]
+    return keys
+
 def identify_person(facecode, session=None):
     """
     search for similar faces in database, return most similar person and assure the entry for every unknown face.
@@ -229,28 +996,284 @@ def identify_person(facecode, session=None):
         (facedb.Person)
     """
 
-    facecode = np.asarray(facecode)
+    return identify_persons(np.asarray(facecode)[None, :], session)[0]
+
+def identify_persons(facecodes, session=None):
+    """
+    search for similar faces in database for a batch of face codes, return the most similar person for every code
+    and assure the entry for every unknown face. All new entries are added in a single transaction.
+    Args:
+        facecodes: (np.array) (M, 128) face feature vectors.
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (list of facedb.Person) in the order of the face codes
+    """
+
+    facecodes = np.atleast_2d(np.asarray(facecodes))
     session = assert_session(session)
 
-    similar_persons = find_similar_persons(facecode)
+    ids = _nearest_persons(facecodes, session)
+
+    query = session.query(Person)
+    persons = [query.get(int(id)) if id >= 0 else None for id in ids]
+    for i in np.flatnonzero(ids >= 0):
+        if persons[i] is None:
+            # indexed by a newer transaction than the one of the session, like an unknown face
+            log.debug("person {} not visible to the session".format(ids[i]))
+            ids[i] = -1
 
-    if len(similar_persons) == 0:
+    # unknown faces, several codes of the same new face in the batch share one entry
+    new_persons = []
+    for i in np.flatnonzero(ids < 0):
+        if len(new_persons) > 0:
+            new_codes = np.vstack([p.code for p in new_persons])
+            distances = np.sqrt(np.sum((new_codes - facecodes[i][None, :]) ** 2, axis=1))
+            j = np.argmin(distances)
+            if distances[j] < __distance_threshold:
+                persons[i] = new_persons[j]
+                continue
         log.info("found unknown face add to database...")
-        p = Person(name=unknown_tag, code=facecode)
+        p = Person(name=unknown_tag, code=facecodes[i])
         session.add(p)
+        new_persons.append(p)
+        persons[i] = p
 
-    elif len(similar_persons) == 1:
-        p = similar_persons[0]
+    if len(new_persons) > 0:
+        # assign the ids and index the new faces right away
+        session.flush()
 
-    else:
-        log.info("found multiple candidates but return the most similar...")
-        p = similar_persons[0]
+    _touch(persons)
 
-    if not nocommit:
+    if _autocommit(session):
         session.commit()
 
+    return persons
+
+def _touch(persons):
+    now = time.time()
+    with __hits_lock:
+        for p in persons:
+            hits, _ = __hits.get(p.id, (0, now))
+            __hits[p.id] = (hits + 1, now)
+
+def flush_hits():
+    """
+    writes the number and time of the identifications of the persons, accumulated in memory by
+    identify_person(s), to the database. It runs in a session of its own, close() and the compaction flush the
+    statistics of their process. The counts stay in memory if the write fails.
+
+    Returns:
+        (int) number of updated persons
+    """
+
+    global __hits
+
+    with __hits_lock:
+        pending, __hits = __hits, {}
+    if len(pending) == 0:
+        return 0
+    if Session is None:
+        open_db()
+    table = Person.__table__
+    statement = table.update().where(table.c.id == bindparam('person_id')) \
+        .values(hits=table.c.hits + bindparam('nhits'), last_seen=bindparam('seen'))
+    try:
+        with contextlib.closing(Session.session_factory()) as session, transaction(session):
+            session.connection().execute(statement, [{'person_id': id, 'nhits': hits, 'seen': seen}
+                                                     for id, (hits, seen) in pending.items()])
+    except Exception:
+        # back to the identifications since, for the next flush
+        with __hits_lock:
+            for id, (hits, seen) in pending.items():
+                later_hits, later_seen = __hits.get(id, (0, seen))
+                __hits[id] = (hits + later_hits, max(seen, later_seen))
+        raise
+    return len(pending)
+
+def merge_persons(source, target, session=None):
+    """
+    merges the source person into the target person like teaching the source codes with their weights: the
+    centroid becomes the nmeans weighted mean, the exemplars are added to the ones of the target and the source is
+    deleted.
+    Args:
+        source: (facedb.Person) person to merge, e.g. a duplicate unknown face
+        target: (facedb.Person) person to keep
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (facedb.Person) the target
+    """
+
+    session = assert_session(session)
+
+    with transaction(session):
+        new_nmeans = target.nmeans + source.nmeans
+        target.code = (target.code * target.nmeans + source.code * source.nmeans) / new_nmeans
+        target.nmeans = new_nmeans
+        target.hits = (target.hits or 0) + (source.hits or 0)
+        target.last_seen = max(target.last_seen or 0., source.last_seen or 0.) or None
+        for e in list(source.exemplars):
+            _add_exemplar(target, e.code, e.weight)
+        session.delete(source)
+
+    return target
+
+def delete_person(name=None, id=None, session=None):
+    """
+    deletes the person from the face database
+    Args:
+        name: (str) name of the person in the face database (either name or id has to be specified)
+        id: (int) id of the person in the face database (either name or id has to be specified)
+        session: (sqlalchemy.Session, optional)
+
+    Returns:
+        (facedb.Person) the deleted person
+    """
+
+    session = assert_session(session)
+
+    with transaction(session):
+        p = get_person(name, id, session=session)
+        session.delete(p)
+        session.flush()
+
     return p
 
+class WriteBehind(object):
+    """
+    applies the identify and teach calls of any thread on a background thread, in batched transactions. The new
+    unknown persons and centroid updates of up to max_batch_size calls arriving within max_delay are written with
+    one commit, e.g. for camera threads that must not wait for the disk.
+
+        writer = facedb.WriteBehind()
+        future = writer.identify(codes)
+        ...
+        persons = future.result()
+    """
+
+    def __init__(self, max_batch_size=256, max_delay=0.05):
+        """
+        Args:
+            max_batch_size: (int) maximal number of calls per transaction
+            max_delay: (float) seconds to wait for further calls before committing
+        """
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.ncommits = 0
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _submit(self, kind, args):
+        future = Future()
+        self._tasks.put((kind, args, future))
+        return future
+
+    def identify(self, facecodes):
+        """
+        Args:
+            facecodes: (np.array) (M, 128) face feature vectors.
+
+        Returns:
+            (Future) of the list of (detached) facedb.Person in the order of the face codes
+        """
+        return self._submit('identify', (np.atleast_2d(np.asarray(facecodes)),))
+
+    def teach(self, facecode, name=None, id=None, weight=1.0):
+        """
+        see teach
+
+        Returns:
+            (Future) of the (detached) facedb.Person
+        """
+        return self._submit('teach', (np.asarray(facecode), name, id, weight))
+
+    def flush(self):
+        """ blocks until all calls submitted before are committed """
+        self._submit('flush', ()).result()
+
+    def close(self):
+        """ commits the pending calls and stops the writer """
+        self._tasks.put(None)
+        self._thread.join()
+
+    def _run(self):
+        # the persons handed out keep their loaded attributes after the commit
+        session = Session.session_factory(expire_on_commit=False)
+        try:
+            stop = False
+            while not stop:
+                task = self._tasks.get()
+                if task is None:
+                    break
+                batch = [task]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch_size and batch[-1][0] != 'flush':
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        task = self._tasks.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if task is None:
+                        stop = True
+                        break
+                    batch.append(task)
+                self._apply(session, batch)
+        finally:
+            session.close()
+
+    def _apply(self, session, batch):
+        results = []
+        try:
+            with transaction(session):
+                identify = []
+                for kind, args, future in batch:
+                    if kind == 'identify':
+                        # consecutive lookups are a single batch
+                        identify.append((args[0], future))
+                        continue
+                    self._identify(session, identify, results)
+                    identify = []
+                    if kind == 'teach':
+                        try:
+                            results.append((future, teach(*args, session=session)))
+                        except Exception as e:
+                            # only fails this call
+                            future.set_exception(e)
+                    else:
+                        results.append((future, None))
+                self._identify(session, identify, results)
+        except Exception as e:
+            log.exception("write behind transaction failed")
+            for kind, args, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.ncommits += 1
+        session.expunge_all()
+        for future, result in results:
+            future.set_result(result)
+
+    @staticmethod
+    def _identify(session, identify, results):
+        if len(identify) == 0:
+            return
+        persons = identify_persons(np.vstack([codes for codes, future in identify]), session)
+        start = 0
+        for codes, future in identify:
+            results.append((future, persons[start:start + len(codes)]))
+            start += len(codes)
+
 def close():
+    if Session is not None and len(__hits) > 0:
+        flush_hits()
+    if __index is not None and __index_config['backend'] != 'exact':
+        # keep the trained partition for the next start
+        save_index()
+    if __index is not None and get_snapshot().exists():
+        save_snapshot()
     if Session is not None:
         Session.remove()
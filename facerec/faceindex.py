@@ -0,0 +1,491 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import logging
+import threading
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class FaceIndex(object):
+    """ resident matrix of face codes with a parallel id array for vectorized nearest neighbour lookups. """
+
+    def __init__(self, dim=128, dtype=np.float64, capacity=1024):
+        """
+        creates an empty index.
+        Args:
+            dim: (int) dimension of the face codes
+            dtype: (np.dtype, default float64) dtype of the code matrix (float32 halves the memory)
+            capacity: (int) number of rows to preallocate, grows by doubling
+        """
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.RLock()
+        self._allocate(max(int(capacity), 1))
+        self._size = 0
+        self._rows = {}
+
+    def _allocate(self, capacity):
+        self._codes = np.empty((capacity, self.dim), dtype=self.dtype)
+        self._norms = np.empty(capacity, dtype=self.dtype)
+        self._ids = np.empty(capacity, dtype=np.int64)
+
+    def _grow(self, capacity):
+        codes, norms, ids = self._codes, self._norms, self._ids
+        self._allocate(capacity)
+        self._codes[:self._size] = codes[:self._size]
+        self._norms[:self._size] = norms[:self._size]
+        self._ids[:self._size] = ids[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    @property
+    def ids(self):
+        """ (np.array) ids of the indexed codes in row order """
+        return self._ids[:self._size]
+
+    @property
+    def codes(self):
+        """ (np.array) contiguous (N, dim) matrix of the indexed codes """
+        return self._codes[:self._size]
+
+    def _as_code(self, code):
+        code = np.asarray(code, dtype=self.dtype).ravel()
+        if code.shape[0] != self.dim:
+            raise ValueError("face code must have {} dimensions, got {}!".format(self.dim, code.shape[0]))
+        return code
+
+    def build(self, ids, codes):
+        """
+        replaces the content of the index.
+        Args:
+            ids: (iterable of int) ids of the codes
+            codes: (iterable of np.array) face codes, one per id
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        codes = np.asarray(codes, dtype=self.dtype).reshape(len(ids), self.dim)
+        with self._lock:
+            self._allocate(max(len(ids), 16))
+            self._size = len(ids)
+            self._codes[:self._size] = codes
+            self._norms[:self._size] = np.einsum('ij,ij->i', codes, codes)
+            self._ids[:self._size] = ids
+            self._rows = {int(id): row for row, id in enumerate(ids)}
+
+    @classmethod
+    def from_arrays(cls, ids, codes, norms=None):
+        """
+        creates an index on existing arrays without copying them, e.g. memory mapped snapshot files. The arrays
+        are written to on add, update and remove, map files copy on write. They are copied once the index grows.
+        Args:
+            ids: (np.array) (N,) int64 ids
+            codes: (np.array) (N, dim) face codes
+            norms: (np.array, optional) (N,) squared norms of the codes, computed if not given
+
+        Returns:
+            (FaceIndex)
+        """
+        index = cls(dim=codes.shape[1], dtype=codes.dtype, capacity=1)
+        with index._lock:
+            index._codes = codes
+            index._ids = ids
+            index._norms = np.einsum('ij,ij->i', codes, codes) if norms is None else norms
+            index._size = len(ids)
+            index._rows = {int(id): row for row, id in enumerate(ids)}
+        return index
+
+    def add(self, id, code):
+        """
+        adds the code of id to the index or replaces its code if the id is already indexed.
+        Args:
+            id: (int) id of the code
+            code: (np.array) face code
+        """
+        code = self._as_code(code)
+        id = int(id)
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                if self._size == self._codes.shape[0]:
+                    self._grow(max(2 * self._size, 16))
+                row = self._size
+                self._size += 1
+                self._rows[id] = row
+                self._ids[row] = id
+            self._codes[row] = code
+            self._norms[row] = code.dot(code)
+
+    update = add
+
+    def remove(self, id):
+        """
+        removes the code of id from the index, unknown ids are ignored.
+        Args:
+            id: (int) id of the code
+        """
+        with self._lock:
+            row = self._rows.pop(int(id), None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                # move the last row into the gap to keep the matrix contiguous
+                self._codes[row] = self._codes[last]
+                self._norms[row] = self._norms[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._size = last
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._rows = {}
+
+    def distances(self, code):
+        """
+        computes the euclidean distances of code to all indexed codes.
+        Args:
+            code: (np.array) face code
+
+        Returns:
+            (np.array) distances in row order
+        """
+        code = self._as_code(code)
+        with self._lock:
+            # |a-b|^2 = |a|^2 + |b|^2 - 2ab, a single matrix-vector product
+            squared = self.codes.dot(-2 * code)
+            squared += self._norms[:self._size]
+            squared += code.dot(code)
+        return np.sqrt(np.maximum(squared, 0, out=squared), out=squared)
+
+    def distance_matrix(self, codes):
+        """
+        computes the euclidean distances of many codes to all indexed codes.
+        Args:
+            codes: (np.array) (M, dim) face codes
+
+        Returns:
+            (np.array) (M, N) distances, columns in row order of the index
+        """
+        codes = np.asarray(codes, dtype=self.dtype).reshape(-1, self.dim)
+        with self._lock:
+            # a single matrix-matrix product for the whole batch
+            squared = codes.dot(-2 * self.codes.T)
+            squared += self._norms[None, :self._size]
+            squared += np.einsum('ij,ij->i', codes, codes)[:, None]
+        return np.sqrt(np.maximum(squared, 0, out=squared), out=squared)
+
+    def nearest(self, codes, threshold=None):
+        """
+        searches the most similar indexed code for every code of a batch.
+        Args:
+            codes: (np.array) (M, dim) face codes
+            threshold: (float, optional) only accept codes closer than threshold
+
+        Returns:
+            2-tuple (ids, distances) of length M, id is -1 where nothing was found
+        """
+        codes = np.asarray(codes, dtype=self.dtype).reshape(-1, self.dim)
+        ids = np.full(len(codes), -1, dtype=np.int64)
+        distances = np.full(len(codes), np.inf)
+        with self._lock:
+            if self._size == 0:
+                return ids, distances
+            matrix = self.distance_matrix(codes)
+            J = np.argmin(matrix, axis=1)
+            distances[:] = matrix[np.arange(len(codes)), J]
+            ids[:] = self._ids[J]
+        if threshold is not None:
+            ids[distances >= threshold] = -1
+        return ids, distances
+
+    def search(self, code, threshold=None, k=None):
+        """
+        searches the most similar indexed codes.
+        Args:
+            code: (np.array) face code
+            threshold: (float, optional) only return codes closer than threshold
+            k: (int, optional) maximal number of results
+
+        Returns:
+            2-tuple (ids, distances) sorted by distance
+        """
+        with self._lock:
+            distances = self.distances(code)
+            ids = self.ids.copy()
+        if threshold is not None:
+            I = np.flatnonzero(distances < threshold)
+        else:
+            I = np.arange(len(distances))
+        if k is not None and k < len(I):
+            I = I[np.argpartition(distances[I], k)[:k]]
+        I = I[np.argsort(distances[I], kind='stable')]
+        return ids[I], distances[I]
+
+    def save(self, path):
+        """
+        stores the index in a numpy archive.
+        Args:
+            path: (str, pathlib.Path) file to write
+        """
+        with self._lock:
+            np.savez(str(path), kind='exact', ids=self.ids, codes=self.codes)
+
+    @classmethod
+    def _from_archive(cls, archive, **kwargs):
+        index = cls(dim=archive['codes'].shape[1], **kwargs)
+        index.build(archive['ids'], archive['codes'])
+        return index
+
+
+class IVFFaceIndex(object):
+    """
+    approximate index that partitions the codes into inverted lists around k-means centroids and only
+    searches the nprobe lists closest to the query. Below min_train_size codes it searches exhaustively.
+    """
+
+    def __init__(self, dim=128, dtype=np.float64, nlist=None, nprobe=8, min_train_size=10000, niter=10):
+        """
+        creates an empty index.
+        Args:
+            dim: (int) dimension of the face codes
+            dtype: (np.dtype, default float64) dtype of the code matrices
+            nlist: (int, optional) number of inverted lists, defaults to 4*sqrt(N) at training
+            nprobe: (int) number of lists to search per query, the recall/latency knob
+            min_train_size: (int) number of codes from which on the index is partitioned
+            niter: (int) k-means iterations in training
+        """
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.niter = niter
+        self._lock = threading.RLock()
+        self._centroids = None
+        self._trained_size = 0
+        self._lists = [FaceIndex(dim, dtype)]
+        self._list_of = {}
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def __contains__(self, id):
+        return id in self._list_of
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    @property
+    def ids(self):
+        with self._lock:
+            return np.concatenate([l.ids for l in self._lists])
+
+    @property
+    def codes(self):
+        with self._lock:
+            return np.concatenate([l.codes for l in self._lists])
+
+    def _assign(self, codes, chunk=8192):
+        # nearest centroid for every code, in chunks to bound the size of the distance matrix
+        norms = np.einsum('ij,ij->i', self._centroids, self._centroids)
+        assignment = np.empty(len(codes), dtype=np.int64)
+        for start in range(0, len(codes), chunk):
+            squared = codes[start:start + chunk].dot(-2 * self._centroids.T)
+            squared += norms[None, :]
+            assignment[start:start + chunk] = np.argmin(squared, axis=1)
+        return assignment
+
+    def train(self, codes):
+        """
+        computes the centroids of the inverted lists with k-means.
+        Args:
+            codes: (np.array) (N, dim) training codes
+        """
+        codes = np.asarray(codes, dtype=self.dtype)
+        nlist = self.nlist or max(int(4 * np.sqrt(len(codes))), 1)
+        nlist = min(nlist, len(codes))
+        rng = np.random.RandomState(0)
+        sample = codes[rng.choice(len(codes), min(len(codes), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        log.info("train ivf index with {} lists on {} codes...".format(nlist, len(sample)))
+        for _ in range(self.niter):
+            self._centroids = centroids
+            assignment = self._assign(sample)
+            order = np.argsort(assignment, kind='stable')
+            filled, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            counts = np.diff(np.append(starts, len(sample)))
+            centroids[filled] = sums / counts[:, None]
+        self._centroids = centroids
+
+    def build(self, ids, codes):
+        """
+        replaces the content of the index, trains the lists if there are enough codes.
+        Args:
+            ids: (iterable of int) ids of the codes
+            codes: (iterable of np.array) face codes, one per id
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        codes = np.asarray(codes, dtype=self.dtype).reshape(len(ids), self.dim)
+        with self._lock:
+            if len(ids) >= self.min_train_size:
+                self.train(codes)
+                self._trained_size = len(ids)
+            else:
+                self._centroids = None
+            self._fill(ids, codes)
+
+    def _fill(self, ids, codes):
+        if self.trained:
+            assignment = self._assign(codes)
+            self._lists = []
+            for l in range(len(self._centroids)):
+                rows = np.flatnonzero(assignment == l)
+                index = FaceIndex(self.dim, self.dtype, capacity=16)
+                index.build(ids[rows], codes[rows])
+                self._lists.append(index)
+            self._list_of = dict(zip(ids.tolist(), assignment.tolist()))
+        else:
+            self._lists = [FaceIndex(self.dim, self.dtype)]
+            self._lists[0].build(ids, codes)
+            self._list_of = dict.fromkeys(ids.tolist(), 0)
+
+    def add(self, id, code):
+        """
+        adds the code of id to the index or replaces its code if the id is already indexed.
+        Args:
+            id: (int) id of the code
+            code: (np.array) face code
+        """
+        code = np.asarray(code, dtype=self.dtype).ravel()
+        id = int(id)
+        with self._lock:
+            self.remove(id)
+            l = int(self._assign(code[None, :])[0]) if self.trained else 0
+            self._lists[l].add(id, code)
+            self._list_of[id] = l
+            if len(self) >= max(self.min_train_size, 4 * self._trained_size):
+                # the partition got too coarse for the grown gallery, retrain
+                self.build(self.ids, self.codes)
+
+    update = add
+
+    def remove(self, id):
+        with self._lock:
+            l = self._list_of.pop(int(id), None)
+            if l is not None:
+                self._lists[l].remove(id)
+
+    def clear(self):
+        with self._lock:
+            self._centroids = None
+            self._trained_size = 0
+            self._fill(np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=self.dtype))
+
+    def search(self, code, threshold=None, k=None):
+        """
+        searches the most similar indexed codes in the nprobe closest lists.
+        Args:
+            code: (np.array) face code
+            threshold: (float, optional) only return codes closer than threshold
+            k: (int, optional) maximal number of results
+
+        Returns:
+            2-tuple (ids, distances) sorted by distance
+        """
+        code = np.asarray(code, dtype=self.dtype).ravel()
+        with self._lock:
+            if not self.trained:
+                return self._lists[0].search(code, threshold, k)
+            probes = np.argsort(np.sum((self._centroids - code[None, :]) ** 2, axis=1))[:self.nprobe]
+            results = [self._lists[l].search(code, threshold, k) for l in probes]
+        ids = np.concatenate([ids for ids, _ in results])
+        distances = np.concatenate([distances for _, distances in results])
+        I = np.argsort(distances, kind='stable')[:k]
+        return ids[I], distances[I]
+
+    def nearest(self, codes, threshold=None):
+        """
+        searches the most similar indexed code for every code of a batch.
+        Args:
+            codes: (np.array) (M, dim) face codes
+            threshold: (float, optional) only accept codes closer than threshold
+
+        Returns:
+            2-tuple (ids, distances) of length M, id is -1 where nothing was found
+        """
+        codes = np.asarray(codes, dtype=self.dtype).reshape(-1, self.dim)
+        ids = np.full(len(codes), -1, dtype=np.int64)
+        distances = np.full(len(codes), np.inf)
+        with self._lock:
+            if not self.trained:
+                return self._lists[0].nearest(codes, threshold)
+            for i, code in enumerate(codes):
+                found, found_distances = self.search(code, threshold, k=1)
+                if len(found):
+                    ids[i], distances[i] = found[0], found_distances[0]
+        return ids, distances
+
+    def save(self, path):
+        """
+        stores the index including the trained centroids in a numpy archive.
+        Args:
+            path: (str, pathlib.Path) file to write
+        """
+        with self._lock:
+            centroids = self._centroids if self.trained else np.empty((0, self.dim), dtype=self.dtype)
+            np.savez(str(path), kind='ivf', ids=self.ids, codes=self.codes, centroids=centroids,
+                     trained_size=self._trained_size)
+
+    @classmethod
+    def _from_archive(cls, archive, **kwargs):
+        index = cls(dim=archive['codes'].shape[1], **kwargs)
+        if len(archive['centroids']):
+            # reuse the persisted partition instead of training again
+            index._centroids = archive['centroids'].astype(index.dtype)
+            index._trained_size = int(archive['trained_size'])
+        index._fill(archive['ids'], archive['codes'].astype(index.dtype))
+        return index
+
+
+backends = {'exact': FaceIndex, 'ivf': IVFFaceIndex}
+
+
+def create_index(backend='exact', **kwargs):
+    """
+    creates an empty index.
+    Args:
+        backend: (str) one of the registered backends ('exact', 'ivf')
+        **kwargs: parameters passed to the index class
+
+    Returns:
+        (FaceIndex, IVFFaceIndex)
+    """
+    try:
+        cls = backends[backend]
+    except KeyError:
+        raise ValueError("unknown index backend '{}', use one of {}!".format(backend, sorted(backends)))
+    return cls(**kwargs)
+
+
+def load_index(path, **kwargs):
+    """
+    loads an index stored with save.
+    Args:
+        path: (str, pathlib.Path) file to read
+        **kwargs: parameters passed to the index class
+
+    Returns:
+        (FaceIndex, IVFFaceIndex)
+    """
+    with np.load(str(path)) as archive:
+        return backends[str(archive['kind'])]._from_archive(archive, **kwargs)
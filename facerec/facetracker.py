@@ -8,50 +8,472 @@ import uuid
 import numpy as np
 import time
 import copy
-from collections import deque
+import queue
 from multiprocessing import Manager, Event # Process as Thread
-from threading import Thread #as Process, Event
+from threading import Thread, Lock #as Process, Event
 
-from .dlib_api import detect_and_identify_faces, detect_faces
-from .facedb import assert_session, unknown_tag
-from .client import FacerecApi
+from .dlib_api import detect_and_identify_faces, detect_faces, describe_faces
+from .facedb import assert_session, identify_persons, unknown_tag
+from .client import FacerecApi, AsyncFacerecApi
+from .stream import VideoReader, LatencyStats
 
 import dlib
+try:
+    from scipy.optimize import linear_sum_assignment
+except ModuleNotFoundError:
+    # match_faces falls back to greedy matching
+    linear_sum_assignment = None
 
 log = logging.getLogger(__name__)
 
-_processes = []
+class CallbackExecutor(object):
+    """
+    runs the event callbacks on a fixed number of worker threads. All events of a track go to the same worker and
+    run in the order they were submitted (appeared -> identified -> disappeared).
+    """
+
+    policies = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, nworkers=2, maxsize=1000, policy='block'):
+        """
+        Args:
+            nworkers: (int) number of worker threads
+            maxsize: (int) maximal number of waiting events per worker (0 for unbounded)
+            policy: (str) what happens if a queue is full, 'block' waits for space (backpressure on the caller),
+                    'drop_newest' discards the new event, 'drop_oldest' discards the oldest waiting event
+        """
+        if policy not in self.policies:
+            raise ValueError("policy must be one of {}!".format(self.policies))
+        self.policy = policy
+        self.ndropped = 0
+        self.nexecuted = 0
+        self._lock = Lock()
+        self._queues = [queue.Queue(maxsize) for _ in range(nworkers)]
+        self._workers = [Thread(target=self._work, args=(q,), daemon=True) for q in self._queues]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            function, args = item
+            try:
+                function(*args)
+            except Exception:
+                log.exception("callback {} failed".format(function))
+            with self._lock:
+                self.nexecuted += 1
+
+    def submit(self, key, function, *args):
+        """
+        queues function(*args) on the worker of key.
+        Args:
+            key: (hashable) events with the same key run in order, e.g. the track id
+            function: (callable) function to call
+
+        Returns:
+            (bool) False if the event was dropped
+        """
+        q = self._queues[hash(key) % len(self._queues)]
+        if self.policy == 'block':
+            q.put((function, args))
+            return True
+        while True:
+            try:
+                q.put_nowait((function, args))
+                return True
+            except queue.Full:
+                with self._lock:
+                    self.ndropped += 1
+                if self.policy == 'drop_newest':
+                    log.warning("callback queue full, drop event...")
+                    return False
+                try:
+                    q.get_nowait()
+                    log.warning("callback queue full, drop oldest event...")
+                except queue.Empty:
+                    pass
+
+    def depth(self):
+        """ (int) number of events waiting in all queues """
+        return sum(q.qsize() for q in self._queues)
+
+    def depths(self):
+        """ (list of int) number of events waiting per worker """
+        return [q.qsize() for q in self._queues]
+
+    def shutdown(self, wait=True):
+        """
+        stops the workers after the events already queued.
+        Args:
+            wait: (bool) block until all queued events ran
+        """
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
 
 class Identifier(Thread):
-    def __init__(self, interval, function, args=[], kwargs={}):
+    def __init__(self, interval, function, args=[], kwargs={}, latency=None):
         super(Identifier, self).__init__()
         self.interval = interval
         self.function = function
         self.args = args
         self.kwargs = kwargs
+        # records the duration of the runs which identified faces
+        self.latency = latency if latency is not None else LatencyStats()
         self.canceled = Event()
         self.triggered = Event()
+        # new faces wait for the next run_once
+        self.pending = False
+        self.last_run = 0.
 
     def cancel(self):
         """Stop the timer if it hasn't finished yet"""
         self.canceled.set()
-        self.triggered.clear()
+        # wake up a waiting run loop
+        self.triggered.set()
 
     def trigger(self):
+        self.pending = True
         self.triggered.set()
         self.triggered.clear()
 
+    def due(self):
+        """ (bool) whether new faces appeared or the interval passed since the last run """
+        return self.pending or time.monotonic() - self.last_run >= self.interval
+
+    def run_once(self):
+        """ runs the identification on the calling thread, returns the number of identified faces """
+        self.pending = False
+        self.last_run = time.monotonic()
+        start = time.perf_counter()
+        nidentified = self.function(*self.args, **self.kwargs)
+        if nidentified:
+            self.latency.add(time.perf_counter() - start)
+        return nidentified or 0
+
     def run(self):
         while not self.canceled.is_set():
-            self.function(*self.args, **self.kwargs)
+            self.run_once()
             self.triggered.wait(self.interval)
 
 
 
+class _TrackState(object):
+    """ identification state of a single track """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_time = 0.
+        self.nidentified = 0
+        self.rect = None
+        self.signature = None
+        self.code_sum = None
+        self.ncodes = 0
+
+    def code(self):
+        return self.code_sum / self.ncodes
+
+    def add_code(self, code, reset_distance):
+        if self.ncodes > 0 and np.linalg.norm(code - self.code()) > reset_distance:
+            # looks like somebody else now, start a new average
+            self.code_sum = None
+            self.ncodes = 0
+        self.code_sum = code.copy() if self.code_sum is None else self.code_sum + code
+        self.ncodes += 1
+
+
+class IdentificationScheduler(object):
+    """
+    decides per track when it is identified again: new tracks come first, tracks whose identity is confirmed back off
+    exponentially, and tracks whose rectangle and appearance did not change reuse their last descriptor. Every track
+    keeps a running average of its face codes that is used for identification.
+    """
+
+    def __init__(self, min_interval=2., max_interval=30., backoff=2., max_faces_per_run=None,
+                 max_relative_shift=0.05, max_appearance_change=6., reset_distance=0.6):
+        """
+        Args:
+            min_interval: (float) seconds between identifications of new or changed tracks
+            max_interval: (float) maximal seconds between identifications of confirmed tracks
+            backoff: (float) factor to increase the interval by with every confirmation
+            max_faces_per_run: (int, optional) maximal number of tracks to identify per run
+            max_relative_shift: (float) rectangle shift relative to the face width that still counts as unchanged
+            max_appearance_change: (float) mean absolute gray value change of the face thumbnail that still counts
+                                   as unchanged
+            reset_distance: (float) face code distance from the running average that restarts the average
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_faces_per_run = max_faces_per_run
+        self.max_rel_shift = max_relative_shift
+        self.max_appearance_change = max_appearance_change
+        self.reset_distance = reset_distance
+        self._states = {}
+        self.ncomputed = 0
+        self.ncached = 0
+
+    @staticmethod
+    def _signature(frame, rect):
+        # coarse 8x8 gray thumbnail of the face to detect appearance changes cheaply
+        l, t, r, b = [int(c) for c in rect]
+        h, w = frame.shape[:2]
+        crop = frame[max(t, 0):min(b, h), max(l, 0):min(r, w)]
+        if crop.size == 0:
+            return None
+        if crop.ndim == 3:
+            crop = crop.mean(axis=2)
+        rows = np.linspace(0, crop.shape[0], 9).astype(int)
+        cols = np.linspace(0, crop.shape[1], 9).astype(int)
+        return np.add.reduceat(np.add.reduceat(crop, rows[:-1], axis=0), cols[:-1], axis=1) / \
+            np.outer(np.maximum(np.diff(rows), 1), np.maximum(np.diff(cols), 1))
+
+    def _unchanged(self, state, rect, signature):
+        if state.ncodes == 0 or signature is None or state.signature is None:
+            return False
+        w = max(abs(rect[2] - rect[0]), 1)
+        if np.max(np.abs(np.asarray(rect) - np.asarray(state.rect))) / w > self.max_rel_shift:
+            return False
+        return np.mean(np.abs(signature - state.signature)) <= self.max_appearance_change
+
+    def codes(self, frame, tracks, rects, now=None):
+        """
+        selects the tracks due for identification and returns their averaged codes, computes new descriptors only
+        for tracks that changed.
+        Args:
+            frame: (np.array) current frame
+            tracks: (list of dict) shared data of the tracked faces
+            rects: (list of 4-tuple) rectangles of the tracked faces
+
+        Returns:
+            3-tuple (tracks, rects, codes) of the tracks due
+        """
+        now = time.time() if now is None else now
+        ids = [face['id'] for face in tracks]
+        for track_id in set(self._states) - set(ids):
+            del self._states[track_id]
+        states = [self._states.setdefault(track_id, _TrackState(self.min_interval)) for track_id in ids]
+
+        due = [i for i, state in enumerate(states) if state.next_time <= now]
+        # new tracks first, then the longest overdue
+        due.sort(key=lambda i: (states[i].nidentified > 0, states[i].next_time))
+        if self.max_faces_per_run is not None:
+            due = due[:self.max_faces_per_run]
+
+        describe = []
+        for i in due:
+            signature = self._signature(frame, rects[i])
+            if self._unchanged(states[i], rects[i], signature):
+                self.ncached += 1
+            else:
+                describe.append((i, signature))
+
+        if len(describe) > 0:
+            faces = describe_faces(frame, [rects[i] for i, _ in describe])
+            for (i, signature), (facecode, rect, shape) in zip(describe, faces):
+                states[i].add_code(np.asarray(facecode), self.reset_distance)
+                states[i].rect = rects[i]
+                states[i].signature = signature
+                self.ncomputed += 1
+
+        return [tracks[i] for i in due], [rects[i] for i in due], [states[i].code() for i in due]
+
+    def identified(self, track_id, changed, now=None):
+        """
+        schedules the next identification of the track.
+        Args:
+            track_id: (str) id of the track
+            changed: (bool) whether the identification changed the identity of the track
+        """
+        now = time.time() if now is None else now
+        state = self._states.get(track_id)
+        if state is None:
+            return
+        if changed or state.nidentified == 0:
+            state.interval = self.min_interval
+        else:
+            state.interval = min(state.interval * self.backoff, self.max_interval)
+        state.nidentified += 1
+        state.next_time = now + state.interval
+
+
+def match_faces(track_coords, detection_coords, max_rel_shift):
+    """
+    assigns detections to tracks with minimal total cost. The cost of a pair is the centre distance relative to the
+    face size plus one minus the intersection over union, pairs whose centre moved more than max_rel_shift times the
+    width or height are not assigned.
+    Args:
+        track_coords: (np.array) (N, 4) rectangles (left, top, right, bottom) of the tracks
+        detection_coords: (np.array) (M, 4) rectangles of the detections
+        max_rel_shift: (float) maximal centre shift relative to the face size
+
+    Returns:
+        2-tuple (track rows, detection rows) of the assigned pairs
+    """
+    tracks = np.asarray(track_coords, dtype=float).reshape(-1, 4)
+    detections = np.asarray(detection_coords, dtype=float).reshape(-1, 4)
+    if len(tracks) == 0 or len(detections) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    w = np.maximum(tracks[:, 2] - tracks[:, 0], 1)[:, None]
+    h = np.maximum(tracks[:, 3] - tracks[:, 1], 1)[:, None]
+    dx = np.abs((tracks[:, None, 0] + tracks[:, None, 2]) - (detections[None, :, 0] + detections[None, :, 2])) / 2 / w
+    dy = np.abs((tracks[:, None, 1] + tracks[:, None, 3]) - (detections[None, :, 1] + detections[None, :, 3])) / 2 / h
+
+    iw = np.maximum(np.minimum(tracks[:, None, 2], detections[None, :, 2]) -
+                    np.maximum(tracks[:, None, 0], detections[None, :, 0]), 0)
+    ih = np.maximum(np.minimum(tracks[:, None, 3], detections[None, :, 3]) -
+                    np.maximum(tracks[:, None, 1], detections[None, :, 1]), 0)
+    intersection = iw * ih
+    area_tracks = ((tracks[:, 2] - tracks[:, 0]) * (tracks[:, 3] - tracks[:, 1]))[:, None]
+    area_detections = ((detections[:, 2] - detections[:, 0]) * (detections[:, 3] - detections[:, 1]))[None, :]
+    iou = intersection / np.maximum(area_tracks + area_detections - intersection, 1e-9)
+
+    cost = np.sqrt(dx ** 2 + dy ** 2) + (1 - iou)
+    feasible = (dx < max_rel_shift) & (dy < max_rel_shift)
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(np.where(feasible, cost, 1e6))
+        keep = feasible[rows, cols]
+        return rows[keep], cols[keep]
+
+    # greedy by cost, take the cheapest remaining pair first
+    rows, cols = np.nonzero(feasible)
+    order = np.argsort(cost[rows, cols], kind='stable')
+    assigned_rows, assigned_cols = set(), set()
+    pairs = []
+    for r, c in zip(rows[order], cols[order]):
+        if r not in assigned_rows and c not in assigned_cols:
+            assigned_rows.add(r)
+            assigned_cols.add(c)
+            pairs.append((r, c))
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+class TrackStore(object):
+    """ array backed positions of the tracked faces: a ring buffer of the last coordinates per track with running sums """
+
+    def __init__(self, nbuffer=5, capacity=16):
+        """
+        Args:
+            nbuffer: (int) number of frames the coordinates are averaged over
+            capacity: (int) number of tracks to preallocate, grows by doubling
+        """
+        self.nbuffer = nbuffer
+        self._allocate(max(int(capacity), 1))
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+
+    def _allocate(self, capacity):
+        self._buffer = np.zeros((capacity, self.nbuffer, 4))
+        self._sums = np.zeros((capacity, 4))
+        self._counts = np.zeros(capacity, dtype=int)
+        self._next = np.zeros(capacity, dtype=int)
+        self._missing = np.zeros(capacity, dtype=int)
+
+    def _grow(self, capacity):
+        arrays = (self._buffer, self._sums, self._counts, self._next, self._missing)
+        self._allocate(capacity)
+        for new, old in zip((self._buffer, self._sums, self._counts, self._next, self._missing), arrays):
+            new[:self._size] = old[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, track_id):
+        return track_id in self._rows
+
+    @property
+    def ids(self):
+        """ (list of str) track ids in row order """
+        return list(self._ids)
+
+    def rows(self, track_ids):
+        return np.asarray([self._rows[track_id] for track_id in track_ids], dtype=int)
+
+    def add(self, track_id, coords):
+        if self._size == len(self._counts):
+            self._grow(2 * self._size)
+        row = self._size
+        self._size += 1
+        self._ids.append(track_id)
+        self._rows[track_id] = row
+        self._sums[row] = 0
+        self._counts[row] = 0
+        self._next[row] = 0
+        self.update_in_frame([row], np.asarray(coords, dtype=float).reshape(1, 4))
+        return row
+
+    def remove(self, track_id):
+        row = self._rows.pop(track_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            for array in (self._buffer, self._sums, self._counts, self._next, self._missing):
+                array[row] = array[last]
+            self._ids[row] = self._ids[last]
+            self._rows[self._ids[row]] = row
+        self._ids.pop()
+        self._size = last
+
+    def update_in_frame(self, rows, coords):
+        """
+        appends new coordinates for the rows in one vectorized step.
+        Args:
+            rows: (np.array) rows of the tracks
+            coords: (np.array) (len(rows), 4) new coordinates
+        """
+        rows = np.asarray(rows, dtype=int)
+        if len(rows) == 0:
+            return
+        slots = self._next[rows]
+        full = (self._counts[rows] == self.nbuffer)[:, None]
+        self._sums[rows] -= np.where(full, self._buffer[rows, slots], 0)
+        self._buffer[rows, slots] = coords
+        self._sums[rows] += coords
+        self._next[rows] = (slots + 1) % self.nbuffer
+        self._counts[rows] = np.minimum(self._counts[rows] + 1, self.nbuffer)
+        self._missing[rows] = 0
+
+    def update_not_in_frame(self, rows):
+        self._missing[np.asarray(rows, dtype=int)] += 1
+
+    def missing(self, track_id):
+        return int(self._missing[self._rows[track_id]])
+
+    def coords(self, track_id=None):
+        """
+        averaged coordinates of a track or of all tracks in row order.
+        Args:
+            track_id: (str, optional) id of the track
+
+        Returns:
+            (np.array) 4 or (N, 4) ints
+        """
+        if track_id is not None:
+            row = self._rows[track_id]
+            return (self._sums[row] / self._counts[row]).round().astype(int)
+        n = self._size
+        return (self._sums[:n] / np.maximum(self._counts[:n], 1)[:, None]).round().astype(int)
+
+
 class FaceTracker(object):
     """ Trackes Faces in an concurent stream of images. """
     def __init__(self, url=None, max_relative_shift=0.8, avg_over_nframes=1, missing_tolerance_nframes=0,
-                 identification_interval=2, appearance_callback=None, identification_callback=None, disappearance_callback=None):
+                 identification_interval=2, appearance_callback=None, identification_callback=None, disappearance_callback=None,
+                 shared_state='local', identify_tracked_faces=False, schedule_identification=False,
+                 max_identification_interval=30, detect_every_nframes=1, min_tracking_quality=7.,
+                 callback_workers=2, callback_queue_size=1000, callback_policy='block', max_concurrent_requests=None,
+                 callbacks=None, identify_codes=None, copy_frames=True, detector=None):
         """
         creates a face tracker that identifies the tracked face with facerec engine. The requests to identify can be done locally
         or sent to a facerec server by specifying the url.
@@ -64,34 +486,118 @@ class FaceTracker(object):
             appearance_callback: (face->None) function to call on appeared faces
             identification_callback: (face->None) function to call on completed identification
             disappearance_callback: (face->None) function to call on disappeared faces
+            shared_state: (str) 'local' shares the tracked faces and the latest frame with the identifier thread
+                          in-process, 'manager' goes through a multiprocessing Manager as before
+            identify_tracked_faces: (bool) identify the faces on their tracked rectangles instead of detecting
+                          them again on the full frame, the cost scales with the number of faces not the resolution
+            schedule_identification: (bool) identify tracked faces per track (implies identify_tracked_faces):
+                          new tracks first, confirmed tracks back off up to max_identification_interval, unchanged
+                          tracks reuse their descriptor, and every track is identified with its averaged face code
+            max_identification_interval: (float) seconds a confirmed track is identified at the latest again
+            detect_every_nframes: (int) run the face detector only on every n-th frame and follow the faces with
+                          correlation trackers in between
+            min_tracking_quality: (float) peak to side lobe ratio of a correlation tracker below which the tracker
+                          is considered drifted and the detector runs again on the current frame
+            callback_workers: (int) number of threads running the callbacks
+            callback_queue_size: (int) maximal number of waiting callbacks per thread
+            callback_policy: (str) 'block', 'drop_newest' or 'drop_oldest' if the callbacks can not keep up,
+                          see CallbackExecutor
+            max_concurrent_requests: (int, optional) send the identification requests of all faces concurrently
+                          with up to this many requests in flight (server mode, requires aiohttp)
+            callbacks: (CallbackExecutor, optional) executor shared with other trackers for the callbacks, replaces
+                          callback_workers, callback_queue_size and callback_policy
+            identify_codes: (callable, optional) shared identification service, identifies a (N, 128) array of face
+                          codes and returns a person dict with 'name' and 'id' per code. The tracker identifies its
+                          tracked faces (implies identify_tracked_faces) with it and runs no identifier thread, the
+                          owner calls identify_faces when identification_due (see trackerpool.FaceTrackerPool)
+            copy_frames: (bool) the identifier works on a copy of the latest frame. False shares the frame passed
+                          to update without copying it ('local' shared_state only), the caller must not modify it
+                          afterwards, e.g. draw the tracked faces on it
+            detector: (callable, optional) face detector shared with other trackers, called like a dlib frontal face
+                          detector, detector(image) returns the face rectangles. Defaults to a detector of its own
         """
 
         self.max_rel_shift = max_relative_shift
         self.avg_over_nframes = avg_over_nframes
         self.missing_tol_nframes = missing_tolerance_nframes
-
-        self.detector = dlib.get_frontal_face_detector()
-
-        self.memory_manager = Manager()
-        self._shared = self.memory_manager.dict()
-        self._shared['tracked_faces'] = self.memory_manager.dict()
+        self.copy_frames = copy_frames
+
+        self.detector = dlib.get_frontal_face_detector() if detector is None else detector
+        self.detect_every_nframes = detect_every_nframes
+        self.min_tracking_quality = min_tracking_quality
+        self._correlation_trackers = []
+        self._nframes_since_detection = 0
+
+        if shared_state == 'local':
+            self.memory_manager = None
+            self._shared = {'tracked_faces': {}}
+        elif shared_state == 'manager':
+            self.memory_manager = Manager()
+            self._shared = self.memory_manager.dict()
+            self._shared['tracked_faces'] = self.memory_manager.dict()
+        else:
+            raise ValueError("shared_state must be either 'local' or 'manager'!")
         self.tracked_faces = {}
+        self._store = TrackStore()
+        # seconds per frame to decode (process only), to detect and track, and per identification run
+        self.latencies = {'decode': LatencyStats(), 'detect': LatencyStats(), 'identify': LatencyStats()}
+        self.reader = None
 
         self.appearance_callback = appearance_callback
         self.disappearance_callback = disappearance_callback
-
-        if url is not None:
-            self.api = FacerecApi(url)
-            self._identifier = Identifier(identification_interval, FaceTracker._verify_identify_server,
-                                          args=(self._shared, self.api, self.max_rel_shift,
-                                                identification_callback, disappearance_callback))
+        self._own_callbacks = callbacks is None
+        self.callbacks = CallbackExecutor(callback_workers, callback_queue_size, callback_policy) \
+            if callbacks is None else callbacks
+
+        # all events of a face go through the executor to keep their order
+        callbacks = self.callbacks
+        identification_callback = lambda face, cb=identification_callback: \
+            callbacks.submit(face['id'], FaceTracker._on_identification_proxy, face, cb)
+        disappearance_callback = lambda face, cb=disappearance_callback: \
+            callbacks.submit(face['id'], FaceTracker._on_disappearance_proxy, face, cb)
+
+        self.scheduler = None
+        if schedule_identification:
+            identify_tracked_faces = True
+            self.scheduler = IdentificationScheduler(identification_interval, max_identification_interval)
+
+        if identify_codes is not None:
+            self.api = None
+            identify = lambda codes: [(person['name'], person['id']) for person in identify_codes(codes)]
+            self._identifier = Identifier(identification_interval, FaceTracker._identify_tracks,
+                                          args=(self._shared, identify, self.scheduler,
+                                                identification_callback, disappearance_callback),
+                                          latency=self.latencies['identify'])
+        elif url is not None:
+            if max_concurrent_requests is not None:
+                self.api = AsyncFacerecApi(url, max_concurrency=max_concurrent_requests)
+            else:
+                self.api = FacerecApi(url)
+            if identify_tracked_faces:
+                self._identifier = Identifier(identification_interval, FaceTracker._identify_tracks_server,
+                                              args=(self._shared, self.api,
+                                                    identification_callback, disappearance_callback, self.scheduler),
+                                              latency=self.latencies['identify'])
+            else:
+                self._identifier = Identifier(identification_interval, FaceTracker._verify_identify_server,
+                                              args=(self._shared, self.api, self.max_rel_shift,
+                                                    identification_callback, disappearance_callback),
+                                              latency=self.latencies['identify'])
         else:
             self.api = None
-            self._identifier = Identifier(identification_interval, FaceTracker._verify_identify_local,
-                                          args=(self._shared, self.max_rel_shift,
-                                                identification_callback, disappearance_callback))
+            if identify_tracked_faces:
+                self._identifier = Identifier(identification_interval, FaceTracker._identify_tracks_local,
+                                              args=(self._shared, identification_callback, disappearance_callback,
+                                                    self.scheduler),
+                                              latency=self.latencies['identify'])
+            else:
+                self._identifier = Identifier(identification_interval, FaceTracker._verify_identify_local,
+                                              args=(self._shared, self.max_rel_shift,
+                                                    identification_callback, disappearance_callback),
+                                              latency=self.latencies['identify'])
 
-        self._identifier.start()
+        if identify_codes is None:
+            self._identifier.start()
 
     @staticmethod
     def _verify_identity(shared, max_rel_shift, rect, name, id, identification_callback, disappearance_callback):
@@ -100,46 +606,102 @@ class FaceTracker(object):
 
             for track_id, face in shared['tracked_faces'].items():
                 if FaceTracker.is_same_face(face['coords'], face_coordinates, max_rel_shift):
-                    name=copy.copy(name)
-                    id=copy.copy(id)
-                    if face["face_id"] != id:
-                        if face["identified"]:
-                            FaceTracker._on_disappearance_proxy(face, disappearance_callback)
-                        face["name"] = name
-                        face["face_id"] = id
-                        face['identified'] = time.time()
-                        log.info("identified: {}".format(face))
-                        if identification_callback is not None:
-                            identification_callback(face)
+                    if FaceTracker._set_identity(face, name, id, identification_callback, disappearance_callback):
                         break
 
+    @staticmethod
+    def _set_identity(face, name, id, identification_callback, disappearance_callback):
+        name = copy.copy(name)
+        id = copy.copy(id)
+        if face["face_id"] != id:
+            if face["identified"]:
+                # the previous identity disappeared, report it as it was
+                disappearance_callback(dict(face))
+            face["name"] = name
+            face["face_id"] = id
+            face['identified'] = time.time()
+            log.info("identified: {}".format(face))
+            identification_callback(face)
+            return True
+        return False
+
+    @staticmethod
+    def _tracked_rects(shared):
+        # snapshot of the tracks with their rectangles, the faces were already localized by update
+        tracks = list(shared['tracked_faces'].values())
+        return tracks, [tuple(face['coords']) for face in tracks]
+
+    @staticmethod
+    def _identify_codes_server(api, codes):
+        if isinstance(api, AsyncFacerecApi):
+            # all faces in flight at once over the pooled connections
+            return api.run(api.map(api.identify_facecode, codes))
+        return [api.identify_facecode(code) for code in codes]
+
+    @staticmethod
+    def _identify_tracks_server(shared, api, identification_callback, disappearance_callback, scheduler=None):
+        def identify(codes):
+            persons = FaceTracker._identify_codes_server(api, codes)
+            return [(person['name'], person['id']) for person in persons]
+        return FaceTracker._identify_tracks(shared, identify, scheduler, identification_callback,
+                                            disappearance_callback)
+
+    @staticmethod
+    def _identify_tracks_local(shared, identification_callback, disappearance_callback, scheduler=None):
+        def identify(codes):
+            session = assert_session()
+            try:
+                return [(person.name, person.id) for person in identify_persons(codes, session)]
+            finally:
+                session.close()
+        return FaceTracker._identify_tracks(shared, identify, scheduler, identification_callback,
+                                            disappearance_callback)
+
+    @staticmethod
+    def _identify_tracks(shared, identify, scheduler, identification_callback, disappearance_callback):
+        # returns the number of identified faces
+        if 'frame' not in shared: return 0
+        frame = shared['frame']
+        tracks, rects = FaceTracker._tracked_rects(shared)
+        if scheduler is not None:
+            tracks, rects, codes = scheduler.codes(frame, tracks, rects)
+        if len(tracks) == 0: return 0
+        if scheduler is None:
+            codes = [facecode for facecode, rect, shape in describe_faces(frame, rects)]
+        for face, (name, id) in zip(tracks, identify(np.vstack(codes))):
+            changed = FaceTracker._set_identity(face, name, id, identification_callback, disappearance_callback)
+            if scheduler is not None:
+                scheduler.identified(face['id'], changed)
+        return len(tracks)
+
     @staticmethod
     def _verify_identify_server(shared, api, max_rel_shift, identification_callback, disappearance_callback):
-        if 'frame' not in shared: return
+        if 'frame' not in shared: return 0
         faces = detect_faces(shared['frame'])
-        for facecode, rect, shapes in faces:
+        persons = FaceTracker._identify_codes_server(api, [facecode for facecode, rect, shapes in faces])
+        for (facecode, rect, shapes), person in zip(faces, persons):
 
-            person = api.identify_facecode(facecode)
             FaceTracker._verify_identity(shared, max_rel_shift, rect,
                                          copy.copy(person['name']), copy.copy(person['id']),
                                          identification_callback, disappearance_callback)
+        return len(faces)
 
     @staticmethod
     def _verify_identify_local(shared, max_rel_shift, identification_callback, disappearance_callback):
-        if 'frame' not in shared: return
+        if 'frame' not in shared: return 0
         session = assert_session()
         persons = detect_and_identify_faces(shared['frame'], session)
         for person, rect, shapes in persons:
             FaceTracker._verify_identity(shared, max_rel_shift, rect,
                                          copy.copy(person.name), copy.copy(person.id),
                                          identification_callback, disappearance_callback)
-        session.close_all()
+        session.close()
+        return len(persons)
 
     @staticmethod
-    def start_thread(shared, callback, proxy):
-        p = Thread(target=proxy, args=(shared, callback))
-        _processes.append(p)
-        p.start()
+    def _on_identification_proxy(face, callback):
+        if callback is not None:
+            callback(face)
 
     @staticmethod
     def _on_appearance_proxy(face, callback):
@@ -166,79 +728,177 @@ class FaceTracker(object):
 
         return (abs(x11 - x21) / w < max_rel_shift_per_frame) and (abs(y11 - y21) / h < max_rel_shift_per_frame)
 
-    def update(self, frame):
-
-        current_faces_rects = self.detector(frame)
+    def _follow_faces(self, frame):
+        # positions of the faces from the correlation trackers, None if any of them drifted
+        h, w = frame.shape[:2]
+        rects = []
+        for tracker in self._correlation_trackers:
+            quality = tracker.update(frame)
+            p = tracker.get_position()
+            cx, cy = (p.left() + p.right()) / 2, (p.top() + p.bottom()) / 2
+            if quality < self.min_tracking_quality or not (0 <= cx < w and 0 <= cy < h):
+                log.debug("face tracking drifted (quality {:.1f}), detect again...".format(quality))
+                return None
+            rects.append(dlib.rectangle(int(round(p.left())), int(round(p.top())),
+                                        int(round(p.right())), int(round(p.bottom()))))
+        return rects
+
+    def _locate_faces(self, frame):
+        if 0 < self._nframes_since_detection < self.detect_every_nframes:
+            rects = self._follow_faces(frame)
+            if rects is not None:
+                self._nframes_since_detection += 1
+                return rects
+
+        rects = self.detector(frame)
+        if self.detect_every_nframes > 1:
+            self._nframes_since_detection = 1
+            self._correlation_trackers = []
+            for rect in rects:
+                tracker = dlib.correlation_tracker()
+                tracker.start_track(frame, rect)
+                self._correlation_trackers.append(tracker)
+        return rects
 
-        faces_in_frame = []
-        any_new_faces = False
-        for face_rect in current_faces_rects:
+    def update(self, frame):
 
-            face_coordinates = np.asarray(
-                [face_rect.left(), face_rect.top(), face_rect.right(), face_rect.bottom()])
+        start = time.perf_counter()
+        current_faces_rects = self._locate_faces(frame)
+        detections = np.asarray([[d.left(), d.top(), d.right(), d.bottom()] for d in current_faces_rects],
+                                dtype=int).reshape(-1, 4)
 
-            this_face = None
-            for track_id, face in self.tracked_faces.items():
-                if self.is_same_face(face.coords(), face_coordinates, self.max_rel_shift):
-                    this_face = face
-                    del self.tracked_faces[track_id]
-                    break
+        store = self._store
+        track_ids = store.ids
+        track_rows, detection_rows = match_faces(store.coords(), detections, self.max_rel_shift)
+        store.update_in_frame(track_rows, detections[detection_rows])
 
-            if this_face is None:
-                # create new tracked face
-                this_face = TrackedFace(self.memory_manager.dict())
-                FaceTracker.start_thread(this_face._shared, self.appearance_callback, FaceTracker._on_appearance_proxy)
+        faces_in_frame = []
+        for row in track_rows:
+            track_id = track_ids[row]
+            this_face = self.tracked_faces[track_id]
+            this_face._shared['coords'] = store.coords(track_id).tolist()
+            faces_in_frame.append((track_id, this_face))
 
-                track_id = this_face.id()
+        any_new_faces = False
+        for i in sorted(set(range(len(detections))) - set(detection_rows.tolist())):
+            # create new tracked face
+            this_face = TrackedFace(self._new_shared_dict(), store)
+            self.callbacks.submit(this_face.id(), FaceTracker._on_appearance_proxy, this_face._shared,
+                                  self.appearance_callback)
+
+            track_id = this_face.id()
+            if self.memory_manager is not None:
                 self._shared['tracked_faces'][track_id]=this_face._shared
 
-                this_face.update_in_frame(face_coordinates)
-                any_new_faces = True
-            else:
-                this_face.update_in_frame(face_coordinates)
+            this_face.update_in_frame(detections[i])
             faces_in_frame.append((track_id, this_face))
+            any_new_faces = True
 
+        missing_rows = sorted(set(range(len(track_ids))) - set(track_rows.tolist()))
+        store.update_not_in_frame(missing_rows)
         faces_recently_in_frame = []
-        for track_id, face in self.tracked_faces.items():
-            face.update_not_in_frame()
-            if face._not_in_frame < self.missing_tol_nframes:
+        for row in missing_rows:
+            track_id = track_ids[row]
+            face = self.tracked_faces[track_id]
+            if store.missing(track_id) < self.missing_tol_nframes:
                 faces_recently_in_frame.append((track_id, face))
                 face._shared['disappeared'] = time.time()
+            else:
+                store.remove(track_id)
+                self.callbacks.submit(track_id, FaceTracker._on_disappearance_proxy, face._shared,
+                                      self.disappearance_callback)
 
         tracked_faces = dict(faces_in_frame + faces_recently_in_frame)
-        for track_id, face in self.tracked_faces.items():
-            if track_id not in tracked_faces.keys():
-                FaceTracker.start_thread(face._shared, self.disappearance_callback, FaceTracker._on_disappearance_proxy)
-
-        self.tracked_faces.clear()
-        self._shared['tracked_faces'].clear()
-        for track_id, face in tracked_faces.items():
-            self.tracked_faces[track_id] = face
-            self._shared['tracked_faces'][track_id] = face._shared
 
-        self._shared['frame'] = frame.copy()
+        self.tracked_faces = tracked_faces
+        if self.memory_manager is None:
+            # publish new objects instead of mutating, the identifier thread never sees a half updated state
+            self._shared['tracked_faces'] = {track_id: face._shared for track_id, face in tracked_faces.items()}
+            self._shared['frame'] = frame.copy() if self.copy_frames else frame
+        else:
+            self._shared['tracked_faces'].clear()
+            for track_id, face in tracked_faces.items():
+                self._shared['tracked_faces'][track_id] = face._shared
+            self._shared['frame'] = frame.copy()
 
         if any_new_faces:
             self._identifier.trigger()
 
+        self.latencies['detect'].add(time.perf_counter() - start)
         return self.tracked_faces.values()
 
+    def process(self, source, maxsize=None, policy=None):
+        """
+        tracks the faces of a video file or stream decoded on a reader thread (see stream.VideoReader) instead of
+        a capture loop of the caller. The callbacks are called as with update, the latencies of decoding, detection
+        and identification are recorded separately in self.latencies.
+
+            for frame, faces in tracker.process('rtsp://camera/stream'):
+                ...
+
+        Args:
+            source: (str, int) file path, stream url or camera index (or an object like cv2.VideoCapture)
+            maxsize: (int, optional) number of decoded frames to buffer
+            policy: (str, optional) 'block', 'drop_newest' or 'drop_oldest' if the tracker can not keep up,
+                    defaults to 'block' for files (every frame, as fast as possible) and 'drop_oldest' for live
+                    sources (always the newest frame)
+
+        Returns:
+            generator of 2-tuples (stream.Frame, list of TrackedFace) per processed frame, self.reader counts the
+            decoded and dropped frames
+
+        Raises:
+            the error opening the source, e.g. IOError
+        """
+        self.reader = VideoReader(source, maxsize, policy, latency=self.latencies['decode'])
+        self.reader.start()
+        try:
+            for frame in self.reader:
+                yield frame, list(self.update(frame.image))
+        finally:
+            self.reader.stop()
+
+    def _new_shared_dict(self):
+        if self.memory_manager is None:
+            return {}
+        return self.memory_manager.dict()
+
     def get_tracked_faces(self):
         return self.tracked_faces.copy()
 
+    def identification_due(self):
+        """ (bool) whether new faces appeared or the identification interval passed, see identify_codes """
+        return self._identifier.due()
+
+    def identify_faces(self):
+        """
+        identifies the tracked faces on the calling thread, for trackers with a shared identify_codes service.
+        Returns:
+            (int) number of identified faces
+        """
+        return self._identifier.run_once()
+
     def stop(self):
-        [p.join() for  p in _processes]
         self._identifier.cancel()
-        self._identifier.join()
+        if self._identifier.ident is not None:
+            self._identifier.join()
+        if self._own_callbacks:
+            self.callbacks.shutdown()
+        if isinstance(self.api, AsyncFacerecApi):
+            self.api.run(self.api.close())
+        elif self.api is not None:
+            self.api.close()
+        if self.memory_manager is not None:
+            self.memory_manager.shutdown()
 
 class TrackedFace():
     """ a face tracked in video stream """
 
-    def __init__(self, shared_data):
+    def __init__(self, shared_data, store=None):
 
         self._processes = []
         self._tracker_id = str(uuid.uuid4())
-        self._coords_buffer = deque(maxlen=5)
+        self._store = store if store is not None else TrackStore()
         self._shared = shared_data
         self._shared['id'] = self._tracker_id
         self._shared['face_id'] = -1
@@ -261,13 +921,21 @@ class TrackedFace():
         return self._tracker_id
 
     def coords(self):
-        coords = np.mean(np.asarray(self._coords_buffer), axis=0).round().astype(int)
-        return coords
+        if self._tracker_id not in self._store:
+            # the track ended, the last known position is kept in the shared data
+            return np.asarray(self._shared['coords'])
+        return self._store.coords(self._tracker_id)
 
     def update_in_frame(self, coords):
-        self._not_in_frame = 0
-        self._coords_buffer.append(coords)
+        if self._tracker_id in self._store:
+            self._store.update_in_frame(self._store.rows([self._tracker_id]), np.asarray(coords).reshape(1, 4))
+        else:
+            self._store.add(self._tracker_id, coords)
         self._shared['coords'] = self.coords().tolist()
 
     def update_not_in_frame(self):
-        self._not_in_frame += 1
+        self._store.update_not_in_frame(self._store.rows([self._tracker_id]))
+
+    @property
+    def _not_in_frame(self):
+        return self._store.missing(self._tracker_id)
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import facedb
+
+log = logging.getLogger(__name__)
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
+
+_upsample = 1
+
+
+def iter_image_paths(paths, extensions=image_extensions):
+    """
+    streams the image files of the given files and directories (recursively, in sorted order).
+    Args:
+        paths: (list of str) image files or directories
+        extensions: (tuple of str) file extensions of images
+
+    Returns:
+        generator of str
+    """
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            for root, dirs, files in os.walk(str(path)):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.lower().endswith(extensions):
+                        yield os.path.join(root, f)
+        else:
+            yield str(path)
+
+
+def read_image(path):
+    """
+    decodes an image file into the BGR layout of cv2.imread, falls back to pillow without opencv.
+    Args:
+        path: (str) image file
+
+    Returns:
+        (np.array) 3d uint8 array
+    """
+    try:
+        import cv2
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError("could not decode image {}!".format(path))
+        return image
+    except ModuleNotFoundError:
+        from PIL import Image
+        with Image.open(path) as image:
+            # same channel order as cv2.imread so codes match faces enrolled with opencv
+            return np.ascontiguousarray(np.asarray(image.convert('RGB'))[:, :, ::-1])
+
+
+def _init_worker(upsample):
+    global _upsample
+    _upsample = upsample
+    # load the dlib models once per worker process
+    from .dlib_api import preload
+    preload()
+
+
+def _process_image(path):
+    from .dlib_api import detect_faces_batch
+    try:
+        faces = detect_faces_batch([read_image(path)], upsample=_upsample)[0]
+    except Exception as e:
+        return path, None, None, str(e)
+    codes = np.asarray([code for code, d, shape in faces]).reshape(-1, 128)
+    rects = [(d.left(), d.top(), d.right(), d.bottom()) for code, d, shape in faces]
+    return path, codes, rects, None
+
+
+def _read_journal(journal):
+    if not journal.exists():
+        return set()
+    with open(str(journal), 'r') as fp:
+        return set(line.rstrip('\n') for line in fp)
+
+
+class _Writer(object):
+    """ collects the results of the workers and writes them to the database in batches. """
+
+    def __init__(self, mode, batch_size, output, journal):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.output = output
+        self.journal = journal
+        self.pending = []
+        self.npending_faces = 0
+
+    def add(self, path, codes, rects):
+        self.pending.append((path, codes, rects))
+        self.npending_faces += len(codes)
+        if self.npending_faces >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        session = facedb.assert_session()
+        if self.mode == 'enrol':
+            records = self._enrol(session)
+        else:
+            records = self._search(session)
+
+        # only journal the images once their results are committed
+        if self.output is not None:
+            for record in records:
+                self.output.write(json.dumps(record) + '\n')
+            self.output.flush()
+        for path, codes, rects in self.pending:
+            self.journal.write(path + '\n')
+        self.journal.flush()
+        self.pending = []
+        self.npending_faces = 0
+
+    def _search(self, session):
+        codes = np.vstack([codes for path, codes, rects in self.pending])
+        persons = iter(facedb.identify_persons(codes, session=session) if len(codes) else [])
+        records = []
+        for path, codes, rects in self.pending:
+            faces = []
+            for rect in rects:
+                person = next(persons)
+                faces.append({'id': person.id, 'name': person.name, 'rect': list(rect)})
+            records.append({'path': path, 'faces': faces})
+        return records
+
+    def _enrol(self, session):
+        records = []
+        with facedb.transaction(session):
+            for path, codes, rects in self.pending:
+                if len(codes) != 1:
+                    log.warning("{} faces detected on {}, expected exactly one, skip...".format(len(codes), path))
+                    continue
+                # the directory of the image names the person
+                name = pathlib.Path(path).parent.name
+                person = facedb.teach(codes[0], name, session=session)
+                records.append({'path': path, 'faces': [{'id': person.id, 'name': person.name,
+                                                         'rect': list(rects[0])}]})
+        return records
+
+
+def ingest(paths, mode='search', processes=None, batch_size=256, output=None, journal=None, restart=False,
+           upsample=1, report_interval=10.):
+    """
+    detects the faces on many image files with a pool of worker processes and identifies (mode 'search') or
+    teaches (mode 'enrol', the directory of an image names the person) them in batched database transactions.
+    Processed images are recorded in a journal, an interrupted run continues where it stopped.
+    Args:
+        paths: (list of str) image files or directories
+        mode: (str) 'search' or 'enrol'
+        processes: (int, optional) number of worker processes, defaults to the cpu count
+        batch_size: (int) number of faces to write per transaction
+        output: (str, optional) json lines file to append the results per image to
+        journal: (str, optional) file that records the processed images, defaults to ingest-<mode>.journal
+                 next to the database
+        restart: (bool) ignore the journal and process all images again
+        upsample: (int) number of times to upsample the images before detection
+        report_interval: (float) seconds between progress reports
+
+    Returns:
+        (dict) with the number of images, faces, errors and the rates per second
+    """
+
+    if mode not in ('search', 'enrol'):
+        raise ValueError("mode must be either 'search' or 'enrol'!")
+
+    journal = pathlib.Path(journal) if journal is not None else \
+        facedb.get_db_path().joinpath('ingest-{}.journal'.format(mode))
+    done = set() if restart else _read_journal(journal)
+    if len(done) > 0:
+        log.info("resume, skip {} images already processed...".format(len(done)))
+
+    todo = (path for path in iter_image_paths(paths) if path not in done)
+
+    stats = {'images': 0, 'faces': 0, 'errors': 0}
+    start = last_report = time.time()
+
+    with open(str(journal), 'w' if restart else 'a') as journal_fp, \
+            (open(output, 'w' if restart else 'a') if output is not None else _nullcontext()) as output_fp:
+        writer = _Writer(mode, batch_size, output_fp, journal_fp)
+        with Pool(processes, initializer=_init_worker, initargs=(upsample,)) as pool:
+            for path, codes, rects, error in pool.imap_unordered(_process_image, todo, chunksize=4):
+                if error is not None:
+                    log.warning("failed to process {}: {}".format(path, error))
+                    stats['errors'] += 1
+                    continue
+                writer.add(path, codes, rects)
+                stats['images'] += 1
+                stats['faces'] += len(codes)
+
+                now = time.time()
+                if now - last_report > report_interval:
+                    last_report = now
+                    _report(stats, now - start)
+        writer.flush()
+
+    return _report(stats, time.time() - start)
+
+
+def _report(stats, elapsed):
+    stats = dict(stats, seconds=elapsed,
+                 images_per_second=stats['images'] / max(elapsed, 1e-9),
+                 faces_per_second=stats['faces'] / max(elapsed, 1e-9))
+    log.info("{images} images, {faces} faces, {errors} errors in {seconds:.1f}s "
+             "({images_per_second:.1f} images/s, {faces_per_second:.1f} faces/s)".format(**stats))
+    return stats
+
+
+class _nullcontext(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk enrolment and search of faces on image files.')
+    parser.add_argument('mode', choices=['search', 'enrol'],
+                        help="'search' identifies all faces, 'enrol' teaches the face of every image to the person "
+                             "named by its directory")
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--db', help='directory of the face database (default: configured path)')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=256, help='faces per database transaction')
+    parser.add_argument('--output', help='json lines file for the results per image')
+    parser.add_argument('--journal', help='file recording the processed images to resume from')
+    parser.add_argument('--restart', action='store_true', help='ignore the journal and start over')
+    parser.add_argument('--upsample', type=int, default=1, help='upsampling of the images before detection')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.db is not None:
+        facedb.set_db_path(args.db)
+
+    try:
+        ingest(args.paths, mode=args.mode, processes=args.processes, batch_size=args.batch_size,
+               output=args.output, journal=args.journal, restart=args.restart, upsample=args.upsample)
+    finally:
+        facedb.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+compact binary bodies of the batch endpoints of the facerec server.
+
+A body is the magic b'FRB1', the length of a json header as little endian uint32, the json header and the raw
+payload. Face codes are sent as little endian float32 (512 bytes per code instead of ~1.4kB of base64 encoded
+float64 in json), images as concatenated jpeg files with their sizes in the header.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+content_type = 'application/x-facerec-batch'
+magic = b'FRB1'
+
+_header = struct.Struct('<4sI')
+
+
+def pack(header, payload=b''):
+    """
+    Args:
+        header: (dict) json serializable meta data
+        payload: (bytes) raw data
+
+    Returns:
+        (bytes) body of a request
+    """
+    header = json.dumps(header).encode('utf-8')
+    return _header.pack(magic, len(header)) + header + bytes(payload)
+
+
+def unpack(body):
+    """
+    Args:
+        body: (bytes) body of a request packed by pack
+
+    Returns:
+        2-tuple (dict, memoryview) header and payload
+    """
+    body = memoryview(body)
+    if len(body) < _header.size:
+        raise ValueError("batch body too short!")
+    tag, length = _header.unpack(body[:_header.size])
+    if tag != magic:
+        raise ValueError("not a facerec batch body!")
+    start = _header.size + length
+    if len(body) < start:
+        raise ValueError("batch body truncated!")
+    return json.loads(bytes(body[_header.size:start]).decode('utf-8')), body[start:]
+
+
+def encode_facecodes(codes, **header):
+    """
+    packs face codes as float32.
+    Args:
+        codes: (np.array) (N, 128) face codes
+        header: additional meta data, e.g. names=[...] or ids=[...]
+
+    Returns:
+        (bytes) body of a request
+    """
+    codes = np.ascontiguousarray(np.asarray(codes).reshape(len(codes), -1), dtype='<f4')
+    header.update(dtype='<f4', shape=list(codes.shape))
+    return pack(header, codes.tobytes())
+
+
+def decode_facecodes(body):
+    """
+    Args:
+        body: (bytes) body packed by encode_facecodes
+
+    Returns:
+        2-tuple (np.array, dict) (N, 128) float64 face codes and the header
+    """
+    header, payload = unpack(body)
+    shape = tuple(header.pop('shape'))
+    dtype = np.dtype(header.pop('dtype'))
+    if len(payload) != int(np.prod(shape)) * dtype.itemsize:
+        raise ValueError("size of the face codes does not match the shape {}!".format(shape))
+    return np.frombuffer(payload, dtype=dtype).reshape(shape).astype(np.float64), header
+
+
+def encode_images(images, **header):
+    """
+    packs images as jpeg files.
+    Args:
+        images: (list of np.array) images given by 3d int arrays
+        header: additional meta data, e.g. names=[...] or ids=[...]
+
+    Returns:
+        (bytes) body of a request
+    """
+    from .client import FacerecApi
+    files = [FacerecApi.compress_image(image) for image in images]
+    header.update(sizes=[len(f) for f in files])
+    return pack(header, b''.join(files))
+
+
+def decode_images(body):
+    """
+    Args:
+        body: (bytes) body packed by encode_images
+
+    Returns:
+        2-tuple (list of bytes, dict) the encoded image files and the header
+    """
+    header, payload = unpack(body)
+    sizes = header.pop('sizes')
+    if sum(sizes) != len(payload):
+        raise ValueError("size of the images does not match the header!")
+    offsets = np.cumsum([0] + sizes)
+    return [bytes(payload[a:b]) for a, b in zip(offsets[:-1], offsets[1:])], header
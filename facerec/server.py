@@ -0,0 +1,435 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+http server of the facerec api (the routes of client.FacerecApi).
+
+The face database and its index stay resident in the server process. All database work runs on a single thread
+that groups the concurrently pending identify requests into one vectorized lookup and one transaction
+(micro-batching). Decoding images and detecting faces runs in a pool of worker processes that keep the dlib models
+loaded.
+
+    facerec-server [--host 0.0.0.0] [--port 80] [--db DIR] [--processes N]
+"""
+
+import argparse
+import base64
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from sqlalchemy.orm.exc import NoResultFound
+
+from . import facedb, protocol
+
+log = logging.getLogger(__name__)
+
+_upsample = 1
+
+
+def _person(p, rect=None):
+    person = {'id': p.id, 'name': p.name, 'nmeans': p.nmeans}
+    if rect is not None:
+        person['rect'] = list(rect)
+    return person
+
+
+def _init_worker(upsample):
+    global _upsample
+    _upsample = upsample
+    from .dlib_api import preload
+    preload()
+
+
+def _detect(data):
+    """ decodes an encoded image and detects its faces in a worker process, returns the codes and rectangles """
+    from .dlib_api import detect_faces
+    try:
+        import cv2
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except ModuleNotFoundError:
+        from io import BytesIO
+        from PIL import Image
+        image = np.ascontiguousarray(np.asarray(Image.open(BytesIO(data)).convert('RGB'))[:, :, ::-1])
+    if image is None:
+        raise ValueError("could not decode image!")
+    faces = detect_faces(image, upsample=_upsample)
+    codes = np.asarray([code for code, d, shape in faces]).reshape(-1, 128)
+    rects = [(d.left(), d.top(), d.right(), d.bottom()) for code, d, shape in faces]
+    return codes, rects
+
+
+class _Task(object):
+
+    def __init__(self, fn=None, args=(), codes=None):
+        self.fn = fn
+        self.args = args
+        self.codes = codes
+        self.future = Future()
+
+
+class Batcher(threading.Thread):
+    """
+    runs all database work on one thread. Identify requests that arrive within max_batch_delay of each other are
+    answered with a single vectorized lookup of up to max_batch_size codes.
+    """
+
+    def __init__(self, max_batch_size=256, max_batch_delay=0.005):
+        """
+        Args:
+            max_batch_size: (int) maximal number of face codes per lookup
+            max_batch_delay: (float) seconds to wait for further identify requests
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.tasks = queue.Queue()
+        self.nbatches = 0
+        self.ncodes = 0
+
+    def identify(self, codes):
+        """
+        Args:
+            codes: (np.array) (N, 128) face codes
+
+        Returns:
+            (Future) of the list of person dicts
+        """
+        task = _Task(codes=np.atleast_2d(codes))
+        self.tasks.put(task)
+        return task.future
+
+    def call(self, fn, *args):
+        """
+        runs fn(session, *args) on the database thread.
+        Returns:
+            (Future) of the result
+        """
+        task = _Task(fn, args)
+        self.tasks.put(task)
+        return task.future
+
+    def stop(self):
+        self.tasks.put(None)
+        self.join()
+
+    def run(self):
+        session = facedb.assert_session()
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+                if task.codes is None:
+                    self._call(session, task)
+                    continue
+
+                batch, others = self._collect(task)
+                self._identify(session, batch)
+                for other in others:
+                    if other is None:
+                        return
+                    self._call(session, other)
+        finally:
+            facedb.Session.remove()
+
+    def _collect(self, task):
+        batch = [task]
+        others = []
+        ncodes = len(task.codes)
+        deadline = time.monotonic() + self.max_batch_delay
+        while ncodes < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                task = self.tasks.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if task is None or task.codes is None:
+                # answered after the batch, in order
+                others.append(task)
+                if task is None:
+                    break
+                continue
+            batch.append(task)
+            ncodes += len(task.codes)
+        return batch, others
+
+    def _identify(self, session, batch):
+        try:
+            persons = facedb.identify_persons(np.vstack([task.codes for task in batch]), session=session)
+            persons = [_person(p) for p in persons]
+        except Exception as e:
+            session.rollback()
+            for task in batch:
+                task.future.set_exception(e)
+            return
+        self.nbatches += 1
+        self.ncodes += len(persons)
+        start = 0
+        for task in batch:
+            task.future.set_result(persons[start:start + len(task.codes)])
+            start += len(task.codes)
+
+    def _call(self, session, task):
+        try:
+            result = task.fn(session, *task.args)
+        except Exception as e:
+            session.rollback()
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+
+
+def _get_person(session, id_or_name):
+    if str(id_or_name).isdigit():
+        return facedb.get_person(id=int(id_or_name), session=session)
+    return facedb.get_person(name=id_or_name, session=session)
+
+
+def _faces(session):
+    return [_person(p) for p in facedb.persons(session)]
+
+
+def _face(session, id_or_name):
+    return _person(_get_person(session, id_or_name))
+
+
+def _rename(session, id_or_name, name):
+    p = _get_person(session, id_or_name)
+    p.name = name
+    session.commit()
+    return _person(p)
+
+
+def _delete(session, id_or_name):
+    p = _get_person(session, id_or_name)
+    person = _person(p)
+    facedb.delete_person(id=p.id, session=session)
+    return person
+
+
+def _teach(session, codes, names, ids, rects=None):
+    with facedb.transaction(session):
+        persons = [facedb.teach(code, name, id, session=session) for code, name, id in zip(codes, names, ids)]
+    rects = rects or [None] * len(persons)
+    return [_person(p, rect) for p, rect in zip(persons, rects)]
+
+
+def _config(session, config=None):
+    config = config or {}
+    if 'threshold' in config:
+        facedb.set_distance_threshold(float(config['threshold']))
+    return {'threshold': facedb.get_distance_threshold()}
+
+
+class FacerecServer(ThreadingHTTPServer):
+    """ http server of the facerec api, see the module documentation. """
+
+    daemon_threads = True
+
+    def __init__(self, host='0.0.0.0', port=80, processes=None, upsample=1, max_batch_size=256,
+                 max_batch_delay=0.005):
+        """
+        Args:
+            host: (str) interface to listen on
+            port: (int) port to listen on, 0 picks a free one
+            processes: (int, optional) number of worker processes for the images, defaults to the cpu count
+            upsample: (int) number of times to upsample the images before detection
+            max_batch_size: (int) maximal number of face codes per database lookup
+            max_batch_delay: (float) seconds to wait for further identify requests to batch
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), _Handler)
+        self.batcher = Batcher(max_batch_size, max_batch_delay)
+        self.batcher.start()
+        # warm up the resident index before the first request
+        self.batcher.call(lambda session: len(facedb.get_index(session))).result()
+        # the worker processes are started on the first image
+        self.pool = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(upsample,))
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def detect(self, files):
+        """ detects the faces on encoded images in the worker processes, returns a list of (codes, rects) """
+        return list(self.pool.map(_detect, files))
+
+    def identify(self, codes):
+        if len(codes) == 0:
+            return []
+        return self.batcher.identify(codes).result()
+
+    def call(self, fn, *args):
+        return self.batcher.call(fn, *args).result()
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        self.batcher.stop()
+        self.pool.shutdown()
+        facedb.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # keep alive connections: the headers and the body of a response go out in one write, without waiting for the
+    # delayed ack of the client (nagle)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    # body of the current request once read
+    _request_body = None
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+    def _body(self):
+        if self._request_body is None:
+            self._request_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return self._request_body
+
+    def _json(self):
+        body = self._body()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body.decode('utf-8'))
+        # form encoded
+        from urllib.parse import parse_qsl
+        return dict(parse_qsl(body.decode('utf-8')))
+
+    def _send(self, result, status=200):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        self._request_body = None
+        try:
+            result = self._route(method, parts)
+            status = 200 if result is not None else 404
+            if result is None:
+                result = {'error': 'no route {} {}'.format(method, self.path)}
+        except NoResultFound:
+            status, result = 404, {'error': 'face not found'}
+        except (ValueError, KeyError) as e:
+            status, result = 400, {'error': str(e)}
+        except Exception as e:
+            log.exception("request {} {} failed".format(method, self.path))
+            status, result = 500, {'error': str(e)}
+            self.close_connection = True
+        try:
+            # a body left unread would be taken for the next request of the keep-alive connection
+            self._body()
+        except Exception:
+            self.close_connection = True
+        self._send(result, status)
+
+    def _route(self, method, parts):
+        server = self.server
+
+        if parts == ['faces'] and method == 'GET':
+            return server.call(_faces)
+        if len(parts) == 2 and parts[0] == 'faces':
+            if method == 'GET':
+                return server.call(_face, parts[1])
+            if method == 'PATCH':
+                return server.call(_rename, parts[1], self._json()['name'])
+            if method == 'DELETE':
+                return server.call(_delete, parts[1])
+        if parts[:1] == ['config']:
+            if method == 'PATCH':
+                config = self._json()
+                if len(parts) == 2:
+                    # one parameter per request, as sent by older clients
+                    config = {parts[1]: config['value']}
+                return server.call(_config, config)
+            if method == 'GET' and len(parts) == 1:
+                return server.call(_config)
+        if method != 'POST' or len(parts) != 2:
+            return None
+
+        kind, action = parts
+        if action not in ('identify', 'teach'):
+            return None
+        if kind == 'facecode':
+            payload = self._json()
+            codes = np.frombuffer(base64.b64decode(payload['code']))[None, :]
+            # older clients send teach requests to the identify route, a name or id makes it one
+            if 'name' in payload or 'id' in payload:
+                return server.call(_teach, codes, [payload.get('name')], [payload.get('id')])[0]
+            return server.identify(codes)[0]
+        if kind == 'facecodes':
+            codes, header = protocol.decode_facecodes(self._body())
+            if action == 'teach':
+                return server.call(_teach, codes, header.get('names') or [None] * len(codes),
+                                   header.get('ids') or [None] * len(codes))
+            return server.identify(codes)
+        if kind == 'image':
+            payload = self._json()
+            codes, rects = server.detect([base64.b64decode(payload['image'])])[0]
+            if 'name' in payload or 'id' in payload:
+                if len(codes) != 1:
+                    raise ValueError("{} faces detected, an image with exactly one face has to be passed!"
+                                     .format(len(codes)))
+                return server.call(_teach, codes, [payload.get('name')], [payload.get('id')], rects)[0]
+            return [dict(p, rect=list(rect)) for p, rect in zip(server.identify(codes), rects)]
+        if kind == 'images' and action == 'identify':
+            files, header = protocol.decode_images(self._body())
+            results = server.detect(files)
+            persons = iter(server.identify(np.vstack([codes for codes, rects in results] + [np.empty((0, 128))])))
+            return [[dict(next(persons), rect=list(rect)) for rect in rects] for codes, rects in results]
+        return None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Http server of the facerec api.')
+    parser.add_argument('--host', default='0.0.0.0', help='interface to listen on')
+    parser.add_argument('--port', type=int, default=80, help='port to listen on')
+    parser.add_argument('--db', help='directory of the face database (default: configured path)')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes for images')
+    parser.add_argument('--upsample', type=int, default=1, help='upsampling of the images before detection')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='maximal face codes per lookup')
+    parser.add_argument('--max-batch-delay', type=float, default=0.005,
+                        help='seconds to wait for further identify requests to batch')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.db is not None:
+        facedb.set_db_path(args.db)
+
+    server = FacerecServer(args.host, args.port, processes=args.processes, upsample=args.upsample,
+                           max_batch_size=args.max_batch_size, max_batch_delay=args.max_batch_delay)
+    log.info("serve facerec api on {}...".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+contiguous snapshot of the gallery (ids and face codes) in .npy files that processes map instead of loading the
+persons from the database. Mapped read-only (copy on write) the pages are shared between all processes through the
+page cache.
+
+A snapshot <path> consists of
+    <path>.json             meta data: generation, number of rows, files (name of the files of the generation)
+    <path>.<files>.ids.npy  (N,) int64 ids
+    <path>.<files>.codes.npy (N, dim) codes
+    <path>.<files>.norms.npy (N,) squared norms of the codes
+
+The files of a published generation are never written to again: every change writes the files of a new generation
+and publishes them by replacing the meta file, writers of several processes take turns by the lock file <path>.lock.
+Readers which mapped the old files keep a consistent view of codes and norms until they map the new generation.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import uuid
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger(__name__)
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        """
+        Args:
+            path: (str, pathlib.Path) path of the snapshot without extension, e.g. <db path>/face.snapshot
+        """
+        self.path = pathlib.Path(path)
+        self.meta_file = self.path.with_name(self.path.name + '.json')
+        self.lock_file = self.path.with_name(self.path.name + '.lock')
+
+    def _file(self, files, name):
+        return self.path.with_name('{}.{}.{}.npy'.format(self.path.name, files, name))
+
+    def meta(self):
+        """
+        Returns:
+            (dict) meta data of the snapshot, None if there is none
+        """
+        try:
+            with open(str(self.meta_file), 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+    def exists(self):
+        return self.meta() is not None
+
+    def generation(self):
+        """
+        Returns:
+            (int) generation of the snapshot, incremented on every change, 0 if there is no snapshot
+        """
+        meta = self.meta()
+        return 0 if meta is None else meta['generation']
+
+    def mtime(self):
+        return self.meta_file.stat().st_mtime
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        context manager holding the exclusive write lock of the snapshot, write and update take it. Processes which
+        read the current snapshot to decide on a write hold it around both.
+        """
+        with open(str(self.lock_file), 'a+') as fp:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+                else:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _publish(self, meta):
+        tmp_file = self.meta_file.with_name('tmp.' + self.meta_file.name)
+        with open(str(tmp_file), 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(str(tmp_file), str(self.meta_file))
+
+    def read(self, mmap=True):
+        """
+        maps the snapshot.
+        Args:
+            mmap: (bool) map the files copy on write instead of reading them
+
+        Returns:
+            3-tuple (ids, codes, meta) with the valid rows of the files
+        """
+        meta = self.meta()
+        if meta is None:
+            raise IOError("no snapshot at {}!".format(self.path))
+        mode = 'c' if mmap else None
+        ids = np.load(str(self._file(meta['files'], 'ids')), mmap_mode=mode)
+        codes = np.load(str(self._file(meta['files'], 'codes')), mmap_mode=mode)
+        return ids[:meta['size']], codes[:meta['size']], meta
+
+    def norms(self, meta, mmap=True):
+        """
+        Args:
+            meta: (dict) meta data returned by read
+            mmap: (bool) map the file copy on write instead of reading it
+
+        Returns:
+            (np.array) squared norms of the codes of the generation of meta, None for snapshots without them
+        """
+        norms_file = self._file(meta['files'], 'norms')
+        if not norms_file.exists():
+            return None
+        return np.load(str(norms_file), mmap_mode='c' if mmap else None)[:meta['size']]
+
+    def load(self, mmap=True):
+        """
+        maps the snapshot.
+        Args:
+            mmap: (bool) map the files copy on write instead of reading them
+
+        Returns:
+            3-tuple (ids, codes, generation) with the valid rows of the files
+        """
+        ids, codes, meta = self.read(mmap)
+        return ids, codes, meta['generation']
+
+    def write(self, ids, codes, replace=None, **info):
+        """
+        writes all ids and codes to the files of a new generation.
+        Args:
+            ids: (np.array) ids
+            codes: (np.array) (N, dim) codes, the dtype of the snapshot
+            replace: (callable, optional) called with the meta data of the current snapshot under the write lock,
+                     the current snapshot is kept if it returns False, e.g. if it is newer
+            info: additional meta data to store, e.g. revision=...
+
+        Returns:
+            (int) the new generation, the current one if it was kept
+        """
+        with self.lock():
+            old = self.meta()
+            if old is not None and replace is not None and not replace(old):
+                return old['generation']
+            return self._write(ids, codes, old, info)
+
+    def _write(self, ids, codes, old, info):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        codes = np.asarray(codes)
+        generation = 1 if old is None else old['generation'] + 1
+
+        # never the files of another writer, even if it crashed before publishing them
+        files = '{}-{}'.format(generation, uuid.uuid4().hex[:8])
+        for name, array in (('ids', ids), ('codes', codes), ('norms', np.einsum('ij,ij->i', codes, codes))):
+            # the files of a generation are complete before the meta file points to them
+            mapped = np.lib.format.open_memmap(str(self._file(files, name)), mode='w+', dtype=array.dtype,
+                                               shape=array.shape)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+
+        meta = {'generation': generation, 'files': files, 'size': len(ids), 'dim': codes.shape[1],
+                'dtype': codes.dtype.str}
+        meta.update(info)
+        self._publish(meta)
+        if old is not None:
+            # readers keep the unlinked files mapped as long as they need them
+            self._remove_files(old['files'])
+        return generation
+
+    def _remove_files(self, files):
+        for name in ('ids', 'codes', 'norms'):
+            try:
+                os.remove(str(self._file(files, name)))
+            except OSError:
+                # still mapped by a reader on windows
+                log.debug("could not remove old snapshot file {}".format(self._file(files, name)))
+
+    def update(self, ids, codes, **info):
+        """
+        writes a new generation with the codes of new ids appended and the codes of existing ids replaced.
+        Args:
+            ids: (np.array) ids
+            codes: (np.array) (N, dim) codes
+            info: additional meta data to store, e.g. revision=...
+
+        Returns:
+            (int) the new generation
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        codes = np.asarray(codes).reshape(len(ids), -1)
+        with self.lock():
+            old = self.meta()
+            if old is None:
+                return self._write(ids, codes, old, info)
+
+            old_ids, old_codes, _ = self.read()
+            rows = {int(id): row for row, id in enumerate(old_ids)}
+            known = np.asarray([int(id) in rows for id in ids], dtype=bool)
+            new_codes = np.concatenate([old_codes, codes[~known].astype(old_codes.dtype)])
+            new_codes[[rows[int(id)] for id in ids[known]]] = codes[known]
+            return self._write(np.concatenate([old_ids, ids[~known]]), new_codes, old, info)
+
+    def remove(self):
+        """ deletes the snapshot """
+        with self.lock():
+            meta = self.meta()
+            if meta is not None:
+                os.remove(str(self.meta_file))
+                self._remove_files(meta['files'])
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+storage backends of the face database, selected by the SQLAlchemy url:
+
+    sqlite:///path/face.db      single file (default), write ahead log
+    memory://                   in-memory SQLite of the thread which opened it, for tests and single threaded ephemeral
+                                workers
+    postgresql://user@host/db   PostgreSQL with a connection pool, face codes in pgvector columns if the pgvector
+                                package and extension are available (distance search in the database), bytea otherwise
+"""
+
+import logging
+import pathlib
+import threading
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+
+log = logging.getLogger(__name__)
+
+
+class Storage(object):
+    """ a database reachable by a SQLAlchemy url """
+
+    # the face codes are stored in vector columns the database can compute distances on
+    vector_search = False
+
+    def __init__(self, url, **engine_kwargs):
+        """
+        Args:
+            url: (str) SQLAlchemy database url
+            engine_kwargs: passed to sqlalchemy.create_engine, e.g. pool_size
+        """
+        self.url = make_url(url)
+        self.engine_kwargs = engine_kwargs
+
+    def __str__(self):
+        return self.url.render_as_string(hide_password=True)
+
+    def create_engine(self):
+        engine = create_engine(self.url, **self.engine_kwargs)
+        event.listen(engine, 'connect', self._on_connect)
+        return engine
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        pass
+
+    def prepare(self, connection):
+        """ runs before the tables are created """
+        pass
+
+    def finalize(self, connection):
+        """ runs after the tables are created """
+        pass
+
+    def serialize_changes(self, connection):
+        """
+        runs before an entry is appended to the change log, the entries have to become visible in the order of their
+        ids. SQLite serializes all writers anyway.
+        """
+        pass
+
+    def mtime(self):
+        """
+        Returns:
+            (float) time of the last commit if the database is a local file, None otherwise
+        """
+        return None
+
+
+class SqliteStorage(Storage):
+
+    def __init__(self, url, **engine_kwargs):
+        Storage.__init__(self, url, **engine_kwargs)
+        self.file = pathlib.Path(self.url.database)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        # write ahead log: readers don't block on the writer and a commit appends to the log instead of
+        # syncing the database file, synchronous=NORMAL only syncs the log at checkpoints
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def mtime(self):
+        if not self.file.exists():
+            return None
+        # commits go to the write ahead log until it is checkpointed into the database file
+        wal_file = self.file.with_name(self.file.name + '-wal')
+        mtime = self.file.stat().st_mtime
+        if wal_file.exists():
+            mtime = max(mtime, wal_file.stat().st_mtime)
+        return mtime
+
+
+class MemoryStorage(Storage):
+    """
+    in-memory SQLite database on a single connection. All sessions share the connection and with it their
+    transaction, so the database is restricted to the thread which created the engine (see open_db), other threads
+    raise a RuntimeError. Threads and processes sharing a database use a sqlite:/// file.
+    """
+
+    def __init__(self, url='memory://', **engine_kwargs):
+        Storage.__init__(self, 'sqlite://', **engine_kwargs)
+
+    def __str__(self):
+        return 'memory://'
+
+    def create_engine(self):
+        # a single connection, otherwise every connection would see its own empty database. It is closed by the
+        # thread disposing the engine, so sqlite's own thread check is off.
+        return create_engine(self.url, poolclass=_ThreadPool, connect_args={'check_same_thread': False},
+                             **self.engine_kwargs)
+
+
+class _ThreadPool(StaticPool):
+    # hands the single connection to the thread which created the pool only, before the pool touches it
+
+    def __init__(self, *args, **kwargs):
+        StaticPool.__init__(self, *args, **kwargs)
+        self.owner = threading.get_ident()
+
+    def connect(self):
+        if threading.get_ident() != self.owner:
+            raise RuntimeError("the in-memory database can only be used by the thread which opened it!")
+        return StaticPool.connect(self)
+
+
+class PostgresStorage(Storage):
+
+    def __init__(self, url, vector=True, pool_size=5, max_overflow=10, **engine_kwargs):
+        """
+        Args:
+            url: (str) SQLAlchemy database url
+            vector: (bool) store the face codes in pgvector columns if available
+            pool_size: (int) number of connections kept open
+            max_overflow: (int) number of additional connections under load
+            engine_kwargs: passed to sqlalchemy.create_engine
+        """
+        engine_kwargs.setdefault('pool_pre_ping', True)
+        Storage.__init__(self, url, pool_size=pool_size, max_overflow=max_overflow, **engine_kwargs)
+        self.vector_search = vector and vector_type() is not None
+
+    def prepare(self, connection):
+        if self.vector_search:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS vector'))
+
+    def serialize_changes(self, connection):
+        # concurrent transactions would commit their change log ids out of order, readers that already applied a
+        # later id would miss the earlier one. The lock is held until the end of the transaction.
+        connection.execute(text('LOCK TABLE face_changes IN SHARE ROW EXCLUSIVE MODE'))
+
+    def finalize(self, connection):
+        if self.vector_search:
+            # approximate nearest neighbour index for the distance searches
+            connection.execute(text('CREATE INDEX IF NOT EXISTS face_codes_code_hnsw ON face_codes '
+                                    'USING hnsw (code vector_l2_ops)'))
+
+
+def vector_type():
+    """
+    Returns:
+        (class) the pgvector SQLAlchemy column type, None if the pgvector package is not installed
+    """
+    try:
+        from pgvector.sqlalchemy import Vector
+        return Vector
+    except ImportError:
+        return None
+
+
+def create_storage(url, **kwargs):
+    """
+    Args:
+        url: (str) SQLAlchemy database url or memory:// for an in-memory database
+        kwargs: backend parameters, e.g. pool_size
+
+    Returns:
+        (Storage)
+    """
+    if str(url).startswith('memory://'):
+        return MemoryStorage(**kwargs)
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        if not make_url(url).database:
+            return MemoryStorage(**kwargs)
+        return SqliteStorage(url, **kwargs)
+    if backend == 'postgresql':
+        return PostgresStorage(url, **kwargs)
+    return Storage(url, **kwargs)
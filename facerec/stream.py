@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+decoding of video files and streams (e.g. rtsp://) on a reader thread, for FaceTracker.process.
+
+The decoded frames go through a bounded queue. Recorded files are read with the 'block' policy: no frame is lost
+and the tracker runs as fast as it can, faster than real time if decoding and tracking are. Live streams use
+'drop_oldest' with a queue of a single frame: the tracker always gets the newest frame and the frames it can't keep
+up with are dropped instead of piling up latency.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# a decoded frame, timestamp in seconds of the stream position (files) or the wall clock (live streams)
+Frame = namedtuple('Frame', ['index', 'timestamp', 'image'])
+
+
+class LatencyStats(object):
+    """ running statistics of the latencies of a processing stage """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    @property
+    def mean(self):
+        """ (float) mean latency in seconds, 0 before the first measurement """
+        return self.total / self.count if self.count > 0 else 0.
+
+    def __repr__(self):
+        return "mean {:.1f} ms, max {:.1f} ms over {}".format(1e3 * self.mean, 1e3 * self.max, self.count)
+
+
+def is_live(source):
+    """
+    Args:
+        source: (str, int) file path, stream url or camera index
+
+    Returns:
+        (bool) True for cameras and stream urls, False for local files
+    """
+    if isinstance(source, int):
+        return True
+    if not isinstance(source, str):
+        return getattr(source, 'live', True)
+    return '://' in source and not source.startswith('file://') and not os.path.exists(source)
+
+
+class VideoReader(threading.Thread):
+    """
+    decodes the frames of a video source into a bounded queue.
+
+        reader = VideoReader('rtsp://camera/stream')
+        reader.start()
+        for frame in reader:
+            ...
+    """
+
+    policies = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, source, maxsize=None, policy=None, latency=None, notify=None):
+        """
+        Args:
+            source: (str, int or capture) file path, stream url, camera index or an object with the read() and
+                    release() methods of cv2.VideoCapture
+            maxsize: (int, optional) number of decoded frames to buffer, defaults to 1 for live sources and 32 for
+                    files
+            policy: (str, optional) what happens if the queue is full, 'block' waits for the consumer, 'drop_newest'
+                    discards the new frame, 'drop_oldest' the oldest buffered one. Defaults to 'drop_oldest' for
+                    live sources and 'block' for files
+            latency: (LatencyStats, optional) records the time to decode a frame
+            notify: (callable, optional) called without arguments on the reader thread whenever a frame or the end
+                    of the source was queued, e.g. to schedule the consumer
+        """
+        super(VideoReader, self).__init__(daemon=True)
+        live = is_live(source)
+        policy = policy or ('drop_oldest' if live else 'block')
+        if policy not in self.policies:
+            raise ValueError("policy must be one of {}!".format(self.policies))
+        self.source = source
+        self.live = live
+        self.policy = policy
+        self.latency = latency if latency is not None else LatencyStats()
+        self.notify = notify
+        self.nframes = 0
+        self.ndropped = 0
+        self.finished = False
+        self._frames = queue.Queue(maxsize or (1 if live else 32))
+        self._stopped = threading.Event()
+
+    def _open(self):
+        if hasattr(self.source, 'read'):
+            return self.source
+        import cv2
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise IOError("can not open video source {}!".format(self.source))
+        return capture
+
+    def _timestamp(self, capture):
+        if self.live:
+            return time.time()
+        try:
+            import cv2
+            return capture.get(cv2.CAP_PROP_POS_MSEC) / 1e3
+        except (ImportError, AttributeError):
+            return float(self.nframes)
+
+    def run(self):
+        try:
+            capture = self._open()
+        except Exception as e:
+            log.error(str(e))
+            # raised to the consumer instead of an empty source
+            self._put(e)
+            return
+        try:
+            while not self._stopped.is_set():
+                start = time.perf_counter()
+                ok, image = capture.read()
+                if not ok:
+                    log.info("end of video source {} after {} frames".format(self.source, self.nframes))
+                    break
+                self.latency.add(time.perf_counter() - start)
+                self._enqueue(Frame(self.nframes, self._timestamp(capture), image))
+                self.nframes += 1
+        finally:
+            capture.release()
+            self._put(None)
+
+    def _put(self, item):
+        # blocks, but gives up once the reader is stopped
+        while not self._stopped.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if self.notify is not None:
+            self.notify()
+
+    def _enqueue(self, frame):
+        if self.policy == 'block':
+            return self._put(frame)
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                break
+            except queue.Full:
+                self.ndropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                try:
+                    self._frames.get_nowait()
+                except queue.Empty:
+                    pass
+        if self.notify is not None:
+            self.notify()
+
+    def pending(self):
+        """ (bool) whether a frame or the end of the source waits for next_frame """
+        return not self.finished and not self._frames.empty()
+
+    def next_frame(self):
+        """
+        Returns:
+            (Frame) the next queued frame, None if there is none yet or the source ended (finished is set)
+
+        Raises:
+            the error opening the source, once (finished is set)
+        """
+        if self.finished:
+            return None
+        try:
+            frame = self._frames.get_nowait()
+        except queue.Empty:
+            return None
+        if frame is None or isinstance(frame, Exception):
+            self.finished = True
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def __iter__(self):
+        """
+        Returns:
+            generator of Frame until the end of the source or stop()
+
+        Raises:
+            the error opening the source, e.g. IOError
+        """
+        while not self._stopped.is_set():
+            try:
+                frame = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                if not self.is_alive():
+                    return
+                continue
+            if frame is None:
+                return
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+
+    def stop(self):
+        """ stops decoding and ends the iteration """
+        self._stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+"""
+face tracking of many video streams on shared resources: one pool of worker threads for the detection, tracking
+and identification of all streams, one batched identification service and one callback executor.
+
+    pool = FaceTrackerPool(max_workers=8)
+    for i, url in enumerate(camera_urls):
+        pool.add_stream('camera {}'.format(i), url, identification_callback=on_identified)
+    ...
+    pool.stop()
+
+Every stream is decoded on its own reader thread (decoding releases the GIL) into a single slot holding its newest
+frame. The workers serve the streams with a pending frame round robin, one frame of a stream at a time: a busy
+camera can't starve the others, and max_workers bounds the CPU used by all streams together. The identifications of
+the streams run on the same workers, their face codes are looked up together in batches. The streams share the
+dlib models, one set per worker.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from . import dlib_api
+from .facetracker import FaceTracker, CallbackExecutor
+from .stream import VideoReader
+
+log = logging.getLogger(__name__)
+
+
+class _SharedDetector(object):
+    # the face detector of all trackers of a pool. dlib models must not run on several threads at once, it is the
+    # detector of the models of the calling worker thread (see dlib_api.use_thread_models), not one per stream.
+
+    def __call__(self, image, *args):
+        return dlib_api.detector(image, *args)
+
+
+class _Stream(object):
+
+    def __init__(self, name, tracker, frame_callback):
+        self.name = name
+        self.tracker = tracker
+        self.frame_callback = frame_callback
+        self.reader = None
+        self.busy = False
+        self.queued = False
+        self.nprocessed = 0
+
+
+class FaceTrackerPool(object):
+    """ tracks the faces of many video streams with a shared worker pool and identification service """
+
+    def __init__(self, url=None, max_workers=None, callback_workers=2, callback_queue_size=1000,
+                 callback_policy='block', max_batch_size=256, max_batch_delay=0.01):
+        """
+        Args:
+            url: (str, optional) url of a facerec server to identify the faces with, the local face database by
+                 default
+            max_workers: (int, optional) global CPU budget, number of frames processed at the same time over all
+                 streams, defaults to the number of CPUs
+            callback_workers: (int) number of threads running the callbacks of all streams
+            callback_queue_size: (int) maximal number of waiting callbacks per thread
+            callback_policy: (str) 'block', 'drop_newest' or 'drop_oldest', see CallbackExecutor
+            max_batch_size: (int) maximal number of face codes per lookup in the local face database
+            max_batch_delay: (float) seconds to wait for the face codes of further streams before a lookup
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.callbacks = CallbackExecutor(callback_workers, callback_queue_size, callback_policy)
+        if url is not None:
+            from .client import FacerecApi
+            # the server batches the concurrent requests of the workers
+            self.api = FacerecApi(url, pool_size=self.max_workers)
+            self._batcher = None
+            self.identify_codes = self.api.identify_facecodes
+        else:
+            from .server import Batcher
+            self.api = None
+            self._batcher = Batcher(max_batch_size, max_batch_delay)
+            self._batcher.start()
+            self.identify_codes = lambda codes: self._batcher.identify(codes).result()
+
+        self.detector = _SharedDetector()
+        self._streams = {}
+        self._ready = collections.deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(self.max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def add_stream(self, name, source, frame_callback=None, maxsize=None, policy=None, **tracker_kwargs):
+        """
+        starts to track the faces of a video source.
+        Args:
+            name: (hashable) name of the stream, e.g. the camera
+            source: (str, int) file path, stream url or camera index (or an object like cv2.VideoCapture)
+            frame_callback: (callable, optional) called as frame_callback(name, frame, faces) on the worker after
+                 every processed frame (stream.Frame, list of TrackedFace)
+            maxsize: (int, optional) number of decoded frames to buffer, see stream.VideoReader
+            policy: (str, optional) 'block', 'drop_newest' or 'drop_oldest', defaults to the newest frame for live
+                 sources and every frame for files
+            tracker_kwargs: parameters of the FaceTracker, e.g. identification_interval or identification_callback
+
+        Returns:
+            (FaceTracker) the tracker of the stream
+        """
+        if name in self._streams:
+            raise ValueError("stream {} already exists!".format(name))
+        tracker = FaceTracker(callbacks=self.callbacks, identify_codes=self.identify_codes, detector=self.detector,
+                              **tracker_kwargs)
+        stream = _Stream(name, tracker, frame_callback)
+        stream.reader = VideoReader(source, maxsize, policy, latency=tracker.latencies['decode'],
+                                    notify=lambda: self._schedule(stream))
+        with self._condition:
+            self._streams[name] = stream
+        stream.reader.start()
+        return tracker
+
+    def remove_stream(self, name):
+        """ stops the stream and its tracker """
+        with self._condition:
+            stream = self._streams.pop(name)
+            if stream.queued:
+                self._ready.remove(stream)
+                stream.queued = False
+            while stream.busy:
+                self._condition.wait()
+        stream.reader.stop()
+        stream.tracker.stop()
+
+    def _schedule(self, stream):
+        with self._condition:
+            if not stream.busy and not stream.queued and stream.name in self._streams:
+                stream.queued = True
+                self._ready.append(stream)
+                self._condition.notify()
+
+    def _work(self):
+        # the detection and the face codes of concurrent streams run on models of the worker
+        dlib_api.use_thread_models()
+        while True:
+            with self._condition:
+                while len(self._ready) == 0 and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                stream = self._ready.popleft()
+                stream.queued = False
+                if self._streams.get(stream.name) is not stream:
+                    # removed while it waited in the line
+                    continue
+                stream.busy = True
+            try:
+                self._process(stream)
+            except Exception:
+                log.exception("processing of stream {} failed".format(stream.name))
+            with self._condition:
+                stream.busy = False
+                self._condition.notify_all()
+            if stream.reader.pending() or \
+                    (stream.tracker.identification_due() and len(stream.tracker.tracked_faces) > 0):
+                # back to the end of the line, after all other waiting streams
+                self._schedule(stream)
+
+    def _process(self, stream):
+        frame = stream.reader.next_frame()
+        if frame is not None:
+            faces = list(stream.tracker.update(frame.image))
+            stream.nprocessed += 1
+            if stream.frame_callback is not None:
+                stream.frame_callback(stream.name, frame, faces)
+        if stream.tracker.identification_due() and len(stream.tracker.tracked_faces) > 0:
+            stream.tracker.identify_faces()
+
+    def stats(self):
+        """
+        Returns:
+            (dict) per stream name a dict with the number of 'decoded', 'processed' and 'dropped' frames and the
+            'latencies' of decoding, detection and identification
+        """
+        with self._condition:
+            streams = list(self._streams.values())
+        return {stream.name: {'decoded': stream.reader.nframes, 'processed': stream.nprocessed,
+                              'dropped': stream.reader.ndropped, 'latencies': dict(stream.tracker.latencies)}
+                for stream in streams}
+
+    def streams(self):
+        """ (list) names of the streams """
+        with self._condition:
+            return list(self._streams)
+
+    def finished(self):
+        """ (bool) whether all sources ended and their frames are processed """
+        with self._condition:
+            return all(stream.reader.finished and not stream.busy and not stream.queued
+                       for stream in self._streams.values())
+
+    def wait(self, timeout=None):
+        """
+        blocks until all sources ended, e.g. to process recorded files.
+        Returns:
+            (bool) False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self):
+        """ stops all streams, the workers and the identification service """
+        for name in self.streams():
+            self.remove_stream(name)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self.callbacks.shutdown()
+        if self._batcher is not None:
+            self._batcher.stop()
+        if self.api is not None:
+            self.api.close()
@@ -33,7 +33,9 @@ setup(
       'Intended Audience :: Developers',
       'Programming Language :: Python :: 3',
     ],
-    entry_points={'console_scripts': []},
+    entry_points={'console_scripts': ['facerec-ingest=facerec.pipeline:main',
+                                    'facerec-server=facerec.server:main',
+                                    'facerec-compact=facerec.compaction:main']},
     keywords='',
     packages=find_packages(exclude=['docs', 'tests*']),
     include_package_data=True,
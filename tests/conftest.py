@@ -0,0 +1,13 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import pytest
+from facerec import facedb
+
+
+@pytest.fixture(scope='function')
+def tmpdb(tmpdir):
+    facedb.set_db_path(tmpdir)
+    return tmpdir
@@ -1,4 +1,4 @@
-from facerec.client import FacerecApi
+from facerec.client import FacerecApi, AsyncFacerecApi
 from facerec.dlib_api import detect_faces
 import pytest
 import cv2
@@ -50,4 +50,13 @@ def test_teach_code(client):
 
 def test_teach_image(client):
     img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
-    print(client.teach_image(img, name='Tobias Schoch'))
\ No newline at end of file
+    print(client.teach_image(img, name='Tobias Schoch'))
+
+def test_async_identify_codes():
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    facecode, rect, shape = detect_faces(img)[0]
+    api = AsyncFacerecApi("http://localhost:80", max_concurrency=4)
+    persons = api.run(api.map(api.identify_facecode, [facecode] * 10))
+    api.run(api.close())
+    assert len(persons) == 10
+    assert len(set(p['id'] for p in persons)) == 1
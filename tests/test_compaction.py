@@ -0,0 +1,77 @@
+from facerec import facedb, compaction
+import numpy as np
+import pytest
+import time
+
+
+def test_cluster():
+    rng = np.random.RandomState(0)
+    centers = rng.randn(5, 128)
+    codes = centers[np.repeat(np.arange(5), 4)] + rng.randn(20, 128) * 0.01
+    seeds = compaction.cluster(codes, 0.3)
+    assert len(np.unique(seeds)) == 5
+    # the same neighbours row by row
+    blocks = compaction._neighbours(codes, 0.3, max_bytes=1)
+    assert all(np.array_equal(a, b) for a, b in zip(blocks, compaction._neighbours(codes, 0.3)))
+    assert np.all(seeds.reshape(5, 4) == seeds.reshape(5, 4)[:, :1])
+    # the seed order decides the representative
+    seeds = compaction.cluster(codes, 0.3, order=np.arange(20)[::-1])
+    assert np.all(seeds == np.repeat(np.arange(3, 20, 4), 4))
+
+
+def test_hits(tmpdb):
+    codes = np.random.randn(2, 128)
+    p = facedb.identify_person(codes[0])
+    for i in range(3):
+        facedb.identify_person(codes[0] + 0.01)
+    facedb.identify_person(codes[1])
+    session = facedb.assert_session()
+    session.refresh(p)
+    # accumulated in memory until the flush
+    assert p.hits == 0
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database gone")
+
+    # the counts of a failed flush are kept for the next one
+    factory = facedb.Session.session_factory
+    facedb.Session.session_factory = fail
+    try:
+        with pytest.raises(RuntimeError):
+            facedb.flush_hits()
+    finally:
+        facedb.Session.session_factory = factory
+    facedb.identify_person(codes[0])
+    assert facedb.flush_hits() == 2
+    session.refresh(p)
+    assert p.hits == 5
+    assert p.last_seen == pytest.approx(time.time(), abs=60)
+
+
+def test_compact(tmpdb):
+    rng = np.random.RandomState(1)
+    centers = rng.randn(10, 128) * 0.2
+    facedb.teach(centers[0], name='known')
+    session = facedb.assert_session()
+    # near duplicate unknowns of 9 faces and 5 stale ones
+    unknowns = [facedb.Person(name=facedb.unknown_tag, code=centers[1 + i % 9] + rng.randn(128) * 0.005,
+                              hits=i, last_seen=time.time()) for i in range(45)]
+    stale = [facedb.Person(name=facedb.unknown_tag, code=rng.randn(128), hits=1, last_seen=time.time() - 100 * 86400)
+             for i in range(5)]
+    session.add_all(unknowns + stale)
+    session.commit()
+    codes = [p.code for p in unknowns[::9]]
+
+    report = compaction.compact(max_age=30, min_hits=2, merge_distance=0.3)
+    assert report['expired'] == 5
+    assert report['merged'] == 36
+    assert report['persons'] == (51, 10)
+    assert len(facedb.get_index()) == report['exemplars'][1]
+    assert facedb.get_person('known').nmeans == 2
+
+    # the nmeans weighted centroid
+    merged = facedb.find_similar_persons(centers[1])[0]
+    assert merged.nmeans == 5
+    assert np.allclose(merged.code, np.mean(codes, axis=0), atol=1e-5)
+    assert merged.hits == sum(range(0, 45, 9))
+    assert len(merged.exemplars) <= facedb.get_exemplar_policy()['max_exemplars']
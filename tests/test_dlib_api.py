@@ -4,16 +4,46 @@
 # author:  TOS
 
 import pytest
-from .test_facedb import tmpdb
 import glob
 import os
 import pathlib
+import subprocess
+import sys
+import threading
 import cv2
+import numpy as np
 import facerec.dlib_api
 import facerec.facedb
 
 here = os.path.split(__file__)[0]
 
+def test_lazy_import():
+    # neither the package nor the client should load dlib or its models
+    code = "import sys, facerec, facerec.client; assert 'dlib' not in sys.modules"
+    subprocess.check_call([sys.executable, '-c', code])
+
+def test_preload():
+    facerec.dlib_api.preload()
+    assert facerec.dlib_api._models is not None
+    assert facerec.dlib_api.detector is facerec.dlib_api._models[0]
+
+def test_thread_models():
+    facerec.dlib_api.preload()
+    models = []
+
+    def load():
+        facerec.dlib_api.use_thread_models()
+        models.append(facerec.dlib_api.facerec)
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every thread its own models, the others keep the shared ones
+    assert len({id(m) for m in models + [facerec.dlib_api.facerec]}) == 3
+    assert facerec.dlib_api.facerec is facerec.dlib_api._models[2]
+
 def test_identify_no_face(tmpdb):
     img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
     persons = facerec.dlib_api.detect_and_identify_faces(img)
@@ -40,4 +70,38 @@ def test_teach_tos(tmpdb):
     assert len(persons) == 1
     person = persons[0][0]
     assert person.id == 2
-    assert person.name == 'unknown'
\ No newline at end of file
+    assert person.name == 'unknown'
+
+def test_detect_faces_batch():
+    files = sorted(glob.glob(os.path.join(here, 'data', "*.jpg")))[:4]
+    images = [cv2.imread(f) for f in files]
+
+    batch = facerec.dlib_api.detect_faces_batch(images)
+    assert len(batch) == len(images)
+    for img, faces in zip(images, batch):
+        single = facerec.dlib_api.detect_faces(img)
+        assert len(single) == len(faces)
+        for (code, rect, shape), (batch_code, batch_rect, batch_shape) in zip(single, faces):
+            assert rect == batch_rect
+            assert np.allclose(code, batch_code, atol=1e-4)
+
+
+def test_detection_modes():
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    reference = facerec.dlib_api.locate_faces(img, upsample=1, scale=1.0)
+    assert len(reference) == 1
+    r = reference[0]
+
+    # coarse detection maps back to full resolution coordinates
+    coarse = facerec.dlib_api.locate_faces(img, upsample=1, scale=0.5)
+    assert len(coarse) == 1
+    assert abs(coarse[0].center().x - r.center().x) < r.width() / 4
+    assert abs(coarse[0].center().y - r.center().y) < r.height() / 4
+
+    roi = [(r.left() - r.width(), r.top() - r.height(), r.right() + r.width(), r.bottom() + r.height())]
+    assert len(facerec.dlib_api.locate_faces(img, roi=roi)) == 1
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    assert len(facerec.dlib_api.locate_faces(img, roi=mask)) == 0
+
+    facecode, rect, shape = facerec.dlib_api.detect_faces(img, scale=0.5)[0]
+    assert np.linalg.norm(facecode - facerec.dlib_api.detect_faces(img)[0][0]) < 0.2
@@ -6,13 +6,145 @@
 import logging
 import os
 import cv2
-from facerec.facetracker import FaceTracker
+import numpy as np
+import threading
+from facerec.facetracker import FaceTracker, IdentificationScheduler, TrackStore, CallbackExecutor, match_faces
+from facerec.dlib_api import detect_faces
 from facerec import facedb
 
 log = logging.getLogger(__name__)
 
 here = os.path.split(__file__)[0]
 
+def test_match_faces():
+    tracks = np.asarray([[0, 0, 100, 100], [90, 0, 190, 100], [500, 500, 600, 600]])
+    # the two close faces moved towards each other, greedy first hit matching would swap them
+    detections = np.asarray([[95, 0, 195, 100], [20, 0, 120, 100], [2000, 2000, 2100, 2100]])
+    rows, cols = match_faces(tracks, detections, 0.8)
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 0)]
+
+    rows, cols = match_faces(np.empty((0, 4)), detections, 0.8)
+    assert len(rows) == 0 and len(cols) == 0
+
+def test_track_store():
+    store = TrackStore(nbuffer=2)
+    store.add('a', [0, 0, 10, 10])
+    store.add('b', [100, 100, 110, 110])
+    store.update_in_frame(store.rows(['a', 'b']), np.asarray([[2, 2, 12, 12], [100, 100, 110, 110]]))
+    assert store.coords('a').tolist() == [1, 1, 11, 11]
+    store.update_in_frame(store.rows(['a']), np.asarray([[4, 4, 14, 14]]))
+    assert store.coords('a').tolist() == [3, 3, 13, 13]
+
+    store.update_not_in_frame(store.rows(['a']))
+    assert store.missing('a') == 1
+    store.remove('a')
+    assert store.ids == ['b']
+    assert store.coords().tolist() == [[100, 100, 110, 110]]
+
+def test_callback_executor_order():
+    executor = CallbackExecutor(nworkers=3)
+    events = []
+    for i in range(100):
+        for event in ('appeared', 'identified', 'disappeared'):
+            executor.submit(i, lambda i, event: events.append((i, event)), i, event)
+    executor.shutdown()
+    assert executor.nexecuted == 300 and executor.depth() == 0
+    for i in range(100):
+        assert [event for j, event in events if j == i] == ['appeared', 'identified', 'disappeared']
+
+def test_callback_executor_drop():
+    release = threading.Event()
+    executor = CallbackExecutor(nworkers=1, maxsize=2, policy='drop_oldest')
+    executed = []
+    executor.submit('track', release.wait)
+    while executor.depth() > 0:
+        pass
+    for i in range(5):
+        executor.submit('track', executed.append, i)
+    assert executor.depth() == 2 and executor.ndropped == 3
+    release.set()
+    executor.shutdown()
+    assert executed == [3, 4]
+
+def test_identification_scheduler():
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    facecode, rect, shape = detect_faces(img)[0]
+    rects = [(rect.left(), rect.top(), rect.right(), rect.bottom())]
+    tracks = [{'id': 'track'}]
+
+    scheduler = IdentificationScheduler(min_interval=1, max_interval=8)
+    due, _, codes = scheduler.codes(img, tracks, rects, now=0)
+    assert len(due) == 1 and scheduler.ncomputed == 1
+    assert (abs(codes[0] - facecode) < 1e-3).all()
+    scheduler.identified('track', changed=True, now=0)
+
+    # not due yet
+    due, _, _ = scheduler.codes(img, tracks, rects, now=0.5)
+    assert len(due) == 0
+
+    # confirmed identities back off, the unchanged face reuses its descriptor
+    for now, interval in [(1, 2), (3, 4), (7, 8), (15, 8)]:
+        due, _, _ = scheduler.codes(img, tracks, rects, now=now)
+        assert len(due) == 1
+        scheduler.identified('track', changed=False, now=now)
+        assert scheduler._states['track'].interval == interval
+    assert scheduler.ncomputed == 1 and scheduler.ncached == 4
+
+    # tracks that are gone are forgotten
+    scheduler.codes(img, [], [], now=100)
+    assert len(scheduler._states) == 0
+
+def test_detect_every_nframes():
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    tracker = FaceTracker(detect_every_nframes=5, identification_interval=3600)
+    detections = []
+    detector = tracker.detector
+    tracker.detector = lambda frame, *args: detections.append(1) or detector(frame, *args)
+
+    try:
+        track_ids = set()
+        for i in range(10):
+            faces = list(tracker.update(img))
+            assert len(faces) == 1
+            track_ids.add(faces[0].id())
+        assert len(track_ids) == 1
+        assert len(detections) == 2
+    finally:
+        tracker.stop()
+        facedb.close()
+
+def test_frame_copy():
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    tracker = FaceTracker(identification_interval=3600)
+    try:
+        tracker.update(img)
+        # the caller draws on its frame, the identifier detects on the original
+        img[:] = 0
+        assert tracker._shared['frame'].any()
+    finally:
+        tracker.stop()
+        facedb.close()
+
+def test_process_video_file(tmpdir):
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    video = str(tmpdir.join('video.avi'))
+    writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 25, (img.shape[1], img.shape[0]))
+    for i in range(20):
+        writer.write(img)
+    writer.release()
+
+    tracker = FaceTracker(identification_interval=3600)
+    try:
+        results = list(tracker.process(video))
+        assert [frame.index for frame, faces in results] == list(range(20))
+        assert all(len(faces) == 1 for frame, faces in results)
+        assert tracker.reader.ndropped == 0
+        assert tracker.latencies['decode'].count == 20
+        assert tracker.latencies['detect'].count == 20
+    finally:
+        tracker.stop()
+        facedb.close()
+
 def test_webcamstream_tracker_local():
 
     tracker = FaceTracker()
@@ -82,3 +214,29 @@ def test_tracker_server_logging():
         cv2.destroyAllWindows()
         tracker.stop()
         facedb.close()
+
+def test_webcamstream_tracker_identify_tracked_faces():
+    tracker = FaceTracker(identify_tracked_faces=True,
+                          identification_callback=lambda face: log.info("identified: {}".format(face['name'])))
+
+    cam = cv2.VideoCapture(0)
+    color_green = (0, 255, 0)
+    line_width = 3
+
+    try:
+        while True:
+            ret_val, img = cam.read()
+            faces = tracker.update(img)
+            # draw on a copy, the tracker shares the frame with the identifier
+            img = img.copy()
+            for face in faces:
+                coords = face.coords();
+                cv2.rectangle(img, (coords[0], coords[1]), (coords[2], coords[3]), color_green, line_width)
+                cv2.putText(img, face.name('not identified'), (coords[0], coords[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 1, cv2.LINE_AA)
+            cv2.imshow('my webcam', img)
+            if cv2.waitKey(1) == 27:
+                break  # esc to quit
+    finally:
+        cv2.destroyAllWindows()
+        tracker.stop()
+        facedb.close()
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import json
+import os
+import facerec.facedb
+import facerec.pipeline
+
+here = os.path.split(__file__)[0]
+
+
+def test_iter_image_paths():
+    paths = list(facerec.pipeline.iter_image_paths([os.path.join(here, 'data')]))
+    assert all(p.lower().endswith(facerec.pipeline.image_extensions) for p in paths)
+    assert paths == sorted(paths)
+
+
+def test_search_resume(tmpdb):
+    output = str(tmpdb.join('results.jsonl'))
+    nimages = len(list(facerec.pipeline.iter_image_paths([os.path.join(here, 'data')])))
+
+    stats = facerec.pipeline.ingest([os.path.join(here, 'data')], mode='search', processes=2, output=output)
+    assert stats['images'] == nimages
+    assert stats['faces'] >= 1
+    with open(output) as fp:
+        records = [json.loads(line) for line in fp]
+    assert len(records) == nimages
+    assert len(facerec.facedb.persons()) >= 1
+
+    # everything is journaled, a second run has nothing left to do
+    stats = facerec.pipeline.ingest([os.path.join(here, 'data')], mode='search', processes=2, output=output)
+    assert stats['images'] == 0
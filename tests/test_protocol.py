@@ -0,0 +1,31 @@
+from facerec import protocol
+import numpy as np
+import pytest
+
+
+def test_facecodes_roundtrip():
+    codes = np.random.randn(20, 128) * 0.1
+    body = protocol.encode_facecodes(codes, names=['a'] * 20)
+    # float32 payload, about 4 bytes per dimension
+    assert len(body) < 20 * 128 * 4 + 512
+    decoded, header = protocol.decode_facecodes(body)
+    assert decoded.dtype == np.float64
+    assert decoded.shape == codes.shape
+    assert np.abs(decoded - codes).max() < 1e-6
+    assert header == {'names': ['a'] * 20}
+
+
+def test_invalid_body():
+    with pytest.raises(ValueError):
+        protocol.unpack(b'{"code": ""}')
+    body = protocol.encode_facecodes(np.zeros((2, 128)))
+    with pytest.raises(ValueError):
+        protocol.decode_facecodes(body[:-4])
+
+
+def test_images_roundtrip():
+    images = [np.zeros((32, 32, 3), dtype=np.uint8), np.full((16, 24, 3), 255, dtype=np.uint8)]
+    files, header = protocol.decode_images(protocol.encode_images(images, ids=[1, 2]))
+    assert len(files) == 2
+    assert header == {'ids': [1, 2]}
+    assert all(f[:2] == b'\xff\xd8' for f in files)
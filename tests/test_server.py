@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import http.client
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from facerec.client import FacerecApi
+from facerec.server import FacerecServer
+
+
+@pytest.fixture()
+def server(tmpdb):
+    server = FacerecServer('localhost', 0, processes=1, max_batch_delay=0.02)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_facecodes(server):
+    api = FacerecApi(server.url)
+    codes = np.random.rand(5, 128)
+
+    taught = api.teach_facecodes(codes, names=['person {}'.format(i) for i in range(5)])
+    assert [p['name'] for p in taught] == ['person {}'.format(i) for i in range(5)]
+    assert len(api.faces()) == 5
+
+    persons = api.identify_facecodes(codes[::-1])
+    assert [p['id'] for p in persons] == [p['id'] for p in taught][::-1]
+    assert api.identify_facecode(codes[0])['id'] == taught[0]['id']
+
+    assert api.set_name(taught[0]['id'], 'renamed')['name'] == 'renamed'
+    assert api.face('renamed')['id'] == taught[0]['id']
+    api.delete_face(taught[0]['id'])
+    assert len(api.faces()) == 4
+    assert 'error' in api.face(taught[0]['id'])
+
+    assert api.set_config(threshold=0.5)['threshold'] == 0.5
+    api.close()
+
+
+def test_micro_batching(server):
+    api = FacerecApi(server.url, pool_size=16)
+    codes = np.random.rand(64, 128)
+    with ThreadPoolExecutor(16) as pool:
+        persons = list(pool.map(api.identify_facecode, codes))
+    # every code an unknown person of its own
+    assert len(set(p['id'] for p in persons)) == 64
+    assert server.batcher.ncodes == 64
+    assert server.batcher.nbatches < 64
+    api.close()
+
+
+def test_keep_alive(server):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    sockets = []
+    # the bodies of unknown routes and failed requests are skipped, the connection serves the next request
+    for method, path, status in [('POST', '/unknown', 404), ('GET', '/faces', 200),
+                                 ('POST', '/facecode/identify', 400), ('GET', '/faces', 200)]:
+        connection.request(method, path, body=b'{"no": "code"}', headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        assert response.status == status
+        sockets.append(connection.sock)
+    assert all(sock is sockets[0] for sock in sockets)
+    connection.close()
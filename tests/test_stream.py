@@ -0,0 +1,102 @@
+import time
+import numpy as np
+import pytest
+from facerec.stream import VideoReader, LatencyStats, is_live
+
+
+class FakeCapture(object):
+    """ a decoded video of nframes frames """
+
+    def __init__(self, nframes, fps=None, live=False):
+        self.nframes = nframes
+        self.fps = fps
+        self.live = live
+        self.index = 0
+        self.released = False
+
+    def read(self):
+        if self.index == self.nframes:
+            return False, None
+        if self.fps is not None:
+            time.sleep(1. / self.fps)
+        self.index += 1
+        return True, np.full((4, 4, 3), self.index, dtype=np.uint8)
+
+    def release(self):
+        self.released = True
+
+
+def test_is_live(tmpdir):
+    assert is_live(0)
+    assert is_live('rtsp://camera/stream')
+    video = tmpdir.join('video.mp4')
+    video.write(b'')
+    assert not is_live(str(video))
+    assert not is_live(FakeCapture(1))
+
+
+def test_reader_file():
+    capture = FakeCapture(100)
+    reader = VideoReader(capture, maxsize=4)
+    assert reader.policy == 'block'
+    reader.start()
+    frames = []
+    for frame in reader:
+        # slower than the decoder, but no frame is lost
+        time.sleep(0.001)
+        frames.append(frame)
+    assert [frame.index for frame in frames] == list(range(100))
+    assert reader.ndropped == 0
+    assert reader.latency.count == 100
+    assert capture.released
+
+
+def test_reader_live_newest_frame():
+    reader = VideoReader(FakeCapture(50, fps=500, live=True))
+    assert reader.policy == 'drop_oldest'
+    reader.start()
+    indices = []
+    for frame in reader:
+        time.sleep(0.01)
+        indices.append(frame.index)
+    assert indices == sorted(indices)
+    assert reader.ndropped > 0
+    assert len(indices) + reader.ndropped == 50
+
+
+def test_reader_stop():
+    reader = VideoReader(FakeCapture(10 ** 6), maxsize=2)
+    reader.start()
+    for frame in reader:
+        if frame.index == 5:
+            reader.stop()
+    assert not reader.is_alive()
+    assert reader.nframes < 10
+
+
+def test_reader_open_error():
+    def fail():
+        raise IOError("can not open video source!")
+
+    reader = VideoReader(FakeCapture(1))
+    reader._open = fail
+    reader.start()
+    with pytest.raises(IOError):
+        list(reader)
+
+    reader = VideoReader(FakeCapture(1))
+    reader._open = fail
+    reader.start()
+    reader.join()
+    with pytest.raises(IOError):
+        reader.next_frame()
+    assert reader.finished and reader.next_frame() is None
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    assert stats.mean == 0
+    stats.add(0.01)
+    stats.add(0.03)
+    assert stats.mean == pytest.approx(0.02)
+    assert stats.max == 0.03
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+# created: 18.10.2026
+# author:  TOS
+
+import collections
+import os
+import threading
+import cv2
+from facerec.trackerpool import FaceTrackerPool
+from facerec import facedb
+
+here = os.path.split(__file__)[0]
+
+
+class ImageCapture(object):
+    """ a recorded video showing the same image in every frame """
+
+    live = False
+
+    def __init__(self, image, nframes):
+        self.image = image
+        self.nframes = nframes
+
+    def read(self):
+        if self.nframes == 0:
+            return False, None
+        self.nframes -= 1
+        return True, self.image.copy()
+
+    def release(self):
+        pass
+
+
+def test_tracker_pool(tmpdb):
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    processed = collections.Counter()
+    identified = []
+    lock = threading.Lock()
+
+    def on_frame(name, frame, faces):
+        with lock:
+            processed[name] += len(faces)
+
+    pool = FaceTrackerPool(max_workers=2)
+    try:
+        trackers = [pool.add_stream('camera {}'.format(i), ImageCapture(img, 10), frame_callback=on_frame,
+                                    identification_callback=lambda face: identified.append(face['id']))
+                    for i in range(4)]
+        assert all(tracker.detector is pool.detector for tracker in trackers)
+        assert pool.wait(60)
+        # every frame of every stream, one face each
+        assert processed == {'camera {}'.format(i): 10 for i in range(4)}
+        assert all(stats['dropped'] == 0 for stats in pool.stats().values())
+        assert pool._batcher.ncodes >= 4
+    finally:
+        pool.stop()
+        facedb.close()
+
+    # every track identified as the same new face
+    assert len(set(identified)) == 4
+    assert len(facedb.persons()) == 1
+
+
+def test_remove_stream(tmpdb):
+    img = cv2.imread(os.path.join(here, 'data', "Tobias_Schoch_TOS_big (Large).jpg"))
+    processed = collections.Counter()
+
+    def on_frame(name, frame, faces):
+        processed[name] += 1
+
+    pool = FaceTrackerPool(max_workers=1)
+    try:
+        for i in range(3):
+            pool.add_stream('camera {}'.format(i), ImageCapture(img, 50), frame_callback=on_frame)
+        pool.remove_stream('camera 1')
+        nprocessed = processed['camera 1']
+        # the removed stream is neither waiting nor processed any more
+        assert all(stream.name != 'camera 1' for stream in pool._ready)
+        assert pool.wait(120)
+        assert processed['camera 1'] == nprocessed
+        assert pool.streams() == ['camera 0', 'camera 2']
+    finally:
+        pool.stop()
+        facedb.close()